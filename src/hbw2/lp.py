@@ -25,8 +25,9 @@ class LinearProgram :
  
         def copy( self ) :
                 from copy         import deepcopy
+                from model.generic.hybrid.secondary         import copy_model
                 new_lp = LinearProgram( )
-                new_lp.model = self.model.copy()
+                new_lp.model = copy_model( self.model )
                 new_lp.constraints = []
                 new_lp.goal_constraints = set()
                 for index, ext_constraint in enumerate(self.constraints) :
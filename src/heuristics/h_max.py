@@ -1,66 +1,70 @@
 from .heuristic_base                 import        Heuristic
-from .simple_rpg                        import  RelaxedPlanningGraph 
+from .simple_rpg                        import  RelaxedPlanningGraph
+
+import heapq
 
 xrange = range
 
 class H_Max( Heuristic ) :
+        """
+        h_max, computed by generalized Dijkstra over facts: each action
+        keeps a counter of its preconditions not yet settled, and when it
+        reaches zero the effects of the action are queued with the cost
+        of its precondition plus the cost of the action. Facts are
+        settled in order of cost, one cost level at a time, and the
+        relaxed state holds the facts settled so far. Secondary
+        preconditions (and, if RelaxedPlanningGraph.meticulous is set,
+        the invariant constraints with the primary precondition and
+        postcondition) are checked on this state at the end of a level,
+        and again at the next levels while they fail.
+        """
+
+        additive = False
 
         def __init__( self, the_task ) :
                 self.name = 'h_{max}'
                 self.task = the_task
-                # self.all_actions is an enumerable set of indices
-                # into self.task.actions[]
-                self.all_actions = frozenset( [ i for i in xrange( len( self.task.actions ) ) ] )
+                self.actions_version = None
 
+        def prepare( self, num_literals ) :
+                if self.actions_version == self.task.actions_version :
+                        return
+                self.actions_version = self.task.actions_version
+                actions = self.task.actions
+                self.precs = [ action.compiled_precs.literals for action in actions ]
+                self.adds = [ action.compiled_effect.literals for action in actions ]
+                self.costs = [ action.cost for action in actions ]
+                self.no_precs = [ idx for idx in xrange( len(actions) ) if len(self.precs[idx]) == 0 ]
+                self.prec_of = [ [] for k in xrange( num_literals ) ]
+                for idx, precs in enumerate( self.precs ) :
+                        for offset in precs :
+                                self.prec_of[offset].append( idx )
+                self.goal = frozenset( self.task.compiled_Gp.literals )
 
-        def goal_reached( self, s ) :
-                if not s.possible( self.task.Gp ) :
+        def needs_check( self, action ) :
+                return len( action.sec_precs ) != 0 or RelaxedPlanningGraph.meticulous
+
+        def check( self, action ) :
+                if not self.task.check_secondary_precondition( self.rp_state, action ) :
                         return False
-                if self.task.Gs is not None:
-                        result = self.task.check_secondary_goal( s )
-                        return result
+                if RelaxedPlanningGraph.meticulous :
+                        if not self.task.check_postcondition_validity( self.rp_state, action ) :
+                                return False
                 return True
 
+        def secondary_goal_holds( self ) :
+                if self.task.Gs is not None :
+                        return self.task.check_secondary_goal( self.rp_state )
+                return True
 
-        def enqueue( self, action, acc_cost ):
-                p = 0
-                while p < len(self.queue):
-                        (a, c) = self.queue[p]
-                        if c <= acc_cost:
-                                p += 1
-                        else:
-                                self.queue.insert( p, (action, acc_cost) )
-                                return
-                self.queue.append( (action, acc_cost) )
-
-
-        def check_and_enqueue( self, pre_cost ):
-                for idx in self.all_actions :
-                        if not self.available[idx] :
-                                continue
-                        action = self.task.actions[idx]
-                        if not self.rp_state.possible( action.prim_precs ) :
-                                continue
-                        if (len( action.sec_precs ) != 0):
-                                if not self.task.check_secondary_precondition( self.rp_state, action ) :
-                                        continue
-                        self.available[idx] = False
-                        self.enqueue( idx, pre_cost + action.cost )
-
-
-        def dequeue_to_cost( self, cost ):
-                changed = False
-                while len(self.queue) > 0 :
-                        (act_idx, act_cost) = self.queue[0]
-                        if act_cost > cost:
-                                return changed
-                        for X, v in self.task.actions[act_idx].effect :
-                                if not self.rp_state.possible( [ (X, v) ] ) :
-                                        self.rp_state.relaxed_set( X, v )
-                                        changed = True
-                        self.queue.pop(0)
-                return changed
-
+        # queues the effects of the action, with the cost of its
+        # precondition
+        def relax( self, idx, pre_cost ) :
+                c = pre_cost + self.costs[idx]
+                for offset in self.adds[idx] :
+                        if c < self.cost[offset] :
+                                self.cost[offset] = c
+                                heapq.heappush( self.queue, ( c, offset ) )
 
         def __call__( self, node ) :
                 node.preferred_ops = [ ]
@@ -70,24 +74,89 @@ class H_Max( Heuristic ) :
                 except AttributeError:
                         self.rp_state = node.state.copy()
                 # from here on, rp_state is a relaxed, primary state.
-                if self.goal_reached( self.rp_state ):
-                        node.h = 0
-                        return 0
+                self.rp_state.relaxed = True
+                num_literals = self.rp_state.num_literals()
+                self.prepare( num_literals )
+                INF = float('inf')
+                self.cost = [ INF ] * num_literals
+                settled = bytearray( num_literals )
+                num_settled = 0
                 self.queue = []
-                self.available = [ True for idx in self.all_actions ]
-                if True in self.available:
-                        self.check_and_enqueue( 0 )
-                h_value = 0
-                while len(self.queue) > 0:
-                        changed = self.dequeue_to_cost( h_value )
-                        if changed :
-                                if self.goal_reached( self.rp_state ):
-                                        node.h = h_value                
-                                        return h_value
-                                if True in self.available:
-                                        self.check_and_enqueue( h_value )
-                        if len(self.queue) > 0:
-                                (act, cost) = self.queue[0]
-                                h_value = cost
+                for offset in xrange( num_literals ) :
+                        if self.rp_state.holds( offset ) :
+                                self.cost[offset] = 0
+                                self.queue.append( ( 0, offset ) )
+                unsettled = [ len(precs) for precs in self.precs ]
+                pre_cost = [ 0 ] * len(self.precs) # max or sum over the settled preconditions
+                pending = list( self.no_precs ) # actions to check at the end of the level
+                blocked = [] # actions that failed the check
+                blocked_stamp = 0
+                goal_left = len(self.goal)
+                goal_cost = 0
+                goal_stamp = None
+                actions = self.task.actions
+                level = 0
+                while True :
+                        if len(self.queue) > 0 and self.queue[0][0] <= level :
+                                c, offset = heapq.heappop( self.queue )
+                                if settled[offset] : continue
+                                settled[offset] = 1
+                                num_settled += 1
+                                self.rp_state.relaxed_set_literal( offset )
+                                if self.additive :
+                                        for idx in self.prec_of[offset] :
+                                                pre_cost[idx] += c
+                                                unsettled[idx] -= 1
+                                                if unsettled[idx] == 0 :
+                                                        pending.append( idx )
+                                else :
+                                        for idx in self.prec_of[offset] :
+                                                unsettled[idx] -= 1
+                                                if unsettled[idx] == 0 :
+                                                        pre_cost[idx] = c
+                                                        pending.append( idx )
+                                if offset in self.goal :
+                                        goal_left -= 1
+                                        goal_cost = goal_cost + c if self.additive else c
+                                continue
+                        # all facts with cost up to level are settled
+                        if goal_left == 0 and goal_stamp != num_settled :
+                                goal_stamp = num_settled
+                                if self.secondary_goal_holds() :
+                                        h = max( goal_cost, level )
+                                        node.h = h
+                                        return h
+                        checked = []
+                        for idx in pending :
+                                if self.needs_check( actions[idx] ) :
+                                        checked.append( idx )
+                                else :
+                                        self.relax( idx, pre_cost[idx] )
+                        pending = []
+                        if len(blocked) > 0 and blocked_stamp != num_settled :
+                                checked += blocked
+                                blocked = []
+                        blocked_stamp = num_settled
+                        for idx in checked :
+                                if self.check( actions[idx] ) :
+                                        self.relax( idx, max( pre_cost[idx], level ) )
+                                else :
+                                        blocked.append( idx )
+                        if len(self.queue) == 0 :
+                                break
+                        level = max( level, self.queue[0][0] )
                 node.h = float('inf')
                 return float('inf')
+
+class H_Add( H_Max ) :
+        """
+        h_add, computed as h_max but with the cost of a precondition
+        taken as the sum, rather than the maximum, of the costs of its
+        facts.
+        """
+
+        additive = True
+
+        def __init__( self, the_task ) :
+                H_Max.__init__( self, the_task )
+                self.name = 'h_{add}'
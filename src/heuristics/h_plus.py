@@ -1,5 +1,6 @@
 from .heuristic_base                                import        Heuristic
-from .simple_rpg                                        import        RelaxedPlanningGraph
+from .simple_rpg                                        import        IncrementalRPG
+from .hitting_set                                        import        HittingSetSolver
 
 import sys
 
@@ -55,6 +56,17 @@ class H_Plus( Heuristic ) :
                 self.compute_pref_ops = False
                 self.emulate_lm_cut = False
                 self.no_change_threshold = None
+                ## hitting sets are found with the MIP solver ('mip') or
+                ## with the built-in branch and bound ('bnb'); pulp runs
+                ## CBC in a subprocess for every call, so with pulp the
+                ## built-in solver is the default
+                self.hitting_set_solver = 'bnb' if self._use_pulp else 'mip'
+                ## the RPG builder and the hitting set model are built
+                ## once, and again only if the task's actions change
+                self.actions_version = None
+                self.rpg_builder = None
+                self.base_model = None
+                self.curr_model = None
 
         def print_statistics( self ) :
                 logging.info( 'h+ heuristic: Total time: {0}'.format( self.total_time ) )
@@ -66,24 +78,53 @@ class H_Plus( Heuristic ) :
                 logging.info( '# of landmarks: {0}'.format( self.n_landmarks ) )
                 logging.info( '# of RPG calls: {0}'.format( self.n_rpg_tests ) )
                 if self.n_rpg_tests > 0:
-                        logging.info( 'avg. RPG depth: {0}'.format( float(self.sum_rpg_size) / float(self.n_rpg_tests) ) )
+                        logging.info( 'avg. # of reachable actions: {0}'.format( float(self.sum_rpg_size) / float(self.n_rpg_tests) ) )
+                if self.hitting_set_solver == 'bnb' and self.base_model is not None :
+                        self.base_model.print_statistics()
 
 
+        # Removes the landmark constraints of the previous evaluation
+        # from the hitting set model. With gurobi, the model is kept; with
+        # pulp, a new problem is made that shares the variables and the
+        # objective of the base model.
         def reset( self ) :
-                self.rpg_builder.reset()
+                self.rpg_builder.goal_reached_time = 0
+                self.rpg_builder.add_next_layer_time = 0
                 self.L = []
                 self.A = set()
                 self.lb = 0
-                if self.curr_model is not None :
-                        del self.curr_model
-                self.curr_model = self.base_model.copy()
+                if self.hitting_set_solver == 'bnb' :
+                        self.base_model.reset()
+                elif self._use_pulp:
+                        self.curr_model = pulp.LpProblem( "min-cost-hitting-set", pulp.LpMinimize )
+                        self.curr_model.setObjective( self.hs_objective )
+                else:
+                        if len(self.lm_constrs) > 0 :
+                                for constr in self.lm_constrs :
+                                        self.curr_model.remove( constr )
+                                self.lm_constrs = []
+                                self.curr_model.update()
+
+        def __prepare( self ) :
+                if self.actions_version == self.task.actions_version :
+                        return
+                self.actions_version = self.task.actions_version
+                self.all_actions = frozenset( [ i for i in xrange( len(self.task.actions) ) ] )
+                self.rpg_builder = IncrementalRPG( self.task )
+                self.__build_base_model_for_hitting_set()
 
         def __build_base_model_for_hitting_set( self ) :
+                if self.hitting_set_solver == 'bnb' :
+                        self.base_model = HittingSetSolver( [ a.cost for a in self.task.actions ] )
+                        return
                 if self._use_pulp:
-                        self.base_model = pulp.LpProblem( "min-cost-hitting-set", pulp.LpMinimize )
+                        self.base_model = None
                 else:
-                        self.base_model = Model( "min-cost-hitting-set" )
+                        from model.generic.hybrid.secondary import gurobi_env
+                        self.base_model = Model( "min-cost-hitting-set", env = gurobi_env() )
                         self.base_model.setParam( "OutputFlag", 0 )
+                        self.curr_model = self.base_model
+                        self.lm_constrs = []
                 
                 # variables -> one per action
                 self.hs_vars = []
@@ -100,10 +141,7 @@ class H_Plus( Heuristic ) :
 
                 # objective functions
                 if self._use_pulp:
-                        obj = 0
-                        for var in self.hs_vars:
-                                obj = (self.hs_coeffs[var.getName()] * var) + obj
-                        self.base_model.setObjective(obj)
+                        self.hs_objective = pulp.lpSum( [ self.hs_coeffs[var.getName()] * var for var in self.hs_vars ] )
                 else:
                         # MRJ: Support for non-unit costs, makes heuristic admissible if there are action costs
                         self.base_model.setObjective( quicksum( self.hs_coeffs[a.getAttr('VarName')] * a for a in self.hs_vars ), GRB.MINIMIZE )
@@ -113,37 +151,44 @@ class H_Plus( Heuristic ) :
 
         def __update_hitting_set_model( self, disj_landmark ) :
                 #logging.debug( 'New constraint {0}'.format( disj_landmark ) )
-                if self._use_pulp:
-                        constr = (sum([self.hs_vars[index] for index in disj_landmark]) >= 1)
+                if self.hitting_set_solver == 'bnb' :
+                        self.base_model.add( disj_landmark )
+                elif self._use_pulp:
+                        constr = (pulp.lpSum([self.hs_vars[index] for index in disj_landmark]) >= 1)
                         self.curr_model.addConstraint( constr )
                 else:
-                        self.curr_model.addConstr( quicksum( self.curr_model.getVars()[index] for index in disj_landmark ) >= 1 )
+                        self.lm_constrs.append( self.curr_model.addConstr( quicksum( self.hs_vars[index] for index in disj_landmark ) >= 1 ) )
 
 
+        # Adds the candidate actions one at a time to the reachability
+        # fixpoint for A, undoing each addition that makes the goal
+        # reachable: the actions not added form a landmark.
         def __new_landmark( self, s, A ) :
                 self.n_landmarks += 1
                 candidates = self.all_actions - A
                 passed = A.copy()
                 goal_reached = self.__is_goal_reachable( s, passed )
                 assert goal_reached is False
-                prev_last_layer = self.rpg_builder.f_layers[-1].copy()        
                 #print( '# Candidates:  {0} Passed: {1}'.format( len(candidates), len(passed) ) )        
+                t0 = TIMER_FUN()
                 for idx in candidates :
-                        if prev_last_layer.possible( self.task.actions[idx].prim_precs ) :
-                                passed.add(idx)
-                                goal_reached = self.__is_goal_reachable( s, passed )
-                                if goal_reached :
-                                        passed.remove(idx)
-                                        continue
-                                prev_last_layer = self.rpg_builder.f_layers[-1].copy()
-                        else :
-                                passed.add(idx)
+                        self.rpg_builder.add( [ idx ] )
+                        if self.rpg_builder.goal_reached() :
+                                self.rpg_builder.undo()
+                                continue
+                        passed.add(idx)
+                self.reachability_time += TIMER_FUN() - t0
 
                 n = self.all_actions - passed
                 return n
 
         def __min_cost_hitting_set( self ) :
                 t0 = TIMER_FUN()
+                if self.hitting_set_solver == 'bnb' :
+                        self.A, self.lb = self.base_model.solve()
+                        assert len(self.A) > 0
+                        self.hitting_set_time += TIMER_FUN() - t0
+                        return
                 if self._use_pulp:
                         #print(self.curr_model)
                         status = self.curr_model.solve()
@@ -163,15 +208,13 @@ class H_Plus( Heuristic ) :
                                 else:
                                         assert pulp.value(var) is None or pulp.value(var) == 0.0, str(pulp.value(var))
                 else:
-                        curr_vars = self.curr_model.getVars()
+                        curr_vars = self.hs_vars
                         for index in xrange( len(curr_vars) ) :
-                                if curr_vars[index].x :
+                                if curr_vars[index].x > 0.5 :
                                         self.A.add( index )
                                         self.lb += self.task.actions[index].cost
                 #logging.debug( 'Length of relaxed plan: {0}'.format( len(self.A) ) )
                 assert len(self.A) > 0
-                if not self._use_pulp:
-                        self.curr_model.reset()
                 tf = TIMER_FUN()
                 self.hitting_set_time += (tf - t0 )
 
@@ -263,6 +306,10 @@ class H_Plus( Heuristic ) :
                 i = 1
                 last_rp_cost = 0
                 its_with_no_change = 0
+                if len(self.L) > 0 :
+                        # start from a hitting set of the inherited landmarks
+                        self.__min_cost_hitting_set()
+                        last_rp_cost = self.__compute_cost( self.A )
                 self.A |= self.zero_cost_actions
                 while not self.__is_goal_reachable( node.state, self.A ) :
                         #logging.debug( 'Basic Iterative Landmark Algorithm: iteration #{0}: , |L|={1}, |A|={2}, lb = {3}'.format(i, len(self.L), len(self.A), self.lb) )
@@ -298,29 +345,24 @@ class H_Plus( Heuristic ) :
 
         def __is_goal_reachable( self, s, A ) :
                 t0 = TIMER_FUN()
-                self.rpg_builder.reset()
-                self.rpg_builder.set_available_actions( A )
-                res = self.rpg_builder.build_graph( s )
+                self.rpg_builder.initialize( s, A )
+                res = self.rpg_builder.goal_reached()
                 tf = TIMER_FUN()
                 self.reachability_time += tf - t0
                 self.n_rpg_tests += 1;
-                self.sum_rpg_size += len(self.rpg_builder.f_layers);
+                self.sum_rpg_size += self.rpg_builder.num_reached_actions();
                 return res
 
         def evaluate( self, node ) :
                 self.n_calls += 1
-                self.all_actions = frozenset( [ i for i in xrange( len(self.task.actions) ) ] )
-                self.rpg_builder = RelaxedPlanningGraph( self.task )
-                self.base_model = None
-                self.curr_model = None
-                self.__build_base_model_for_hitting_set()
-
+                self.__prepare()
                 self.reset()
-                try :
-                        L_parent = node.parent.landmarks
-                        self.L = [ l for l in L_parent if node.action.index not in l ]
-                except AttributeError :
-                        pass
+                # landmarks of the parent that don't contain the action
+                # applied are landmarks of this state too
+                if node.parent is not None and node.parent.landmarks is not None :
+                        self.L = [ l for l in node.parent.landmarks if node.action.index not in l ]
+                        for landmark in self.L :
+                                self.__update_hitting_set_model( landmark )
                 dead_end = self.__basic_algorithm( node )
                 #dead_end = self.__improved_algorithm( node )
                 #self.__improved_algorithm( node )
@@ -0,0 +1,166 @@
+from         __future__         import         print_function
+
+import logging
+
+xrange = range
+
+class HittingSetSolver :
+        """
+        Exact minimum-cost hitting set solver, by depth-first branch and
+        bound. The incumbent is the better of the weighted Chvatal greedy
+        hitting set and the previous optimal solution extended with the
+        cheapest action of each landmark it doesn't hit. The lower bound
+        at each node is a greedy cost partitioning over the landmarks not
+        yet hit: each landmark takes the minimum cost left on its actions,
+        which is subtracted from all of them. This is a feasible solution
+        of the dual of the LP relaxation, and is never weaker than the
+        disjoint-landmarks bound. Landmarks are added one at a time: the
+        optimal cost before a landmark is added is a lower bound after,
+        and if the previous solution hits the new landmark it is still
+        optimal.
+        """
+
+        def __init__( self, costs ) :
+                self.costs = list( costs )
+                self.hit_by = [ [] for c in self.costs ] # action -> landmarks it hits
+                self.landmarks = []
+                self.solution = set()
+                self.cost = 0
+                self.solved = True
+                # statistics
+                self.num_solves = 0
+                self.num_nodes = 0
+                self.num_still_optimal = 0
+                self.num_greedy_optimal = 0
+
+        def reset( self ) :
+                for landmark in self.landmarks :
+                        for a in landmark :
+                                self.hit_by[a] = []
+                self.landmarks = []
+                self.solution = set()
+                self.cost = 0
+                self.solved = True
+
+        def add( self, landmark ) :
+                j = len(self.landmarks)
+                landmark = sorted( landmark, key = lambda a : self.costs[a] )
+                self.landmarks.append( landmark )
+                for a in landmark :
+                        self.hit_by[a].append( j )
+                if self.solved and self.solution.isdisjoint( landmark ) :
+                        self.solved = False
+
+        # Returns a minimum cost hitting set of the landmarks added since
+        # the last reset, and its cost.
+        def solve( self ) :
+                self.num_solves += 1
+                if self.solved :
+                        self.num_still_optimal += 1
+                        return set( self.solution ), self.cost
+                lb = self.cost # optimal cost for a subset of the landmarks
+                self.best, self.best_cost = self.incumbent()
+                if self.best_cost > lb + 1e-9 :
+                        self.lb = lb
+                        hits = [ 0 ] * len(self.landmarks)
+                        self.branch( [], 0, hits, set() )
+                else :
+                        self.num_greedy_optimal += 1
+                self.solution = set( self.best )
+                self.cost = self.best_cost
+                self.solved = True
+                return set( self.solution ), self.cost
+
+        def incumbent( self ) :
+                # previous solution, extended
+                H_a = set( self.solution )
+                for landmark in self.landmarks :
+                        if H_a.isdisjoint( landmark ) :
+                                H_a.add( landmark[0] )
+                H_b = self.chvatal()
+                cost_H_a = sum( self.costs[a] for a in H_a )
+                cost_H_b = sum( self.costs[a] for a in H_b )
+                if cost_H_a > cost_H_b :
+                        return H_b, cost_H_b
+                return H_a, cost_H_a
+
+        # Weighted Chvatal greedy: repeatedly pick the action with the
+        # lowest cost per landmark hit that isn't hit yet.
+        def chvatal( self ) :
+                H = set()
+                unhit = set( xrange( len(self.landmarks) ) )
+                while len(unhit) > 0 :
+                        best_a, best_ratio = None, None
+                        for j in unhit :
+                                for a in self.landmarks[j] :
+                                        if a in H : continue
+                                        n = sum( 1 for k in self.hit_by[a] if k in unhit )
+                                        ratio = self.costs[a] / float(n)
+                                        if best_ratio is None or ratio < best_ratio :
+                                                best_a, best_ratio = a, ratio
+                        H.add( best_a )
+                        unhit.difference_update( self.hit_by[best_a] )
+                return H
+
+        # Lower bound on the cost of hitting the landmarks not hit yet,
+        # without the excluded actions. Returns None if some landmark can
+        # no longer be hit, and otherwise the bound and the unhit landmark
+        # with the fewest actions left.
+        def bound( self, hits, excluded ) :
+                residual = {}
+                h = 0
+                branch_on, branch_size = None, None
+                for j, landmark in enumerate( self.landmarks ) :
+                        if hits[j] > 0 : continue
+                        d = None
+                        size = 0
+                        for a in landmark :
+                                if a in excluded : continue
+                                size += 1
+                                r = residual.get( a, self.costs[a] )
+                                if d is None or r < d :
+                                        d = r
+                        if d is None :
+                                return None
+                        if branch_on is None or size < branch_size :
+                                branch_on, branch_size = j, size
+                        if d > 0 :
+                                h += d
+                                for a in landmark :
+                                        if a in excluded : continue
+                                        residual[a] = residual.get( a, self.costs[a] ) - d
+                return h, branch_on
+
+        def branch( self, chosen, g, hits, excluded ) :
+                self.num_nodes += 1
+                res = self.bound( hits, excluded )
+                if res is None : return False
+                h, j = res
+                if j is None :
+                        # all landmarks hit
+                        if g < self.best_cost - 1e-9 :
+                                self.best = set( chosen )
+                                self.best_cost = g
+                        return self.best_cost <= self.lb + 1e-9
+                if g + h >= self.best_cost - 1e-9 :
+                        return False
+                # branch on the actions of the landmark: the i-th branch
+                # takes the i-th action and excludes the ones before it
+                newly_excluded = []
+                stop = False
+                for a in self.landmarks[j] :
+                        if a in excluded : continue
+                        chosen.append( a )
+                        for k in self.hit_by[a] : hits[k] += 1
+                        stop = self.branch( chosen, g + self.costs[a], hits, excluded )
+                        for k in self.hit_by[a] : hits[k] -= 1
+                        chosen.pop()
+                        if stop : break
+                        excluded.add( a )
+                        newly_excluded.append( a )
+                excluded.difference_update( newly_excluded )
+                return stop
+
+        def print_statistics( self ) :
+                logging.info( 'Hitting Set B&B: # Solved: {0} # Still Optimal: {1} # Greedy Optimal: {2} # Nodes: {3}'.format( self.num_solves, self.num_still_optimal, self.num_greedy_optimal, self.num_nodes ) )
+
@@ -0,0 +1,247 @@
+from .heuristic_base                 import        Heuristic
+from .simple_rpg                        import  IncrementalRPG, RelaxedPlanningGraph
+
+import heapq
+import logging
+import time
+
+#TIMER_FUN = time.clock
+TIMER_FUN = time.time
+
+xrange = range
+
+class H_LMCut( Heuristic ) :
+        """
+        The LM-cut heuristic: repeatedly computes h_max, finds a cut of
+        actions that separates the state from the goal in the
+        justification graph (each action linked from its most costly
+        precondition), adds the cheapest cost in the cut to h and takes
+        it off the cost of all the actions in the cut, until h_max of
+        the goal is zero.
+
+        The relaxation is that of RelaxedPlanningGraph: the reachability
+        fixpoint of the state, with secondary preconditions checked, is
+        computed first (by IncrementalRPG). If it doesn't reach the goal,
+        the state is a dead end; otherwise, the cuts are found among the
+        actions it reaches. Since reachability is monotone, no action
+        left out can be in a relaxed plan, so h is a lower bound on the
+        cost of one, i.e., on h+.
+
+        The secondary goal is taken into account through a disjunctive
+        fact landmark: the facts of the fixpoint are ordered by h_max,
+        and the shortest prefix on which the secondary goal holds is
+        found by bisection. The goal doesn't hold on the prefix without
+        its last fact, so any relaxed plan must reach one of the facts
+        from there on; an artificial fact, achieved at zero cost by any
+        of them, is added to the precondition of the goal.
+        """
+
+        def __init__( self, the_task ) :
+                self.name = 'h_{lmcut}'
+                self.task = the_task
+                self.actions_version = None
+                ## following variables control how the function behaves
+                self.compute_pref_ops = False
+                ## statistics
+                self.n_calls = 0
+                self.n_cuts = 0
+                self.n_dead_ends = 0
+                self.total_time = 0
+                self.reachability_time = 0
+
+        def print_statistics( self ) :
+                logging.info( 'LM-cut heuristic: Total time: {0}'.format( self.total_time ) )
+                logging.info( 'LM-cut heuristic: Reachability time: {0}'.format( self.reachability_time ) )
+                logging.info( '{0} calls to LM-cut, {1} dead ends'.format( self.n_calls, self.n_dead_ends ) )
+                if self.n_calls > self.n_dead_ends :
+                        logging.info( 'avg. # of cuts: {0}'.format( float(self.n_cuts) / float(self.n_calls - self.n_dead_ends) ) )
+
+        # Facts are literal offsets, plus three artificial facts: INIT,
+        # the precondition of actions that have none, GOAL, the effect
+        # of an artificial goal action whose precondition is the primary
+        # goal, and SEC_GOAL, the secondary goal landmark. The actions
+        # that achieve SEC_GOAL are added after the goal action, for
+        # each evaluation.
+        def prepare( self, num_literals ) :
+                if self.actions_version == self.task.actions_version :
+                        return
+                self.actions_version = self.task.actions_version
+                self.rpg = IncrementalRPG( self.task )
+                self.INIT = num_literals
+                self.GOAL = num_literals + 1
+                self.SEC_GOAL = num_literals + 2
+                self.num_facts = num_literals + 3
+                self.goal_action = len(self.task.actions)
+                self.precs = [ list( action.compiled_precs.literals ) for action in self.task.actions ]
+                self.precs.append( list( self.task.compiled_Gp.literals ) )
+                for precs in self.precs :
+                        if len(precs) == 0 :
+                                precs.append( self.INIT )
+                self.adds = [ list( action.compiled_effect.literals ) for action in self.task.actions ]
+                self.adds.append( [ self.GOAL ] )
+                self.base_costs = [ action.cost for action in self.task.actions ] + [ 0 ]
+                self.prec_of = [ [] for f in xrange( self.num_facts ) ]
+                self.add_of = [ [] for f in xrange( self.num_facts ) ]
+                for idx in xrange( len(self.precs) ) :
+                        for p in self.precs[idx] :
+                                self.prec_of[p].append( idx )
+                        for e in self.adds[idx] :
+                                self.add_of[e].append( idx )
+
+        # Computes h_max of all facts with the current costs, and the
+        # most costly precondition (pcf) of every action reached.
+        def compute_hmax( self ) :
+                INF = float('inf')
+                self.hmax = hmax = [ INF ] * self.num_facts
+                self.pcf = pcf = [ None ] * len(self.precs)
+                unreached = [ len(precs) for precs in self.precs ]
+                costs = self.costs
+                usable = self.usable
+                queue = []
+                for f in self.init_facts :
+                        hmax[f] = 0
+                        queue.append( ( 0, f ) )
+                while len(queue) > 0 :
+                        c, f = heapq.heappop( queue )
+                        if c > hmax[f] : continue
+                        for idx in self.prec_of[f] :
+                                if not usable[idx] : continue
+                                unreached[idx] -= 1
+                                if unreached[idx] > 0 : continue
+                                pcf[idx] = f
+                                c_eff = c + costs[idx]
+                                for e in self.adds[idx] :
+                                        if c_eff < hmax[e] :
+                                                hmax[e] = c_eff
+                                                heapq.heappush( queue, ( c_eff, e ) )
+                return hmax[self.GOAL]
+
+        # Returns the actions of the cut between the facts reachable
+        # from the state and the goal zone (the facts from which the
+        # goal can be reached at zero cost) in the justification graph.
+        def find_cut( self ) :
+                pcf = self.pcf
+                costs = self.costs
+                usable = self.usable
+                goal_zone = bytearray( self.num_facts )
+                goal_zone[self.GOAL] = 1
+                stack = [ self.GOAL ]
+                while len(stack) > 0 :
+                        g = stack.pop()
+                        for idx in self.add_of[g] :
+                                if not usable[idx] or costs[idx] > 0 : continue
+                                p = pcf[idx]
+                                if p is not None and not goal_zone[p] :
+                                        goal_zone[p] = 1
+                                        stack.append( p )
+                cut = set()
+                visited = bytearray( self.num_facts )
+                stack = []
+                for f in self.init_facts :
+                        visited[f] = 1
+                        stack.append( f )
+                while len(stack) > 0 :
+                        f = stack.pop()
+                        for idx in self.prec_of[f] :
+                                if pcf[idx] != f or not usable[idx] : continue
+                                for e in self.adds[idx] :
+                                        if goal_zone[e] :
+                                                cut.add( idx )
+                                        elif not visited[e] :
+                                                visited[e] = 1
+                                                stack.append( e )
+                return cut
+
+        def add_secondary_goal_landmark( self, primary ) :
+                self.landmark = []
+                if self.task.Gs is None and not RelaxedPlanningGraph.meticulous :
+                        return
+                self.compute_hmax()
+                hmax = self.hmax
+                order = [ f for f in self.rpg.reached_trail if hmax[f] > 0 ]
+                order.sort( key = lambda f : hmax[f] )
+                # the secondary goal holds on the prefix of length hi,
+                # and doesn't on that of length lo - 1
+                lo, hi = 0, len(order)
+                while lo < hi :
+                        k = ( lo + hi ) // 2
+                        s = primary.copy()
+                        s.relaxed = True
+                        for f in order[:k] :
+                                s.relaxed_set_literal( f )
+                        if self.task.check_secondary_goal( s ) :
+                                hi = k
+                        else :
+                                lo = k + 1
+                if hi == 0 :
+                        return
+                self.landmark = order[hi-1:]
+                for f in self.landmark :
+                        idx = len(self.precs)
+                        self.precs.append( [ f ] )
+                        self.adds.append( [ self.SEC_GOAL ] )
+                        self.prec_of[f].append( idx )
+                        self.add_of[self.SEC_GOAL].append( idx )
+                self.costs += [ 0 ] * len(self.landmark)
+                self.usable += bytearray( [ 1 ] ) * len(self.landmark)
+                self.precs[self.goal_action].append( self.SEC_GOAL )
+                self.prec_of[self.SEC_GOAL].append( self.goal_action )
+
+        def remove_secondary_goal_landmark( self ) :
+                if len(self.landmark) == 0 :
+                        return
+                for f in self.landmark :
+                        self.prec_of[f].pop()
+                self.add_of[self.SEC_GOAL] = []
+                self.prec_of[self.SEC_GOAL] = []
+                self.precs[self.goal_action].pop()
+                del self.precs[self.goal_action+1:]
+                del self.adds[self.goal_action+1:]
+
+        def evaluate( self, node ) :
+                self.n_calls += 1
+                t0 = TIMER_FUN()
+                try :
+                        primary = node.state.primary
+                except AttributeError :
+                        primary = node.state
+                num_literals = primary.num_literals()
+                self.prepare( num_literals )
+                node.preferred_ops = []
+                node.preferred_ops_counter = 0
+                t1 = TIMER_FUN()
+                self.rpg.initialize( node.state, xrange( len(self.task.actions) ) )
+                goal_reached = self.rpg.goal_reached()
+                self.reachability_time += TIMER_FUN() - t1
+                if not goal_reached :
+                        self.n_dead_ends += 1
+                        node.h = float('inf')
+                        self.total_time += TIMER_FUN() - t0
+                        return node.h
+                self.usable = bytearray( len(self.precs) )
+                for idx in self.rpg.fired_trail :
+                        self.usable[idx] = 1
+                self.usable[self.goal_action] = 1
+                self.costs = list( self.base_costs )
+                self.init_facts = [ f for f in xrange( num_literals ) if primary.holds( f ) ]
+                self.init_facts.append( self.INIT )
+                self.add_secondary_goal_landmark( primary )
+                h = 0
+                in_cuts = set()
+                while self.compute_hmax() > 0 :
+                        cut = self.find_cut()
+                        m = min( [ self.costs[idx] for idx in cut ] )
+                        for idx in cut :
+                                self.costs[idx] -= m
+                        h += m
+                        in_cuts |= cut
+                        self.n_cuts += 1
+                self.remove_secondary_goal_landmark()
+                node.h = h
+                if self.compute_pref_ops :
+                        node.preferred_ops = [ self.task.actions[idx] for idx in in_cuts if idx < self.goal_action and self.task.is_applicable( node.state, self.task.actions[idx] ) ]
+                self.total_time += TIMER_FUN() - t0
+                return h
+
+        def __call__( self, node ) :
+                return self.evaluate( node )
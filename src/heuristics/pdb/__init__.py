@@ -53,13 +53,13 @@ class Canonical_Heuristic_Function ( Heuristic ) :
                                         a_k = None
                                         if action_index is not None :
                                                 a_k = self.task.actions[action_index]
-                                                if  state.satisfies(a_k.prim_precs ) :
+                                                if  state.satisfies_compiled( a_k.compiled_precs ) :
                                                         actions.append( a_k )
                         if h == float('inf') :
                                 return float('inf'), []
                         components.append( ( h, actions ) )
                 
-                return  max( components )
+                return  max( components, key = lambda c : c[0] )
 
         def __call__( self, node ) :
                 node.h = 0
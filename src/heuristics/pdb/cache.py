@@ -0,0 +1,131 @@
+"""
+On-disk store of pattern databases.
+
+A table is stored under a key that is a hash of everything its entries
+depend on: the pattern variables (with their indices in the original
+task, and their domains), the projected actions (with the indices of the
+original actions they come from, since these are the first actions kept
+in the table), their costs, the goals, and the switched constraints of
+the secondary model. The file holds a fixed size header followed by the
+h values (float64) and the first actions (int64), and is memory-mapped
+when loaded, so the table is not read until it is used.
+"""
+from         __future__                import print_function
+
+import         hashlib
+import         logging
+import         mmap
+import         os
+import         struct
+import         tempfile
+
+class TableCache :
+        """
+        Loads and stores the tables of patterns in the directory
+        DIRECTORY (None disables the store; the default is taken from
+        the environment variable PDB_CACHE_DIR). Entries are written to
+        a temporary file and renamed, so several processes can share
+        the directory.
+        """
+
+        DIRECTORY = os.environ.get( 'PDB_CACHE_DIR' )
+
+        MAGIC = b'GSCPDB01'
+        # magic, # of entries, # of unsolvable entries, # of non zero
+        # entries, max value
+        HEADER = struct.Struct( '<8sqqqd' )
+
+        hits = 0
+        misses = 0
+
+        # Returns the key of the table of the projected task.
+        @staticmethod
+        def fingerprint( table, projected_task, vars_maps, actions_maps ) :
+                var_map, inv_var_map = vars_maps
+                action_map, inv_action_map = actions_maps
+                digest = hashlib.sha1()
+                def add( item ) :
+                        digest.update( repr( item ).encode( 'utf-8' ) )
+                        digest.update( b'\n' )
+                add( TableCache.MAGIC )
+                add( table.pattern_vars )
+                for x in projected_task.task.state_vars :
+                        add( ( x.name, list( x.domain ) ) )
+                for index, action in enumerate( projected_task.actions ) :
+                        add( ( inv_action_map[index], action.name, sorted( action.prim_precs ), sorted( action.sec_precs ), sorted( action.effect ), action.cost, action.conditional_costs ) )
+                add( sorted( projected_task.Gp ) )
+                add( sorted( projected_task.Gs ) )
+                add( sorted( projected_task.inactive_by_default ) )
+                lp = projected_task.lp
+                if lp is not None :
+                        for condition, c in lp.constraints :
+                                add( ( sorted( condition ), describe_constraint( lp.model, c ) ) )
+                        add( describe_variables( lp.model ) )
+                return digest.hexdigest()
+
+        @staticmethod
+        def path( key ) :
+                return os.path.join( TableCache.DIRECTORY, key + '.pdb' )
+
+        # Fills the table (already set up by Table.init_table) from the
+        # store, and returns True, if it is there.
+        @staticmethod
+        def load( table, key ) :
+                if TableCache.DIRECTORY is None :
+                        return False
+                try :
+                        with open( TableCache.path( key ), 'rb' ) as f :
+                                data = mmap.mmap( f.fileno(), 0, access = mmap.ACCESS_READ )
+                except ( IOError, OSError, ValueError ) :
+                        TableCache.misses += 1
+                        return False
+                size = len( table.h_values )
+                header = TableCache.HEADER
+                if len(data) != header.size + 16 * size :
+                        TableCache.misses += 1
+                        return False
+                magic, num_entries, unsolvable, non_zero, max_value = header.unpack_from( data, 0 )
+                if magic != TableCache.MAGIC or num_entries != size :
+                        TableCache.misses += 1
+                        return False
+                view = memoryview( data )
+                table.h_values = view[ header.size : header.size + 8 * size ].cast( 'd' )
+                table.actions = view[ header.size + 8 * size : ].cast( 'q' )
+                table.unsolvable_count = unsolvable
+                table.num_non_zero_entries = non_zero
+                table.max_value = max_value
+                TableCache.hits += 1
+                return True
+
+        @staticmethod
+        def store( table, key ) :
+                if TableCache.DIRECTORY is None :
+                        return
+                try :
+                        if not os.path.isdir( TableCache.DIRECTORY ) :
+                                os.makedirs( TableCache.DIRECTORY )
+                        fd, tmp_path = tempfile.mkstemp( dir = TableCache.DIRECTORY, suffix = '.tmp' )
+                        with os.fdopen( fd, 'wb' ) as f :
+                                f.write( TableCache.HEADER.pack( TableCache.MAGIC, len( table.h_values ), table.unsolvable_count, table.num_non_zero_entries, table.max_value ) )
+                                f.write( memoryview( table.h_values ).cast( 'B' ) )
+                                f.write( memoryview( table.actions ).cast( 'B' ) )
+                        os.rename( tmp_path, TableCache.path( key ) )
+                except ( IOError, OSError ) as e :
+                        logging.info( 'PDB cache: table could not be stored: {0}'.format( e ) )
+
+# Returns a description of a constraint of the secondary model: its
+# terms, sense and right hand side for a Gurobi model, and its repr
+# otherwise.
+def describe_constraint( model, c ) :
+        try :
+                row = model.getRow( c )
+                terms = [ ( row.getVar(i).VarName, row.getCoeff(i) ) for i in range( row.size() ) ]
+                return ( sorted( terms ), c.Sense, c.RHS )
+        except AttributeError :
+                return repr( c )
+
+def describe_variables( model ) :
+        try :
+                return [ ( v.VarName, v.LB, v.UB, v.VType ) for v in model.getVars() ]
+        except AttributeError :
+                return None
@@ -5,6 +5,7 @@ Domain-Independent Construction of Pattern Database Heuristics for Cost-Optimal
 P. Haslum, A. Botea, M. Helmert, B. Bonet, S. Koenig
 Proceedings of AAAI, 2007
 """
+import os
 import sys
 import logging
 
@@ -13,6 +14,10 @@ import time
 #TIMER_FUN = time.clock
 TIMER_FUN = time.time
 
+# Default limit on the total number of entries of the tables of the
+# pattern collection built by iPDB. It can be set with the environment
+# variable IPDB_MAX_ENTRIES.
+MAX_NUM_ENTRIES = int( os.environ.get( 'IPDB_MAX_ENTRIES', 10000 ) )
 
 def         select_initial_patterns( in_task ) :
         """
@@ -56,12 +61,14 @@ def         evaluate_over_witnesses( h, witness_collection ) :
                 if new_h_value > prev_h_value : score += 1
         return score
 
-def         iPDB( in_task, max_num_entries ) :
-        from heuristics.projections        import project_hybrid_over_vars
-        from heuristics.pdb.pattern        import Table
+def         iPDB( in_task, max_num_entries = None ) :
         from heuristics.pdb                import Canonical_Heuristic_Function
+        from heuristics.pdb.parallel        import TableBuilder
         from search.a_star                import astar_state_sampling        
 
+        if max_num_entries is None :
+                max_num_entries = MAX_NUM_ENTRIES
+
         t0 = TIMER_FUN()
         pattern_signatures, pattern_num_entries = select_initial_patterns(in_task)
         
@@ -73,17 +80,18 @@ def         iPDB( in_task, max_num_entries ) :
 
         logging.info( 'PDB construction: iPDB (Haslum, 2007)' )
 
-        pattern_collection = []
-        new_pattern_signature_list = []
+        builder = TableBuilder( in_task )
         for k, pattern_signature in enumerate( pattern_signatures ) :
                 logging.info( 'Pattern #{0}, signature size: {1}, # entries: {2}'.format( k, len(pattern_signature), pattern_num_entries[k] ) )
                 #logging.info( 'Pattern #{0}: {1}'.format( k, pattern_signature ) )
                 p_var_names = [ in_task.task.state_vars[i].name for i in pattern_signature ]
                 logging.info( 'Pattern #{0}: {1}, {2}'.format( k, pattern_signature, p_var_names ) )
-                p_k = Table( pattern_signature )
-                p_k.build_relevant_action_set( in_task.actions )
-                projected_task, vars_maps, actions_maps = project_hybrid_over_vars( in_task, pattern_signature )
-                p_k.populate( projected_task, vars_maps, actions_maps )
+        initial_tables = builder.build( pattern_signatures )
+
+        pattern_collection = []
+        new_pattern_signature_list = []
+        for k, pattern_signature in enumerate( pattern_signatures ) :
+                p_k = initial_tables[k]
                 if p_k.max_value == 0 :
                         logging.info( 'Pattern with signature {0} rejected, max h^P() is 0' )
                         #pattern_collection.append(None)
@@ -108,7 +116,8 @@ def         iPDB( in_task, max_num_entries ) :
         task_variables = set( range(0, len(in_task.task.state_vars)) )
 
         while True :
-                candidates = []
+                extensions = []
+                extension_sizes = []
                 # for each pattern
                 for k, pattern_signature in enumerate(pattern_signatures) :
                         if pattern_collection[k] is None : continue
@@ -130,37 +139,38 @@ def         iPDB( in_task, max_num_entries ) :
                                         continue
                                 new_pattern_signature = copy(pattern_signature)
                                 new_pattern_signature.add(x)
-                                new_pattern = Table( new_pattern_signature )
-                                new_pattern.build_relevant_action_set( in_task.actions )
-                                projected_task, vars_maps, actions_maps = project_hybrid_over_vars( in_task, pattern_signature )
-                                new_pattern.populate_informed( projected_task, vars_maps, actions_maps, Canonical_Heuristic_Function( in_task, [ pattern_collection[k] ] ) )
-                                if new_pattern.max_value == 0 :
-                                        logging.info( 'new pattern does not contribute any information to the heuristic' )
-                                        # useless pattern
-                                        continue
-                                new_pattern_collection = [ pattern for l, pattern in enumerate( pattern_collection ) if l != k ]
-                                new_pattern_collection.append( new_pattern )
-                                
-                                new_h = Canonical_Heuristic_Function( in_task, new_pattern_collection )
-                                new_h_s0, _ = new_h.evaluate( in_task.prim_s0 )
-                                score = evaluate_over_witnesses( new_h, witnesses )
-                                logging.info( 'Score: {0}'.format(score) ) 
-                                if  score > 0 :
-                                        candidates.append( ( score, new_h_s0, k, new_pattern_signature, new_pattern_size, new_pattern, new_pattern_collection, new_h ) )
+                                extensions.append( ( k, new_pattern_signature ) )
+                                extension_sizes.append( new_pattern_size )
+                # candidate patterns are built and scored in parallel
+                candidates = []
+                scores = builder.score_candidates( extensions, pattern_collection, witnesses )
+                for i, ( score, new_h_s0, new_pattern ) in enumerate( scores ) :
+                        k, new_pattern_signature = extensions[i]
+                        if new_pattern.max_value == 0 :
+                                logging.info( 'new pattern does not contribute any information to the heuristic' )
+                                continue
+                        logging.info( 'Score: {0}'.format(score) ) 
+                        if  score > 0 :
+                                candidates.append( ( score, new_h_s0, k, i, new_pattern_signature, extension_sizes[i], new_pattern ) )
                 if len(candidates) == 0 :
                         logging.info( 'PDB construction finished!')
                         break
                 logging.info( 'New pattern added, prev. value of h(s0) = {0}'.format( h_s0) )
-                score, h_s0, index,  new_pattern_signature, new_pattern_size, new_pattern, new_pattern_collection, new_h = max(candidates)
+                score, h_s0, index, _, new_pattern_signature, new_pattern_size, new_pattern = max(candidates)
+                new_pattern_collection = list( pattern_collection )
+                new_pattern_collection[index] = new_pattern
+                new_h = Canonical_Heuristic_Function( in_task, new_pattern_collection )
                 cutoff_value = h_s0 * 1.1
                 logging.info( 'Pattern score: {0}, new value for h(s0) ={1}, cutoff = {2}'.format( score, h_s0, cutoff_value ) )
                 pattern_signatures[index] = new_pattern_signature
+                total_num_entries += new_pattern_size - pattern_num_entries[index]
                 pattern_num_entries[index] = new_pattern_size
                 pattern_collection = new_pattern_collection
                 h = new_h
-                witnesses = astar_state_sample( in_task, h, h_s0 * 2, 100 )
+                witnesses = astar_state_sampling( in_task, h, h_s0 * 2, 100 )
                 logging.info( 'Witnesses collected: {0}'.format( len(witnesses) ) )
 
         t1 = TIMER_FUN()
         logging.info( 'iPDB construction time: {0}'.format( t1 - t0 ) )
+        logging.info( 'iPDB table construction time: {0}'.format( builder.build_time ) )
         return h
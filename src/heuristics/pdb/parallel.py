@@ -0,0 +1,138 @@
+"""
+Parallel construction of pattern databases.
+
+The tables of different patterns are independent, so they are built in
+a pool of worker processes. Workers are forked from the planner, and so
+start with a copy of the hybrid task (and of anything else the parent
+sets up before the pool is created). Each first makes a Gurobi
+environment of its own (see secondary.init_worker_env), since the one
+inherited from the parent can't be used; it then projects the task over
+the pattern it is given, copying the secondary model into that
+environment, and sends back only the populated table. Tables
+found in the on-disk store (see TableCache) are loaded rather than
+built.
+"""
+from         __future__                import print_function
+
+import         logging
+import         multiprocessing
+import         time
+
+from         heuristics.projections        import project_hybrid_over_vars
+from        heuristics.pdb.pattern        import Table
+from        heuristics.pdb.cache        import TableCache
+from        model.generic.hybrid.secondary        import init_worker_env
+
+#TIMER_FUN = time.clock
+TIMER_FUN = time.time
+
+class TableBuilder :
+        """
+        Builds the tables of lists of patterns of a hybrid task, and
+        scores iPDB candidate patterns, in NUM_WORKERS processes (None
+        means one per core, and 1 builds everything in this process, as
+        do platforms that can't fork). Results are returned in the order
+        of the patterns given, whatever the number of workers.
+        """
+
+        NUM_WORKERS = None
+
+        # state shared with the workers (inherited when they are forked)
+        in_task = None
+        guides = None
+        collection = None
+        witnesses = None
+
+        def __init__( self, in_task ) :
+                self.in_task = in_task
+                self.build_time = 0
+
+        def num_workers( self, num_jobs ) :
+                n = TableBuilder.NUM_WORKERS
+                if n is None :
+                        n = multiprocessing.cpu_count()
+                if 'fork' not in multiprocessing.get_all_start_methods() :
+                        n = 1
+                return max( 1, min( n, num_jobs ) )
+
+        def map( self, fn, jobs ) :
+                TableBuilder.in_task = self.in_task
+                n = self.num_workers( len(jobs) )
+                if n == 1 :
+                        return [ fn( job ) for job in jobs ]
+                pool = multiprocessing.get_context( 'fork' ).Pool( n, initializer = init_worker_env )
+                try :
+                        return pool.map( fn, jobs, chunksize = 1 )
+                finally :
+                        pool.close()
+                        pool.join()
+
+        # Returns the populated tables of the patterns. If guides is
+        # given, the table of the k-th pattern is populated informed by
+        # the canonical heuristic over the tables in guides[k] (see
+        # Table.populate_informed).
+        def build( self, signatures, guides = None ) :
+                t0 = TIMER_FUN()
+                TableBuilder.guides = guides
+                tables = self.map( build_table, list( enumerate( signatures ) ) )
+                TableBuilder.guides = None
+                self.build_time += TIMER_FUN() - t0
+                logging.info( '{0} pattern databases built by {1} process(es) in {2} secs.'.format( len(tables), self.num_workers( len(signatures) ), TIMER_FUN() - t0 ) )
+                return tables
+
+        # Builds the table of each candidate, a pair (k, signature) where
+        # the signature extends that of the k-th pattern of collection,
+        # and scores the canonical heuristic over collection with the
+        # k-th pattern replaced by the candidate over the witnesses (see
+        # haslum_aaai07.evaluate_over_witnesses). Returns, for each
+        # candidate, a tuple (score, h(s0), table).
+        def score_candidates( self, candidates, collection, witnesses ) :
+                t0 = TIMER_FUN()
+                TableBuilder.collection = collection
+                TableBuilder.witnesses = witnesses
+                results = self.map( score_candidate, candidates )
+                TableBuilder.collection = None
+                TableBuilder.witnesses = None
+                self.build_time += TIMER_FUN() - t0
+                return results
+
+def build_table( job ) :
+        from heuristics.pdb import Canonical_Heuristic_Function
+        k, signature = job
+        in_task = TableBuilder.in_task
+        table = Table( signature )
+        table.build_relevant_action_set( in_task.actions )
+        projected_task, vars_maps, actions_maps = project_hybrid_over_vars( in_task, signature )
+        key = None
+        if TableCache.DIRECTORY is not None :
+                table.init_table( projected_task, vars_maps )
+                key = TableCache.fingerprint( table, projected_task, vars_maps, actions_maps )
+                if TableCache.load( table, key ) :
+                        logging.info( 'PDB cache: table of pattern {0} loaded from {1}'.format( sorted( signature ), TableCache.path( key ) ) )
+                        return table
+        if TableBuilder.guides is None :
+                table.populate( projected_task, vars_maps, actions_maps )
+        else :
+                table.populate_informed( projected_task, vars_maps, actions_maps, Canonical_Heuristic_Function( in_task, TableBuilder.guides[k] ) )
+        if key is not None :
+                TableCache.store( table, key )
+        return table
+
+def score_candidate( job ) :
+        from heuristics.pdb import Canonical_Heuristic_Function
+        from heuristics.pdb.haslum_aaai07 import evaluate_over_witnesses
+        k, signature = job
+        in_task = TableBuilder.in_task
+        collection = TableBuilder.collection
+        TableBuilder.guides = { k : [ collection[k] ] }
+        table = build_table( job )
+        TableBuilder.guides = None
+        if table.max_value == 0 :
+                # useless pattern
+                return 0, 0, table
+        new_collection = list( collection )
+        new_collection[k] = table
+        new_h = Canonical_Heuristic_Function( in_task, new_collection )
+        new_h_s0, _ = new_h.evaluate( in_task.prim_s0 )
+        score = evaluate_over_witnesses( new_h, TableBuilder.witnesses )
+        return score, new_h_s0, table
@@ -1,22 +1,48 @@
 from __future__                import        print_function
+from array                        import        array
+import heapq
 import itertools
 import logging
 
-class Entry :
-
-        def __init__( self, h, a ) :
-                self.h_value = h
-                self.action = a
-
 class Table :
+        """
+        A pattern database. Entries are stored in two flat arrays, one
+        with the h values and one with the index of the first action of
+        an optimal plan (-1 if there is none), indexed by the rank of
+        the abstract state: the value indices of the pattern variables,
+        in the order of the projected task, read as the digits of a
+        mixed-radix number with the last variable varying fastest, which
+        is the order in which itertools.product enumerates them.
+
+        Tables are built by a single backward Dijkstra search over the
+        abstract space, from the abstract goal states and through the
+        regression of the projected actions (see populate_backward). If
+        some projected action can't be regressed (see is_regressable),
+        or backward_construction is off, each entry is instead found by
+        an A* search forward from the abstract state.
+        """
+
+        backward_construction = True
 
         def __init__(self, signature ) :
                 # signature: list of variable indices
                 self.signature = signature
-                self.table = {}
+                self.pattern_vars = []
+                self.multipliers = []
+                self.value_indices = []
+                self.h_values = array( 'd' )
+                self.actions = array( 'q' )
                 self.relevant_actions = set()
                 self.relevant_vars = set()
 
+        # Tables loaded from the cache (see TableCache) hold memoryviews
+        # of a mapped file, which are pickled as arrays.
+        def __getstate__( self ) :
+                state = dict( self.__dict__ )
+                state['h_values'] = array( 'd', self.h_values )
+                state['actions'] = array( 'q', self.actions )
+                return state
+
         def build_relevant_action_set( self, actions ) :
                 for action in actions :
                         # Check if effects affect any variable in the signature
@@ -27,7 +53,137 @@ class Table :
                                         self.relevant_vars |= set( [ x for x, _ in action.effect ] )
 
 
+        # Sets up the ranking of the abstract states of the projected
+        # task, and a table with all entries at h = 0 and no action.
+        def init_table( self, projected_task, vars_maps ) :
+                var_map, inv_var_map = vars_maps
+                domains = [ x.domain for x in projected_task.task.state_vars ]
+
+                self.pattern_vars = [ inv_var_map[x] for x in range(len(domains)) ]
+                self.value_indices = [ dict( (v, i) for i, v in enumerate(D) ) for D in domains ]
+                self.multipliers = [ 0 ] * len(domains)
+                size = 1
+                for x in reversed( range(len(domains)) ) :
+                        self.multipliers[x] = size
+                        size *= len(domains[x])
+                self.h_values = array( 'd', [ 0.0 ] ) * size
+                self.actions = array( 'q', [ -1 ] ) * size
+
+                self.unsolvable_count = 0
+                self.num_non_zero_entries = 0
+                self.max_value = 0
+
+        # Regression is sound if each projected action has a fixed cost
+        # and assigns at most one value to each variable, both in its
+        # precondition and in its effect.
+        def is_regressable( self, projected_task ) :
+                for action in projected_task.actions :
+                        if action.conditional_costs is not None :
+                                return False
+                        for valuation in ( action.prim_precs, action.effect ) :
+                                if len( set( [ x for x, _ in valuation ] ) ) != len(valuation) :
+                                        return False
+                return True
+
         def populate_informed( self, projected_task, vars_maps, actions_maps, h ) :
+                if Table.backward_construction and self.is_regressable( projected_task ) :
+                        self.populate_backward( projected_task, vars_maps, actions_maps )
+                else :
+                        self.populate_forward( projected_task, vars_maps, actions_maps, h )
+
+        # Fills the table by Dijkstra's algorithm from the abstract goal
+        # states, backwards. The abstract state popped from the queue
+        # is s, and the predecessors of s through an action a are the
+        # states in the regression of s through a; these are those that
+        # agree with s on the variables a doesn't change, and with the
+        # precondition of a on those it does (the variables a changes
+        # but has no precondition on can have any value). A predecessor
+        # is reached if it is valid and a is applicable in it, which is
+        # checked as in the forward search (HybridTask.is_applicable).
+        # The validity of each abstract state is checked at most once.
+        def populate_backward( self, projected_task, vars_maps, actions_maps ) :
+                from model.generic.planning.task         import State
+                from model.generic.hybrid.state                import HybridState
+
+                self.init_table( projected_task, vars_maps )
+                action_map, inv_action_map =  actions_maps
+                domains = [ tuple(x.domain) for x in projected_task.task.state_vars ]
+                multipliers = self.multipliers
+                value_indices = self.value_indices
+                size = len(self.h_values)
+                INF = float('inf')
+
+                status = bytearray( size ) # 0: not checked, 1: valid, 2: invalid
+                def valid_state( digits, r ) :
+                        s = HybridState( State( projected_task.task, [ (x, domains[x][i]) for x, i in enumerate(digits) ] ),
+                                        projected_task.secondary, projected_task.inactive_by_default, projected_task.triggers )
+                        if status[r] == 0 :
+                                s.check_valid()
+                                status[r] = 1 if s.valid else 2
+                        else :
+                                s.valid = ( status[r] == 1 )
+                                s.secondary = None
+                        return s if s.valid else None
+
+                def unrank( r ) :
+                        return [ ( r // m ) % len(domains[x]) for x, m in enumerate(multipliers) ]
+
+                # precondition and effect of the actions, as value indices
+                precs = []
+                effects = []
+                for action in projected_task.actions :
+                        precs.append( dict( [ (x, value_indices[x][v]) for x, v in action.prim_precs ] ) )
+                        effects.append( dict( [ (x, value_indices[x][v]) for x, v in action.effect ] ) )
+
+                cost = [ INF ] * size
+                queue = []
+                goal = dict( [ (x, value_indices[x][v]) for x, v in projected_task.Gp ] )
+                free = [ range(len(D)) if x not in goal else [ goal[x] ] for x, D in enumerate(domains) ]
+                for digits in itertools.product( *free ) :
+                        r = sum( [ i * multipliers[x] for x, i in enumerate(digits) ] )
+                        s = valid_state( digits, r )
+                        if s is None or not projected_task.goal_reached( s ) :
+                                continue
+                        cost[r] = 0
+                        queue.append( ( 0, r ) )
+
+                closed = bytearray( size )
+                while len(queue) > 0 :
+                        c, r = heapq.heappop( queue )
+                        if closed[r] : continue
+                        closed[r] = 1
+                        digits = unrank( r )
+                        for a, action in enumerate( projected_task.actions ) :
+                                pre, eff = precs[a], effects[a]
+                                if any( [ digits[x] != i for x, i in eff.items() ] ) : continue
+                                if any( [ digits[x] != i for x, i in pre.items() if x not in eff ] ) : continue
+                                c_pred = c + action.cost
+                                # the regression of s through a
+                                pred_free = [ [ pre[x] ] if x in pre else range(len(domains[x])) for x in eff ]
+                                base = r - sum( [ digits[x] * multipliers[x] for x in eff ] )
+                                for values in itertools.product( *pred_free ) :
+                                        r_pred = base + sum( [ i * multipliers[x] for x, i in zip( eff, values ) ] )
+                                        if closed[r_pred] or c_pred >= cost[r_pred] or status[r_pred] == 2 : continue
+                                        s_pred = valid_state( unrank( r_pred ), r_pred )
+                                        if s_pred is None or not projected_task.is_applicable( s_pred, action ) : continue
+                                        cost[r_pred] = c_pred
+                                        self.actions[r_pred] = inv_action_map[a]
+                                        heapq.heappush( queue, ( c_pred, r_pred ) )
+
+                for r in range(size) :
+                        self.h_values[r] = cost[r]
+                        if cost[r] == INF :
+                                self.actions[r] = -1
+                                self.unsolvable_count += 1
+                                continue
+                        if self.actions[r] >= 0 :
+                                self.num_non_zero_entries += 1
+                        self.max_value = max( self.max_value, cost[r] )
+
+        # Fills the table with an A* search from each abstract state,
+        # guided by h (which evaluates the states of the projected task
+        # through their unprojected values).
+        def populate_forward( self, projected_task, vars_maps, actions_maps, h ) :
                 from itertools                                import product
                 from model.generic.planning.task         import State
 
@@ -45,38 +201,28 @@ class Table :
                         
                         return astar_search( task, heuristic_adapter, make_open_entry=ordered_node_astar, use_relaxed_plan=False, mute=True )
 
-                var_map, inv_var_map = vars_maps
+                self.init_table( projected_task, vars_maps )
                 action_map, inv_action_map =  actions_maps
-
                 domains = [ x.domain for x in projected_task.task.state_vars ]
-        
-                value_index = 0
 
-                self.unsolvable_count = 0
-                self.num_non_zero_entries = 0
-                self.max_value = 0
-                for valuation in product( * map(tuple,domains) ) :
-                        value_index += 1
-                        # indexed with the original vars
-                        entry_index = tuple([ ( inv_var_map[x], v) for x, v in enumerate(valuation) ])
+                for entry_index, valuation in enumerate( product( * map(tuple,domains) ) ) :
                         s0 = State( projected_task.task, [ (x,v) for x,v in enumerate(valuation) ] )
                         projected_task.set_initial_state( s0 )
                         projected_task.initial_state.check_valid()
                         if not projected_task.initial_state.valid :
-                                self.table[ entry_index ] = Entry( float('inf'), None )
+                                self.h_values[ entry_index ] = float('inf')
                                 self.unsolvable_count += 1
                                 continue                                
                         plan = optimal_search( projected_task, h )
                         if plan is None :
-                                self.table[ entry_index ] = Entry( float('inf'), None )
+                                self.h_values[ entry_index ] = float('inf')
                                 self.unsolvable_count += 1
                                 continue
-                        first_action_in_plan = None
                         if len(plan) > 0 :
                                 self.num_non_zero_entries += 1
-                                first_action_in_plan =  inv_action_map[plan[0].index]
+                                self.actions[ entry_index ] = inv_action_map[plan[0].index]
                         plan_cost = sum([ action.cost for action in plan ])
-                        self.table[ entry_index ] = Entry( plan_cost, first_action_in_plan )        
+                        self.h_values[ entry_index ] = plan_cost
                         self.max_value = max( self.max_value, plan_cost )
 
 
@@ -85,15 +231,23 @@ class Table :
                 self.populate_informed(projected_task, vars_maps, actions_maps, H_Zero(projected_task))
 
 
+        # Returns the rank of the projection of the state, or None if
+        # some pattern variable has a value not in the table. States of
+        # a projected task (see populate_informed) carry their values
+        # over the original variables in state.unprojected.
+        def rank( self, state ) :
+                unprojected = getattr( state, 'unprojected', None )
+                if unprojected is not None :
+                        values = dict( unprojected )
+                        try :
+                                return sum( [ self.value_indices[k][ values[X] ] * self.multipliers[k] for k, X in enumerate( self.pattern_vars ) ] )
+                        except KeyError :
+                                return None
+                return sum( [ state.value_index(X) * self.multipliers[k] for k, X in enumerate( self.pattern_vars ) ] )
+
         def evaluate( self, state ) :
-                try :
-                        projected_state = tuple([ (X, state.value(X)) for X in self.signature ])
-                except IndexError :
-                        projected_state = tuple([ (X, v) for X, v in state.unprojected if X in self.signature])
-
-                try : 
-                        entry = self.table[ projected_state ]
-                        return entry.h_value, entry.action
-                except KeyError :
-                         pass
-                return 0, None
+                r = self.rank( state )
+                if r is None :
+                        return 0, None
+                a = self.actions[r]
+                return self.h_values[r], ( a if a >= 0 else None )
@@ -6,9 +6,8 @@ from         __future__                import print_function
 import         logging
 import         random 
         
-from         heuristics.projections        import project_hybrid_over_vars
-from        heuristics.pdb.pattern        import Table
 from         heuristics.pdb                 import Canonical_Heuristic_Function 
+from         heuristics.pdb.parallel        import TableBuilder
 
 xrange = range
 
@@ -77,21 +76,8 @@ def naive_partitioning( in_task, max_num_patterns, max_num_entries ) :
         if len( pattern_signatures) > max_num_patterns :
                 logging.info( '# of patterns {0}, requested was {1}'.format( len(pattern_signatures), max_num_patterns ) )
 
-        logging.info( 'Projecting task over pattern variables' )
-        projected_tasks = []
-        for k, signature in enumerate( pattern_signatures ) :
-                logging.info( 'Pattern {0}, size {1}:'.format( k, len(signature) ) )
-                projected_tasks.append( project_hybrid_over_vars( in_task, signature ) )
-        logging.info( 'Projection complete' )
-
         logging.info( 'Populating pattern databses' )
-        database = []
-        for k, projection_data in enumerate( projected_tasks ) :
-                logging.info( 'Computing values for Pattern {0}, size {1}:'.format( k, len(pattern_signatures[k]) ) )
-                p_k = Table( pattern_signatures[k] )
-                p_k.build_relevant_action_set( in_task.actions )
-                projected_task, vars_maps, actions_maps = projection_data
-                p_k.populate( projected_task, vars_maps, actions_maps ) 
+        database = TableBuilder( in_task ).build( pattern_signatures )
         logging.info( 'Pattern databases have been populated' )
         
         return         Canonical_Heuristic_Function( in_task, database )        
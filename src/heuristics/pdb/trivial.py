@@ -3,9 +3,8 @@ from         __future__                import print_function
 import         logging
 import         random 
         
-from         heuristics.projections        import project_hybrid_over_vars
-from        heuristics.pdb.pattern        import Table
 from         heuristics.pdb                 import Canonical_Heuristic_Function 
+from         heuristics.pdb.parallel        import TableBuilder
 
 def trivial_partitioning( in_task ) :
     """
@@ -24,14 +23,14 @@ def trivial_partitioning( in_task ) :
             for x, v in t:
                 goal_vars.add(x)
 
-    pattern_collection = []
+    signatures = []
     for k, var_num in enumerate(goal_vars):
         sig = [ var_num ]
         logging.info( 'Pattern #{0}: {1}, {2}'.format( k, sig, in_task.task.state_vars[var_num].name ) )
-        p_k = Table( sig )
-        p_k.build_relevant_action_set( in_task.actions )
-        projected_task, vars_maps, actions_maps = project_hybrid_over_vars( in_task, sig )
-        p_k.populate( projected_task, vars_maps, actions_maps )
+        signatures.append( sig )
+
+    pattern_collection = []
+    for p_k in TableBuilder( in_task ).build( signatures ) :
         if p_k.max_value == 0 :
             logging.info( 'max value is 0, pattern rejected' )
             continue
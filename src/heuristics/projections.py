@@ -91,6 +91,8 @@ def        project_hybrid_over_vars( task, variable_set ) :
         constraints_projected_away, projected_secondary = project_secondary_over_vars( task.lp, variable_set, vars_maps[0] )
 
         projected_hybrid = HybridTask( projected_primary, projected_secondary, None, projected_G, projected_secondary.goal_constraints )
+        # the searches on projections are too small to be worth a pool
+        projected_hybrid.check_workers = 1
 
         # kill constraints that have been projected away
         for index in constraints_projected_away :
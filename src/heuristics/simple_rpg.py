@@ -44,7 +44,7 @@ class RelaxedPlanningGraph :
                         return False
                 # check if last layer satisfies goal
                 #print("Gp = {}".format(self.task.Gp))
-                if not self.f_layers[-1].possible( self.task.Gp ) :
+                if not self.f_layers[-1].possible_compiled( self.task.compiled_Gp ) :
                         self.goal_reached_time += TIMER_FUN() - t0 
                         return False
                 #print("Gs = {}".format(self.task.Gs))
@@ -99,7 +99,7 @@ class RelaxedPlanningGraph :
                 for idx in self.all_actions :
                         if not self.available[idx] : continue
                         action = self.task.actions[idx]
-                        if not self.f_layers[-1].possible( action.prim_precs ) :
+                        if not self.f_layers[-1].possible_compiled( action.compiled_precs ) :
                                 continue
                         # In 1st weaker relaxation, check consistency of
                         # invariant constraints with primary prec even if
@@ -111,21 +111,8 @@ class RelaxedPlanningGraph :
                         if self.meticulous:
                                 if not self.task.check_postcondition_validity(self.f_layers[-1], action):
                                         continue
-                        skip = False
-                        for ng in self.task.no_good_list :
-                                try :
-                                        phi, j = ng
-                                        if idx == j and self.f_layers[-1].satisfies( phi ) :
-                                                skip = True
-                                                break
-                                except ValueError :
-                                        tmp = self.f_layers[-1].copy()
-                                        for X, v in self.task.actions[idx].effect :
-                                                tmp.relaxed_set(X,v)
-                                        if tmp.satisfies(ng) :
-                                                skip = True
-                                                break
-                        if skip : continue
+                        if len(self.task.no_goods) > 0 and self.task.no_goods.prunes( self.f_layers[-1], action ) :
+                                continue
         
                         applied_actions.add( idx )
                         self.h_a[ idx ] = len(self.f_layers ) - 1
@@ -157,3 +144,180 @@ class RelaxedPlanningGraph :
                                 if val == lnum:
                                         X, v = lit
                                         print("  {} = {}".format(self.f_layers[lnum].task.state_vars[X].name, v))
+
+class IncrementalRPG :
+        """
+        Relaxed reachability as a fixpoint over fact-reached flags and
+        per-action counters of unreached preconditions, rather than as a
+        layered graph. Actions can be added to the set of available ones
+        after the fixpoint is computed, and the fixpoint is then extended
+        from where it was; the last such addition can be undone. Secondary
+        precondition checks (and no-good pruning) are done when all the
+        primary preconditions of an action are reached, and repeated when
+        more facts are reached if they failed. Since reachability in the
+        relaxation is monotone, the fixpoint is the same as that of the
+        layered graph built by RelaxedPlanningGraph.
+        """
+
+        def __init__( self, the_task ) :
+                self.task = the_task
+                self.num_actions = len( self.task.actions )
+                self.precs = [ action.compiled_precs.literals for action in self.task.actions ]
+                self.adds = [ action.compiled_effect.literals for action in self.task.actions ]
+                self.prec_of = None # literal offset -> actions with it as a precondition
+                self.goal = self.task.compiled_Gp.literals
+                self.saved = None
+                self.goal_reached_time = 0
+                self.add_next_layer_time = 0
+
+        def make_index( self, num_literals ) :
+                self.prec_of = [ [] for k in xrange( num_literals ) ]
+                self.is_goal = bytearray( num_literals )
+                for idx, precs in enumerate( self.precs ) :
+                        for offset in precs :
+                                self.prec_of[offset].append( idx )
+                for offset in self.goal :
+                        self.is_goal[offset] = 1
+
+        # Computes the fixpoint from state, with the actions in A
+        # available.
+        def initialize( self, state, A ) :
+                t0 = TIMER_FUN()
+                s = state.primary.copy()
+                s.relaxed = True
+                num_literals = s.num_literals()
+                if self.prec_of is None :
+                        self.make_index( num_literals )
+                self.state = s
+                self.state_shared = False
+                self.reached = bytearray( num_literals )
+                self.reached_trail = []
+                self.unreached = [ len(precs) for precs in self.precs ]
+                self.goal_left = len(self.goal)
+                self.available = bytearray( self.num_actions )
+                self.fired = bytearray( self.num_actions )
+                self.fired_trail = []
+                self.ready = []
+                self.blocked = [] # actions whose checks failed
+                self.blocked_stamp = 0 # facts reached when they were checked
+                self.goal_result = None
+                self.goal_stamp = None
+                self.saved = None
+                for offset in xrange( num_literals ) :
+                        if s.holds( offset ) :
+                                self.reach( offset )
+                for idx in A :
+                        if not self.available[idx] :
+                                self.make_available( idx )
+                self.propagate()
+                self.add_next_layer_time += TIMER_FUN() - t0
+
+        # Makes the actions available and extends the fixpoint. Only
+        # this last addition can be undone.
+        def add( self, actions ) :
+                t0 = TIMER_FUN()
+                actions = [ idx for idx in actions if not self.available[idx] ]
+                self.saved = ( self.state, len(self.reached_trail), len(self.fired_trail), list( self.blocked ), self.blocked_stamp, self.goal_left, self.goal_result, self.goal_stamp, actions )
+                self.state_shared = True
+                for idx in actions :
+                        self.make_available( idx )
+                self.propagate()
+                self.add_next_layer_time += TIMER_FUN() - t0
+
+        def undo( self ) :
+                state, num_reached, num_fired, self.blocked, self.blocked_stamp, self.goal_left, self.goal_result, self.goal_stamp, actions = self.saved
+                self.saved = None
+                self.state = state
+                self.state_shared = False
+                for offset in self.reached_trail[num_reached:] :
+                        self.reached[offset] = 0
+                        for idx in self.prec_of[offset] :
+                                self.unreached[idx] += 1
+                del self.reached_trail[num_reached:]
+                for idx in self.fired_trail[num_fired:] :
+                        self.fired[idx] = 0
+                del self.fired_trail[num_fired:]
+                for idx in actions :
+                        self.available[idx] = 0
+
+        def make_available( self, idx ) :
+                self.available[idx] = 1
+                if self.unreached[idx] == 0 :
+                        self.ready.append( idx )
+
+        def reach( self, offset ) :
+                self.reached[offset] = 1
+                self.reached_trail.append( offset )
+                if self.is_goal[offset] :
+                        self.goal_left -= 1
+                for idx in self.prec_of[offset] :
+                        self.unreached[idx] -= 1
+                        if self.unreached[idx] == 0 and self.available[idx] :
+                                self.ready.append( idx )
+
+        def fire( self, idx ) :
+                self.fired[idx] = 1
+                self.fired_trail.append( idx )
+                if self.state_shared :
+                        self.state = self.state.copy()
+                        self.state_shared = False
+                self.state.relaxed_apply_compiled( self.task.actions[idx].compiled_effect )
+                for offset in self.adds[idx] :
+                        if not self.reached[offset] :
+                                self.reach( offset )
+
+        def needs_check( self, action ) :
+                return len( action.sec_precs ) != 0 or RelaxedPlanningGraph.meticulous or len(self.task.no_goods) > 0
+
+        # Same tests as RelaxedPlanningGraph.add_next_layer
+        def check( self, action ) :
+                if (len( action.sec_precs ) != 0) or RelaxedPlanningGraph.meticulous:
+                        if not self.task.check_secondary_precondition( self.state, action ) :
+                                return False
+                if RelaxedPlanningGraph.meticulous:
+                        if not self.task.check_postcondition_validity( self.state, action ) :
+                                return False
+                if len(self.task.no_goods) > 0 and self.task.no_goods.prunes( self.state, action ) :
+                        return False
+                return True
+
+        def propagate( self ) :
+                pending = []
+                while True :
+                        while len(self.ready) > 0 :
+                                idx = self.ready.pop()
+                                if self.fired[idx] : continue
+                                if self.needs_check( self.task.actions[idx] ) :
+                                        pending.append( idx )
+                                else :
+                                        self.fire( idx )
+                        # blocked actions are checked again only if more
+                        # facts have been reached since they failed
+                        if len(self.reached_trail) != self.blocked_stamp :
+                                pending += self.blocked
+                                self.blocked = []
+                        if len(pending) == 0 :
+                                return
+                        self.blocked_stamp = len(self.reached_trail)
+                        for idx in pending :
+                                if self.fired[idx] : continue
+                                if self.check( self.task.actions[idx] ) :
+                                        self.fire( idx )
+                                else :
+                                        self.blocked.append( idx )
+                        pending = []
+
+        def goal_reached( self ) :
+                if self.goal_left > 0 :
+                        return False
+                if self.task.Gs is None and not RelaxedPlanningGraph.meticulous :
+                        return True
+                if self.goal_stamp != len(self.reached_trail) :
+                        t0 = TIMER_FUN()
+                        self.goal_result = self.task.check_secondary_goal( self.state )
+                        self.goal_stamp = len(self.reached_trail)
+                        self.goal_reached_time += TIMER_FUN() - t0
+                return self.goal_result
+
+        def num_reached_actions( self ) :
+                return len(self.fired_trail)
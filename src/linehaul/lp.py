@@ -28,9 +28,10 @@ class LinearProgram :
 
         def copy( self ) :
                 from copy import deepcopy
+                from model.generic.hybrid.secondary import copy_model
 
                 new_lp = LinearProgram( )
-                new_lp.model = self.model.copy()
+                new_lp.model = copy_model( self.model )
                 new_lp.constraints = []
                 for index, ext_constraint in enumerate(self.constraints) :
                         new_lp.constraints.append( ( deepcopy(ext_constraint[0]), new_lp.model.getConstrs()[index] ) )
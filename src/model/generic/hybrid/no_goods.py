@@ -0,0 +1,232 @@
+from         __future__         import         print_function
+
+import heapq
+import logging
+
+class NoGood :
+        """
+        A partial primary valuation that is known to lead to an invalid
+        hybrid state. If action_index is None, the no-good is of type 0:
+        no (valid) state satisfies it. Otherwise it is of type 1: applying
+        the action with that index in a state that satisfies the no-good
+        results in an invalid state.
+        """
+
+        def __init__( self, valuation, compiled, action_index, serial ) :
+                self.valuation = valuation
+                self.literals = frozenset( valuation )
+                self.compiled = compiled
+                self.action_index = action_index
+                self.serial = serial
+                self.pruned = 0
+                self.watched = None # literal that indexes a type 0 no-good
+                self.stored = True
+
+        def __len__( self ) :
+                return len(self.literals)
+
+class NoGoodDatabase :
+        """
+        Indexed store of learned no-goods. Type 1 no-goods are kept in
+        one bucket per action; type 0 no-goods are each watched by one
+        of their literals, so that a query only tests the no-goods whose
+        watched literal holds in the state, and are also listed under each
+        of their literals, so that the no-goods that contain a new one
+        are found by intersecting the lists of its literals (as in
+        CoreIndex). No-goods subsumed by another
+        (i.e., that contain all its literals) are not kept. If MAX_SIZE is
+        not None, the no-good that has pruned the fewest states (the
+        oldest among those) is evicted when the database grows beyond it;
+        it is found on a heap keyed by (pruned, serial), whose entries are
+        brought up to date when they come to the top, since the pruned
+        counts only grow.
+        """
+
+        MAX_SIZE = None
+
+        def __init__( self, task ) :
+                self.task = task
+                self.by_action = {} # action index -> list of no-goods
+                self.watches = {} # (X, v) -> [ compiled literal, list of no-goods ]
+                self.containing = {} # (X, v) -> set of type 0 no-goods that contain it
+                self.unconditional = [] # type 0 no-goods with no literals
+                self.size = 0
+                self.num_evicted = 0
+                self.num_subsumed = 0
+                self.next_serial = 0
+                self.eviction_heap = [] # (pruned, serial, no-good)
+
+        def __len__( self ) :
+                return self.size
+
+        def __iter__( self ) :
+                for bucket in self.by_action.values() :
+                        for ng in bucket :
+                                yield ng
+                for ng in self.unconditional :
+                        yield ng
+                for _, bucket in self.watches.values() :
+                        for ng in bucket :
+                                yield ng
+
+        def candidates( self, literals, action_index ) :
+                if action_index is not None :
+                        return self.by_action.get( action_index, [] )
+                result = list( self.unconditional )
+                for lit in literals :
+                        try :
+                                result += self.watches[lit][1]
+                        except KeyError :
+                                pass
+                return result
+
+        # Adds valuation as a no-good, of type 1 for the given action
+        # if action_index is not None, or of type 0 otherwise. Returns
+        # False if it is subsumed by a no-good already in the database.
+        def add( self, valuation, action_index = None ) :
+                literals = frozenset( valuation )
+                # existing no-goods that subsume the new one are watched
+                # by (or, for type 1, bucketed with) one of its literals
+                for ng in self.candidates( literals, action_index ) :
+                        if ng.literals <= literals :
+                                self.num_subsumed += 1
+                                return False
+                if action_index is not None :
+                        subsumed = [ ng for ng in self.by_action.get( action_index, () ) if literals < ng.literals ]
+                else :
+                        subsumed = self.supersets( literals )
+                for ng in subsumed :
+                        self.remove( ng )
+                        self.num_subsumed += 1
+                ng = NoGood( list(literals), self.task.compile_valuation( list(literals) ), action_index, self.next_serial )
+                self.next_serial += 1
+                if action_index is not None :
+                        self.by_action.setdefault( action_index, [] ).append( ng )
+                elif len(literals) == 0 :
+                        self.unconditional.append( ng )
+                else :
+                        watched = min( literals, key = lambda lit : len( self.watches.get( lit, ( None, () ) )[1] ) )
+                        if watched not in self.watches :
+                                self.watches[watched] = [ self.task.compile_valuation( [ watched ] ), [] ]
+                        self.watches[watched][1].append( ng )
+                        ng.watched = watched
+                        for lit in literals :
+                                self.containing.setdefault( lit, set() ).add( ng )
+                self.size += 1
+                if self.MAX_SIZE is not None :
+                        heapq.heappush( self.eviction_heap, ( ng.pruned, ng.serial, ng ) )
+                        if self.size > self.MAX_SIZE :
+                                self.remove( self.pop_least_useful() )
+                                self.num_evicted += 1
+                return True
+
+        # Returns the type 0 no-goods (with literals) that contain all the
+        # literals given, and at least one more: the intersection of the
+        # sets of no-goods containing each of them, smallest first.
+        def supersets( self, literals ) :
+                if len(literals) == 0 :
+                        return [ ng for _, bucket in self.watches.values() for ng in bucket ]
+                sets = []
+                for lit in literals :
+                        others = self.containing.get( lit )
+                        if others is None :
+                                return []
+                        sets.append( others )
+                sets.sort( key = len )
+                result = set( sets[0] )
+                for others in sets[1:] :
+                        result &= others
+                        if len(result) == 0 :
+                                return []
+                return [ ng for ng in result if len(ng.literals) > len(literals) ]
+
+        def pop_least_useful( self ) :
+                if len(self.eviction_heap) > 2 * self.size :
+                        # drop the entries of no-goods no longer stored
+                        self.eviction_heap = [ ( ng.pruned, ng.serial, ng ) for _, _, ng in self.eviction_heap if ng.stored ]
+                        heapq.heapify( self.eviction_heap )
+                while True :
+                        pruned, serial, ng = heapq.heappop( self.eviction_heap )
+                        if not ng.stored :
+                                continue
+                        if pruned == ng.pruned :
+                                return ng
+                        heapq.heappush( self.eviction_heap, ( ng.pruned, serial, ng ) )
+
+        def remove( self, ng ) :
+                if ng.action_index is not None :
+                        self.by_action[ng.action_index].remove( ng )
+                elif len(ng) == 0 :
+                        self.unconditional.remove( ng )
+                else :
+                        bucket = self.watches[ng.watched][1]
+                        bucket.remove( ng )
+                        if len(bucket) == 0 :
+                                del self.watches[ng.watched]
+                        for lit in ng.literals :
+                                others = self.containing[lit]
+                                others.discard( ng )
+                                if len(others) == 0 :
+                                        del self.containing[lit]
+                ng.stored = False
+                self.size -= 1
+
+        # Returns a no-good satisfied by the (primary) state: of type 1
+        # for the given action if action_index is not None, or of type 0
+        # otherwise. Returns None if there is no such no-good.
+        def find_violated( self, state, action_index = None ) :
+                if action_index is not None :
+                        for ng in self.by_action.get( action_index, () ) :
+                                if state.satisfies_compiled( ng.compiled ) :
+                                        ng.pruned += 1
+                                        return ng
+                        return None
+                for ng in self.unconditional :
+                        ng.pruned += 1
+                        return ng
+                for bucket in self.watched_buckets( state ) :
+                        for ng in bucket :
+                                if state.satisfies_compiled( ng.compiled ) :
+                                        ng.pruned += 1
+                                        return ng
+                return None
+
+        # Returns the buckets of the type 0 no-goods whose watched literal
+        # may hold in the state: those of the literals of the state, or,
+        # if fewer literals are watched than the task has variables, those
+        # of the watched literals that hold in it.
+        def watched_buckets( self, state ) :
+                if len(self.watches) <= len(self.task.state_vars) :
+                        for watched, bucket in self.watches.values() :
+                                if state.satisfies_compiled( watched ) :
+                                        yield bucket
+                        return
+                for lit in state.iter_values() :
+                        entry = self.watches.get( lit )
+                        if entry is not None :
+                                yield entry[1]
+
+        # True if applying the action in (relaxed) state s violates a
+        # no-good: a type 1 no-good of the action that holds in s, or a
+        # type 0 no-good that holds after the effect is applied.
+        def prunes( self, s, action ) :
+                if self.find_violated( s, action.index ) is not None :
+                        return True
+                if len(self.watches) == 0 and len(self.unconditional) == 0 :
+                        return False
+                succ = s.copy()
+                if s.relaxed :
+                        succ.relaxed_apply_compiled( action.compiled_effect )
+                else :
+                        succ.apply_compiled( action.compiled_effect )
+                return self.find_violated( succ ) is not None
+
+        def print_statistics( self ) :
+                ng_lens = [ len(ng) for ng in self ]
+                if len(ng_lens) == 0 :
+                        biggest_no_good = smallest_no_good = 0
+                else :
+                        biggest_no_good = max( ng_lens )
+                        smallest_no_good = min( ng_lens )
+                logging.info( 'No Good Learning: # Lits in Biggest No Good {0} # Lits in Smallest No Good {1}'.format( biggest_no_good, smallest_no_good ) )
+                logging.info( 'No Good Learning: # No Goods: {0} # Subsumed: {1} # Evicted: {2}'.format( len(self), self.num_subsumed, self.num_evicted ) )
@@ -0,0 +1,472 @@
+from         __future__         import         print_function
+
+import logging
+import multiprocessing
+import time
+
+from collections import OrderedDict
+
+# Try importing gurobi: constraints of a real Gurobi model can be switched
+# on and off in place. The other model classes (fake gurobi, the PSR server
+# client) don't support this, so for them we fall back on copying the model
+# and removing the inactive constraints for every query.
+_GurobiModel = None
+try:
+        from gurobipy                import         Model as _GurobiModel, GRB
+        if GRB.VERSION == 'Fake':
+                _GurobiModel = None
+except ImportError:
+        pass
+except AttributeError:
+        pass
+
+#TIMER_FUN = time.clock
+TIMER_FUN = time.time
+
+xrange = range
+
+# Gurobi environment in which this process makes its models, or None
+# for the default one. A process forked from the planner can't use the
+# environment it inherits, so worker processes call init_worker_env()
+# before they make or copy any model.
+_worker_env = None
+
+def init_worker_env() :
+        global _worker_env
+        if _GurobiModel is None :
+                return
+        from gurobipy import Env
+        env = Env( empty = True )
+        env.setParam( 'OutputFlag', 0 )
+        env.start()
+        _worker_env = env
+
+def gurobi_env() :
+        return _worker_env
+
+# Returns a copy of a solver model, in the environment of this process
+# if it is a Gurobi model.
+def copy_model( model ) :
+        if _worker_env is not None and isinstance( model, _GurobiModel ) :
+                return model.copy( _worker_env )
+        return model.copy()
+
+class SecondaryModel :
+        """
+        Consistency checker for the secondary model of a hybrid task.
+
+        Keeps a single solver model per task, and answers the question
+        whether a given set of (switched) constraints is satisfiable.
+        Constraints of a Gurobi model are switched off by giving them a
+        free slack variable, and on again by fixing the slack to zero, so
+        that a query only changes the bounds of the constraints whose
+        status differs from the previous query.
+
+        Answers are memoized by the (frozen) set of active constraints, in
+        a cache of at most CACHE_SIZE entries with least-recently-used
+        eviction (None means unbounded, 0 disables the cache).
+
+        Since the secondary model is a conjunction, a set of constraints
+        that contains a known infeasible core is infeasible, and a set that
+        is contained in a known feasible set is feasible (and satisfied by
+        the same valuation). If SUBSUMPTION is True, queries that miss the
+        cache are answered from an index of such sets when possible,
+        before calling the solver. The indices are bounded, and evict
+        their entries, like the cache.
+
+        If WARM_START is True, the optimal simplex basis found for a state
+        is returned with the answer, and a later check can be given it to
+        start from (e.g., the basis of the parent when checking a child
+        state, whose active constraints differ in only a few). Bases are
+        not kept in the cache: a check answered from the cache or by
+        subsumption returns no basis. This only
+        applies to LPs solved in place: the other model classes don't
+        expose a basis, and a pruned copy of the model has a different
+        shape for every query.
+        """
+
+        CACHE_SIZE = 100000
+        SUBSUMPTION = True
+        WARM_START = True
+
+        calls_to_optimize = 0
+        cache_hits = 0
+        cache_misses = 0
+        subsumption_hits = 0
+        prefetched = 0
+        warm_starts = 0
+        total_time_optimize = 0
+        total_time_model_building = 0
+        models_created = 0
+
+        def __init__( self, lp ) :
+                self.lp = lp
+                self.num_constraints = len(lp.constraints)
+                self.relax_in_place = _GurobiModel is not None and isinstance( lp.model, _GurobiModel )
+                self.model = None
+                self.cache = OrderedDict() # active set -> (valid, valuation, conflict, IIS computed)
+                self.infeasible_cores = CoreIndex( self.CACHE_SIZE )
+                self.feasible_sets = FeasibleSetIndex( self.CACHE_SIZE )
+                if self.relax_in_place :
+                        t0 = TIMER_FUN()
+                        self.model = copy_model( lp.model )
+                        self.model.update()
+                        self.constrs = self.model.getConstrs()
+                        self.num_vars = self.model.numvars
+                        # one slack variable per constraint, created up front
+                        # so that all bases taken from the model have the
+                        # same shape
+                        self.slacks = [ self.model.addVar( lb = 0.0, ub = 0.0, name = 'slack_{0}'.format(i) ) for i in xrange( self.num_constraints ) ]
+                        self.model.update()
+                        for i in xrange( self.num_constraints ) :
+                                self.model.chgCoeff( self.constrs[i], self.slacks[i], 1.0 )
+                        self.model.update()
+                        self.switched_off = set()
+                        self.is_mip = self.model.getAttr( 'IsMIP' ) != 0
+                        SecondaryModel.total_time_model_building += TIMER_FUN() - t0
+                        SecondaryModel.models_created += 1
+
+        # Returns a tuple (valid, valuation, conflict, basis). The
+        # valuation is a list of pairs (index, value) of the secondary
+        # variables if the constraints are satisfiable; conflict is a list
+        # of indices of active constraints that are jointly unsatisfiable,
+        # computed only if extract_no_good is True. basis is the optimal
+        # basis, or None if there isn't one (see WARM_START); if a basis
+        # is given, the solver starts from it.
+        def check( self, active, extract_no_good = False, basis = None ) :
+                key = frozenset( active )
+                entry = self.cache.get( key )
+                # an infeasible entry stored without its conflict can't
+                # answer a query that asks for one
+                if entry is not None and ( entry[0] or entry[3] or not extract_no_good ) :
+                        SecondaryModel.cache_hits += 1
+                        self.cache.move_to_end( key )
+                        return entry[0], entry[1], entry[2], None
+                SecondaryModel.cache_misses += 1
+                if self.SUBSUMPTION :
+                        entry = self.check_subsumption( key, extract_no_good )
+                        if entry is not None :
+                                SecondaryModel.subsumption_hits += 1
+                                self.store( key, entry )
+                                return entry[0], entry[1], entry[2], None
+                if self.relax_in_place :
+                        valid, valuation, conflict, basis = self.check_in_place( key, extract_no_good, basis )
+                else :
+                        valid, valuation, conflict = self.check_on_copy( key, extract_no_good )
+                        basis = None
+                self.record( key, valid, valuation, conflict, extract_no_good )
+                return valid, valuation, conflict, basis
+
+        # Stores the answer to a check in the cache and, if SUBSUMPTION
+        # is on, in the index of feasible sets or infeasible cores.
+        def record( self, key, valid, valuation, conflict, extract_no_good ) :
+                self.store( key, ( valid, valuation, conflict, extract_no_good ) )
+                if self.SUBSUMPTION :
+                        if valid :
+                                self.feasible_sets.add( key, valuation )
+                        elif extract_no_good and len(conflict) > 0 :
+                                self.infeasible_cores.add( frozenset( conflict ), True )
+                        else :
+                                self.infeasible_cores.add( key, False )
+
+        # Answers, on the CheckPool pool, the checks of the active sets
+        # that are neither in the cache nor implied by subsumption, and
+        # records the answers, so that check() then finds all of them.
+        # Does nothing if the cache is disabled.
+        def prefetch( self, active_sets, pool ) :
+                if self.CACHE_SIZE == 0 :
+                        return
+                pending = []
+                seen = set()
+                for active in active_sets :
+                        key = frozenset( active )
+                        if key in seen or key in self.cache :
+                                continue
+                        seen.add( key )
+                        if self.SUBSUMPTION and self.check_subsumption( key, False ) is not None :
+                                continue
+                        pending.append( key )
+                if len(pending) == 0 :
+                        return
+                for key, ( valid, valuation, conflict ) in zip( pending, pool.check_all( pending ) ) :
+                        self.record( key, valid, valuation, conflict, False )
+                SecondaryModel.prefetched += len(pending)
+
+        # Returns a cache entry for the active set if it is implied by a
+        # known feasible superset or infeasible subset, or None.
+        def check_subsumption( self, active, extract_no_good ) :
+                valuation = self.feasible_sets.find_superset( active )
+                if valuation is not None :
+                        return True, valuation, [], False
+                core = self.infeasible_cores.find_subset( active, extract_no_good )
+                if core is not None :
+                        core, is_iis = core
+                        return False, [], sorted( core ) if is_iis else [], is_iis
+                return None
+
+        def store( self, key, entry ) :
+                if self.CACHE_SIZE == 0 :
+                        return
+                self.cache[key] = entry
+                self.cache.move_to_end( key )
+                if self.CACHE_SIZE is not None :
+                        while len(self.cache) > self.CACHE_SIZE :
+                                self.cache.popitem( last = False )
+
+        def switch_constraints( self, active ) :
+                t0 = TIMER_FUN()
+                off = set( [ i for i in xrange( self.num_constraints ) if i not in active ] )
+                for i in self.switched_off - off :
+                        self.slacks[i].setAttr( 'LB', 0.0 )
+                        self.slacks[i].setAttr( 'UB', 0.0 )
+                for i in off - self.switched_off :
+                        self.slacks[i].setAttr( 'LB', -GRB.INFINITY )
+                        self.slacks[i].setAttr( 'UB', GRB.INFINITY )
+                self.switched_off = off
+                self.model.update()
+                SecondaryModel.total_time_model_building += TIMER_FUN() - t0
+
+        # The basis is a pair of lists, of the VBasis of each variable and
+        # the CBasis of each constraint.
+        def get_basis( self, model_vars ) :
+                return ( self.model.getAttr( 'VBasis', model_vars ), self.model.getAttr( 'CBasis', self.constrs ) )
+
+        def set_basis( self, model_vars, basis ) :
+                vbasis, cbasis = basis
+                self.model.setAttr( 'VBasis', model_vars, vbasis )
+                self.model.setAttr( 'CBasis', self.constrs, cbasis )
+                SecondaryModel.warm_starts += 1
+
+        def check_in_place( self, active, extract_no_good, basis = None ) :
+                self.switch_constraints( active )
+                warm_start = self.WARM_START and not self.is_mip
+                if warm_start and basis is not None :
+                        self.set_basis( self.model.getVars(), basis )
+                t0 = TIMER_FUN()
+                self.model.optimize()
+                SecondaryModel.calls_to_optimize += 1
+                SecondaryModel.total_time_optimize += TIMER_FUN() - t0
+                if self.model.status == 2 :
+                        model_vars = self.model.getVars()
+                        valuation = [ ( i, model_vars[i].x ) for i in xrange( self.num_vars ) ]
+                        return True, valuation, [], self.get_basis( model_vars ) if warm_start else None
+                conflict = []
+                if self.model.status in ( 3, 4 ) and extract_no_good :
+                        self.model.computeIIS()
+                        for i in active :
+                                if self.constrs[i].getAttr('IISConstr') :
+                                        conflict.append( i )
+                                else :
+                                        # the constraint may be in the IIS through
+                                        # the (zero) bounds on its slack variable
+                                        slack = self.slacks[i]
+                                        if slack.getAttr('IISLB') or slack.getAttr('IISUB') :
+                                                conflict.append( i )
+                return False, [], conflict, None
+
+        def check_on_copy( self, active, extract_no_good ) :
+                t0 = TIMER_FUN()
+                model = copy_model( self.lp.model )
+                remaining = []
+                for index in xrange( self.num_constraints ) :
+                        if index in active :
+                                remaining.append( index )
+                                continue
+                        try :
+                                model.remove( model.getConstrs()[index] )
+                        except IndexError :
+                                print( 'index {0} # constraints in LP object: {1} # constraints in Gurobi obj: {2}'.format( index, len(self.lp.constraints), len(model.getConstrs()) ) )
+                                raise
+                model.update()
+                SecondaryModel.total_time_model_building += TIMER_FUN() - t0
+                SecondaryModel.models_created += 1
+                if model.status != 1 :
+                        model.reset()
+                t0 = TIMER_FUN()
+                model.optimize()
+                SecondaryModel.calls_to_optimize += 1
+                SecondaryModel.total_time_optimize += TIMER_FUN() - t0
+                if model.status == 2 :
+                        return True, [ ( i, model.getVars()[i].x ) for i in xrange( model.numvars ) ], []
+                conflict = []
+                if model.status in ( 3, 4 ) and extract_no_good :
+                        model.computeIIS()
+                        for i, C in enumerate( model.getConstrs() ) :
+                                if C.getAttr('IISConstr') :
+                                        conflict.append( remaining[i] )
+                return False, [], conflict
+
+        def write( self, active, fileobj ) :
+                for i in active :
+                        print( i, ": ", self.lp.constraints[i][1], file=fileobj )
+
+        @staticmethod
+        def print_statistics() :
+                logging.info( '# Calls to optimize(): {0} Total Time: {1}'.format( SecondaryModel.calls_to_optimize, SecondaryModel.total_time_optimize) )
+                logging.info( '# Consistency cache hits: {0} misses: {1}'.format( SecondaryModel.cache_hits, SecondaryModel.cache_misses ) )
+                logging.info( '# Consistency checks answered by subsumption: {0}'.format( SecondaryModel.subsumption_hits ) )
+                if SecondaryModel.prefetched > 0 :
+                        logging.info( '# Consistency checks answered by worker processes: {0}'.format( SecondaryModel.prefetched ) )
+                logging.info( '# Warm-started optimize() calls: {0}'.format( SecondaryModel.warm_starts ) )
+                logging.info( '# Models created: {0} Total Time: {1}'.format( SecondaryModel.models_created, SecondaryModel.total_time_model_building ) )
+
+
+class CheckPool :
+        """
+        Worker processes, forked from the planner, that answer
+        consistency checks, each on a SecondaryModel of its own, in a
+        Gurobi environment of its own (see SecondaryModel.prefetch and
+        init_worker_env). Answers come back in the order of the queries.
+        The processes run until close() is called.
+        """
+
+        def __init__( self, lp, num_workers ) :
+                ctx = multiprocessing.get_context( 'fork' )
+                self.num_workers = num_workers
+                self.pool = ctx.Pool( num_workers, initializer = init_check_worker, initargs = ( lp, ) )
+
+        # Returns a triple (valid, valuation, conflict) for each active
+        # set (see SecondaryModel.check).
+        def check_all( self, active_sets ) :
+                chunksize = max( 1, len(active_sets) // ( 4 * self.num_workers ) )
+                return self.pool.map( check_in_worker, active_sets, chunksize )
+
+        def close( self ) :
+                self.pool.terminate()
+                self.pool.join()
+
+worker_model = None
+
+def init_check_worker( lp ) :
+        global worker_model
+        init_worker_env()
+        worker_model = SecondaryModel( lp )
+
+def check_in_worker( active ) :
+        valid, valuation, conflict, _ = worker_model.check( active )
+        return valid, valuation, conflict
+
+class CoreIndex :
+        """
+        Set of infeasible constraint sets, kept minimal w.r.t. inclusion,
+        of at most max_size cores (None means unbounded) with least-
+        recently-used eviction. Each core is stored in the bucket of each
+        of its elements: the cores contained in a set are those found in
+        the buckets of its elements as many times as they have elements,
+        and the cores containing a set are in the bucket of each of its
+        elements.
+        """
+
+        def __init__( self, max_size = None ) :
+                self.max_size = max_size
+                self.cores = OrderedDict() # core -> is_iis
+                self.buckets = {} # element -> set of cores
+                self.empty = None
+
+        def __len__( self ) :
+                return len(self.cores)
+
+        # is_iis tells whether the core was computed as an IIS; otherwise
+        # it is just a set of constraints known to be infeasible, and is
+        # not returned when a conflict is asked for.
+        def add( self, core, is_iis ) :
+                if len(core) == 0 :
+                        self.empty = ( core, is_iis )
+                        return
+                if self.max_size == 0 or self.find_subset( core, is_iis ) is not None :
+                        return
+                smallest = min( [ self.buckets.get( e, () ) for e in core ], key = len )
+                for c in [ c for c in smallest if core <= c and ( is_iis or not self.cores[c] ) ] :
+                        self.remove( c )
+                self.cores[core] = is_iis
+                for e in core :
+                        self.buckets.setdefault( e, set() ).add( core )
+                if self.max_size is not None :
+                        while len(self.cores) > self.max_size :
+                                self.remove( next( iter( self.cores ) ) )
+
+        def remove( self, core ) :
+                del self.cores[core]
+                for e in core :
+                        bucket = self.buckets[e]
+                        bucket.discard( core )
+                        if len(bucket) == 0 :
+                                del self.buckets[e]
+
+        def find_subset( self, query, need_iis = False ) :
+                if self.empty is not None and ( self.empty[1] or not need_iis ) :
+                        return self.empty
+                hits = {}
+                for e in query :
+                        for core in self.buckets.get( e, () ) :
+                                n = hits.get( core, 0 ) + 1
+                                hits[core] = n
+                                if n == len(core) and ( self.cores[core] or not need_iis ) :
+                                        self.cores.move_to_end( core )
+                                        return core, self.cores[core]
+                return None
+
+class FeasibleSetIndex :
+        """
+        Set of feasible constraint sets, together with a satisfying
+        valuation of the secondary variables for each, kept maximal w.r.t.
+        inclusion, of at most max_size sets (None means unbounded) with
+        least-recently-used eviction. Each set is stored in the bucket of
+        each of its elements; a query looks only in the smallest bucket of
+        its own elements, and the sets contained in a new set are found,
+        by counting, in the buckets of its elements.
+        """
+
+        def __init__( self, max_size = None ) :
+                self.max_size = max_size
+                self.sets = OrderedDict() # set -> valuation
+                self.buckets = {} # element -> set of sets
+
+        def __len__( self ) :
+                return len(self.sets)
+
+        def add( self, feasible, valuation ) :
+                if self.max_size == 0 or self.find_superset( feasible ) is not None :
+                        return
+                subsumed = [ frozenset() ] if frozenset() in self.sets else []
+                hits = {}
+                for e in feasible :
+                        for F in self.buckets.get( e, () ) :
+                                n = hits.get( F, 0 ) + 1
+                                hits[F] = n
+                                if n == len(F) :
+                                        subsumed.append( F )
+                for F in subsumed :
+                        self.remove( F )
+                self.sets[feasible] = valuation
+                for e in feasible :
+                        self.buckets.setdefault( e, set() ).add( feasible )
+                if self.max_size is not None :
+                        while len(self.sets) > self.max_size :
+                                self.remove( next( iter( self.sets ) ) )
+
+        def remove( self, feasible ) :
+                del self.sets[feasible]
+                for e in feasible :
+                        bucket = self.buckets[e]
+                        bucket.discard( feasible )
+                        if len(bucket) == 0 :
+                                del self.buckets[e]
+
+        def find_superset( self, query ) :
+                if len(query) == 0 :
+                        if len(self.sets) == 0 :
+                                return None
+                        return self.sets[ next( reversed( self.sets ) ) ]
+                smallest = None
+                for e in query :
+                        bucket = self.buckets.get( e )
+                        if bucket is None :
+                                return None
+                        if smallest is None or len(bucket) < len(smallest) :
+                                smallest = bucket
+                for F in smallest :
+                        if query <= F :
+                                self.sets.move_to_end( F )
+                                return self.sets[F]
+                return None
@@ -2,91 +2,72 @@ from         __future__         import         print_function
 
 import sys
 import logging
-import time
-
-#TIMER_FUN = time.clock
-TIMER_FUN = time.time
 
 xrange = range
 
 class HybridState :
 
-        calls_to_optimize = 0
-        total_time_optimize = 0
-        total_time_model_building = 0
-        models_created = 0
+        # Search keeps every generated state, so states have fixed slots
+        # rather than a __dict__
+        __slots__ = ( 'primary', 'valid', 'conflict', 'secondary', 'active', 'secondary_valuation', 'basis', 'lp' )
 
-        def __init__(self, ps, lp, inactive ) :
+        # secondary is the SecondaryModel of the task, or None if
+        # the task has no secondary model. inactive is the set of
+        # indices of constraints that are off regardless of their
+        # trigger (it is not modified). triggers, if given, are the
+        # switched constraint triggers compiled against the primary task
+        # (see HybridTask).
+        def __init__(self, ps, secondary, inactive, triggers = None ) :
 
                 self.primary = ps
                 self.valid = None
-                self.active = []
                 self.conflict = []
-                self.secondary = self.project_inactive_constraints( lp, inactive )
-                self.inactive = inactive
+                self.secondary = secondary
+                self.active = self.find_active_constraints( secondary, inactive, triggers )
                 self.secondary_valuation = []
+                # optimal basis of the secondary model, if any; dropped once the
+                # state has been expanded, as only its successors use it
+                self.basis = None
                 # hold a pointer to the lp only to be able to print variable names
-                self.lp = lp
+                self.lp = None if secondary is None else secondary.lp
 
-        def project_inactive_constraints( self, lp, inactive ) :
-                #print("project inactive: lp =", lp, ", inactive =", inactive)
-                if lp is None : return None
-        
+        # Returns the (frozen) set of indices of constraints that are
+        # active, i.e., whose trigger holds in the primary state and that
+        # are not explicitly inactive.
+        def find_active_constraints( self, secondary, inactive, triggers = None ) :
+                if secondary is None : return None
+                lp = secondary.lp
+
+                if triggers is None :
+                        triggers = [ phi_i for phi_i, _ in lp.constraints ]
+                        satisfies = self.primary.satisfies
+                else :
+                        satisfies = self.primary.satisfies_compiled
+                active = []
                 for i in xrange( len(lp.constraints) ) :
-                        phi_i, _ = lp.constraints[i]
                         # Check whether phi is true under current primary state
-                        if self.primary.satisfies( phi_i ) : 
-                                self.active.append(i)
-                                continue
-                        inactive.add( i )
-                t0 = TIMER_FUN()
-                model = lp.model.copy()
-                for index in inactive :
-                        try :
-                                model.remove( model.getConstrs()[index] )
-                        except IndexError :
-                                print( 'index {0} # constraints in LP object: {1} # constraints in Gurobi obj: {2}'.format( index, len(lp.constraints), len(model.getConstrs()) ) )
-                                raise
-                                #sys.exit(1)
-                model.update()
-                HybridState.total_time_model_building += TIMER_FUN() - t0
-                HybridState.models_created += 1
-                #print("project inactive: model =", model)
-                return model
+                        if i not in inactive and satisfies( triggers[i] ) :
+                                active.append(i)
+                return frozenset( active )
 
-        def check_valid( self, extract_no_good = False ) :
-                # If self.secondary and self.value are both None, that means the
-                # hybrid state was created with lp = None, i.e., that there is no
-                # secondary model; in this case, set valid to true. If, on the
-                # other hand, self.secondary is None but self.valid is not, that
-                # means the state's validity has already been checked, so we don't
+        # If parent is given, the consistency check is warm-started
+        # from its basis (see SecondaryModel).
+        def check_valid( self, extract_no_good = False, parent = None ) :
+                # If self.secondary is None, that means either that the
+                # hybrid state was created without a secondary model, or
+                # that the state's validity has already been checked. In
+                # the first case, set valid to true; in the second, don't
                 # modify it. In either case, return without further checking.
                 if self.secondary is None:
                         if self.valid is None:
                                 self.valid = True
                         return
                 # this is the case when we need to run a consistency check
-                if self.secondary.status != 1 :
-                        self.secondary.reset()
-                t0 = TIMER_FUN()
-                self.secondary.optimize()
-                HybridState.calls_to_optimize += 1
-                HybridState.total_time_optimize += TIMER_FUN() - t0
-                #self.secondary.write( 'last_projected.lp' )
-                if self.secondary.status == 2 : 
-                        self.valid = True
-                        # extract assignment to secondary variables
-                        self.secondary_valuation = [ ( i, self.secondary.getVars()[i].x ) for i in xrange( self.secondary.numvars ) ]
-                elif self.secondary.status in ( 3, 4 ) :
-                        self.valid = False
-                        if extract_no_good :
-                                self.conflict = []
-                                self.secondary.computeIIS()
-                                for i, C in enumerate( self.secondary.getConstrs() ) :
-                                        if C.getAttr('IISConstr') :                        
-                                                self.conflict.append( self.active[i] )
-                                logging.info( 'Conflict constraints: {0}'.format(len(self.conflict) ) )
-                del self.secondary
+                basis = getattr( parent, 'basis', None )
+                self.valid, self.secondary_valuation, conflict, self.basis = self.secondary.check( self.active, extract_no_good, basis )
+                if not self.valid and extract_no_good :
+                        self.conflict = conflict
+                        logging.info( 'Conflict constraints: {0}'.format(len(self.conflict) ) )
                 self.secondary = None
 
         
@@ -104,9 +85,8 @@ class HybridState :
                 print("valid?:", self.valid)
                 if self.secondary is not None:
                         print("constraints:")
-                        for i, C in enumerate( self.secondary.getConstrs() ) :
-                                print(i, ": ", C, file=fileobj)
-                        print("inactive:", self.inactive, file=fileobj)
+                        self.secondary.write( sorted(self.active), fileobj )
+                        print("inactive:", set( xrange( len(self.lp.constraints) ) ) - self.active, file=fileobj)
                 print("secondary valuation:")
                 for (i,v) in self.secondary_valuation:
                         assert i >= 0 and i < len(self.lp.variables)
@@ -1,6 +1,11 @@
 from    __future__      import print_function
 from         .state                import        HybridState
+from         .secondary        import        SecondaryModel, CheckPool
+from         .no_goods        import        NoGoodDatabase
+from         model.generic.planning.successor_generator        import        SuccessorGenerator
+from         collections        import        OrderedDict
 import         logging
+import         os
 import  sys
 
 # static helper function: 
@@ -12,33 +17,86 @@ def get_primary(s):
                 
 
 class HybridTask :
+
+        # The results of check_secondary_precondition,
+        # check_postcondition_validity and check_secondary_goal are
+        # cached, keyed on the action (or goal) and the literals of the
+        # variables in the triggers of the constraints the check may
+        # switch on, since the set of active constraints, and so the
+        # result, depends only on these. At most CHECK_CACHE_SIZE
+        # entries are kept, the least recently used are evicted first
+        # (None means unbounded, 0 disables the cache).
+        CHECK_CACHE_SIZE = 100000
+
+        check_cache_hits = 0
+        check_cache_misses = 0
+
+        # Number of worker processes that check the consistency of the
+        # candidate successor states in get_successor_states_batch (1
+        # checks them in this process), set by the environment variable
+        # CHECK_WORKERS. Tasks take it as the default of their
+        # check_workers attribute.
+        CHECK_WORKERS = int( os.environ.get( 'CHECK_WORKERS', 1 ) )
         
         def __init__( self, task, lp, s0, primary_G, secondary_G = set() ) :
 
                 self.task = task
                 self.lp        = lp
+                self.secondary = None if lp is None else SecondaryModel( lp )
                 self.prim_s0 = s0
                 self.Gp = primary_G
                 self.Gs = secondary_G
                 self.inactive_by_default = set()
                 self.inactive_by_default |= self.Gs
                 self.actions = self.task.actions
-                self.no_good_list = []
+                self.no_goods = NoGoodDatabase( task )
                 self.num_conflicts = 0
                 self.pruned_ngl = 0
                 self.num_actions_added = 0
+                self.successor_generator = None
+                self.check_workers = HybridTask.CHECK_WORKERS
+                self.check_pool = None
+                self.actions_version = 0 # incremented whenever an action is (re)compiled
+                self.check_cache = OrderedDict() # (check, relaxed, projected state) -> result
+                self.check_projections = {} # check -> variables its result depends on
+                self.check_cache_version = None
                 i = 0
                 for action in self.actions :
                         action.index = i
                         self.inactive_by_default |= action.sec_precs
                         i+=1
+                self.compile_valuations()
                 
                 if self.prim_s0 is not None :
-                        self.s0 = self.initial_state = HybridState( self.prim_s0, self.lp, self.inactive_by_default.copy() )
+                        self.s0 = self.initial_state = HybridState( self.prim_s0, self.secondary, self.inactive_by_default, self.triggers )
                 #assert self.s0.secondary is not None
 
+        # Compiles action preconditions and effects, the primary goal
+        # and the triggers of the switched constraints into literal
+        # offsets and masks (see CompiledValuation). This must be
+        # redone if actions are added or their preconditions changed.
+        def compile_valuations( self ) :
+                for action in self.actions :
+                        self.compile_action( action )
+                self.compiled_Gp = self.task.compile_valuation( self.Gp )
+                if self.lp is None :
+                        self.triggers = None
+                else :
+                        self.triggers = [ self.task.compile_valuation( phi ) for phi, _ in self.lp.constraints ]
+
+        def compile_action( self, action ) :
+                self.successor_generator = None # built again on demand
+                self.actions_version += 1
+                action.compiled_precs = self.task.compile_valuation( action.prim_precs )
+                action.compiled_effect = self.task.compile_valuation( action.effect )
+                # the primary postcondition: the effect, plus the
+                # preconditions on variables that the effect doesn't change
+                assigned_vars = [var for var, val in action.effect]
+                post = list(action.effect) + [ (var, val) for var, val in action.prim_precs if var not in assigned_vars ]
+                action.compiled_post = self.task.compile_valuation( post )
+
         def set_initial_state( self, s ) :
-                self.s0 = self.initial_state = HybridState( s, self.lp, self.inactive_by_default.copy() )
+                self.s0 = self.initial_state = HybridState( s, self.secondary, self.inactive_by_default, self.triggers )
 
         # Check if action secondary preconditions hold in s. This
         # will always use the stronger ("1st weaker") relaxation, i.e.,
@@ -51,51 +109,118 @@ class HybridTask :
         # Args: s can be either a HybridState or a (primary) State;
         #       action is a model.generic.planning.Action
         def check_secondary_precondition( self, s, action ) :
-                s_p = get_primary(s).copy()
-                s_p.set_vec(action.prim_precs)
-                return self.check_validity_additional_constraints( s_p, action.sec_precs )
+                key = self.check_key( ( 'pre', action.index ), s, action.prim_precs, action.sec_precs )
+                result = self.cached_check( key )
+                if result is None :
+                        s_p = get_primary(s).copy()
+                        s_p.apply_compiled(action.compiled_precs)
+                        result = self.check_validity_additional_constraints( s_p, action.sec_precs, s )
+                        self.store_check( key, result )
+                return result
 
         # Check if actions effects (on real or relaxed state) are
         # consistent with invariant constraints.
         def check_postcondition_validity(self, s, action):
-                s_p = get_primary(s).copy()
-                s_p.set_vec(action.effect)
-                assigned_vars = [var for var, val in action.effect]
-                for var, val in action.prim_precs:
-                        if var not in assigned_vars:
-                                s_p.set(var, val)
-                result = self.check_validity_additional_constraints(s_p, set())
+                key = self.check_key( ( 'post', action.index ), s, list(action.prim_precs) + list(action.effect), set() )
+                result = self.cached_check( key )
+                if result is None :
+                        s_p = get_primary(s).copy()
+                        s_p.apply_compiled(action.compiled_post)
+                        result = self.check_validity_additional_constraints(s_p, set(), s)
+                        self.store_check( key, result )
                 return result
 
         # Check if secondary goal holds in s. As in check_secondary_prec,
         # this uses the 1st weaker relaxation, and invokes the external
         # solver also if there are no secondary goals.
         def check_secondary_goal( self, s ) :
-                if len(self.Gp) > 0:
-                        s_p = get_primary(s).copy()
-                        s_p.set_vec(self.Gp)
-                        s = s_p
-                result = self.check_validity_additional_constraints( s, self.Gs )
+                key = self.check_key( ( 'goal', ), s, self.Gp, self.Gs )
+                result = self.cached_check( key )
+                if result is None :
+                        if len(self.Gp) > 0:
+                                s_p = get_primary(s).copy()
+                                s_p.apply_compiled(self.compiled_Gp)
+                                s = s_p
+                        result = self.check_validity_additional_constraints( s, self.Gs )
+                        self.store_check( key, result )
                 return result
+
+        # Returns the key of the check in the cache, or None if the
+        # check isn't cached. fixed is the valuation that the check
+        # imposes on the state, and additional the constraints that it
+        # switches on besides those on by default.
+        def check_key( self, check, s, fixed, additional ) :
+                if self.secondary is None or self.CHECK_CACHE_SIZE == 0 :
+                        return None
+                if self.check_cache_version != self.actions_version :
+                        self.check_cache.clear()
+                        self.check_projections = {}
+                        self.check_cache_version = self.actions_version
+                try :
+                        projection = self.check_projections[check]
+                except KeyError :
+                        projection = self.check_projections[check] = self.trigger_projection( fixed, additional )
+                s = get_primary(s)
+                return ( check, s.relaxed, s.projection_key( projection ) )
+
+        # The variables, except those in fixed, of the triggers of the
+        # constraints that may be active, compiled so that states can
+        # be projected on them.
+        def trigger_projection( self, fixed, additional ) :
+                if additional is None :
+                        inactive = self.inactive_by_default
+                else :
+                        inactive = self.inactive_by_default - additional
+                fixed_vars = set( [ x for x, v in fixed ] )
+                relevant = set()
+                for i, ( phi, _ ) in enumerate( self.lp.constraints ) :
+                        if i in inactive : continue
+                        relevant.update( [ x for x, v in phi if x not in fixed_vars ] )
+                return self.task.compile_valuation( [ ( x, self.task.state_vars[x].domain[0] ) for x in sorted(relevant) ] )
+
+        def cached_check( self, key ) :
+                if key is None :
+                        return None
+                result = self.check_cache.get( key )
+                if result is None :
+                        HybridTask.check_cache_misses += 1
+                        return None
+                HybridTask.check_cache_hits += 1
+                self.check_cache.move_to_end( key )
+                return result
+
+        def store_check( self, key, result ) :
+                if key is None :
+                        return
+                self.check_cache[key] = result
+                if self.CHECK_CACHE_SIZE is not None :
+                        while len(self.check_cache) > self.CHECK_CACHE_SIZE :
+                                self.check_cache.popitem( last = False )
+
+        @staticmethod
+        def print_check_statistics() :
+                logging.info( '# Relaxed consistency check cache hits: {0} misses: {1}'.format( HybridTask.check_cache_hits, HybridTask.check_cache_misses ) )
         
-        def check_validity_additional_constraints( self, s, additional ) :
+        # parent, if given, is the state whose basis the consistency
+        # check is warm-started from.
+        def check_validity_additional_constraints( self, s, additional, parent = None ) :
                 if additional is None:
                         inactive = self.inactive_by_default
                 else:
                         inactive = self.inactive_by_default - additional
                 #logging.debug( 'Checking validity with {0} additional constraints'.format( len(additional)) )
                 try :
-                        tmp = HybridState( s.primary, self.lp, inactive.copy() )
+                        tmp = HybridState( s.primary, self.secondary, inactive, self.triggers )
                 except AttributeError :
-                        tmp = HybridState( s, self.lp, inactive.copy() )
+                        tmp = HybridState( s, self.secondary, inactive, self.triggers )
                 #tmp.write(sys.stdout)
-                tmp.check_valid()
+                tmp.check_valid( parent = parent )
                 if not tmp.valid :
                         return False
                 return True
 
         def is_applicable( self, s, action ) :
-                if not s.primary.satisfies( action.prim_precs ) :
+                if not s.primary.satisfies_compiled( action.compiled_precs ) :
                         return False # action is not applicable
                 if len( action.sec_precs ) != 0 :
                         if not self.check_secondary_precondition( s, action ) :
@@ -109,10 +234,10 @@ class HybridTask :
                 if not self.is_applicable( s, action ) : 
                         return None
                 prim_succ = s.primary.copy()
-                prim_succ.set_vec( action.effect )
+                prim_succ.apply_compiled( action.compiled_effect )
         
-                succ = HybridState( prim_succ, self.lp, self.inactive_by_default.copy() )
-                succ.check_valid()
+                succ = HybridState( prim_succ, self.secondary, self.inactive_by_default, self.triggers )
+                succ.check_valid( parent = s )
 
                 if not succ.valid :
                         return None
@@ -126,11 +251,11 @@ class HybridTask :
                 if not self.is_applicable( s, action ) : 
                         return None, False
                 prim_succ = s.primary.copy()
-                prim_succ.set_vec( action.effect )
+                prim_succ.apply_compiled( action.compiled_effect )
 
-                succ = HybridState( prim_succ, self.lp, self.inactive_by_default.copy() )
+                succ = HybridState( prim_succ, self.secondary, self.inactive_by_default, self.triggers )
                 # TODO: No Good Learning, needs to be switchable
-                succ.check_valid(True)
+                succ.check_valid( True, s )
 
                 if not succ.valid :
                         print( 'Action effect:')
@@ -151,10 +276,13 @@ class HybridTask :
                                 new_action = copy.deepcopy(action)
                                 x, v = val
                                 new_action.prim_precs.add( (x,  not v) )
+                                new_action.index = len(self.task.actions)
+                                self.compile_action( new_action )
                                 self.task.actions.append( new_action )
                                 count += 1
                         x,v = no_good[0]
                         action.prim_precs.add( (x,  not v) )
+                        self.compile_action( action )
                         print( '|A|: {0}'.format(len(self.task.actions)) )
                         self.num_actions_added += count
                         return None, True
@@ -169,16 +297,15 @@ class HybridTask :
                 if not self.is_applicable( s, action ) : 
                         return None
                 prim_succ = s.primary.copy()
-        
-                for phi in self.no_good_list :
-                        if prim_succ.satisfies( phi ) : 
-                                self.pruned_ngl += 1
-                                return None                
+                prim_succ.apply_compiled( action.compiled_effect )
+
+                if self.no_goods.find_violated( prim_succ ) is not None :
+                        self.pruned_ngl += 1
+                        return None
 
-                prim_succ.set_vec( action.effect )
-                succ = HybridState( prim_succ, self.lp, self.inactive_by_default.copy() )
+                succ = HybridState( prim_succ, self.secondary, self.inactive_by_default, self.triggers )
                 # TODO: No Good Learning, needs to be switchable
-                succ.check_valid(True)
+                succ.check_valid( True, s )
 
                 if not succ.valid :
                         #print( 'Action effect:')
@@ -191,7 +318,8 @@ class HybridTask :
                                 #self.task.print_valuation( self.lp.constraints[index][0], sys.stdout ) 
                                 for val in phi : 
                                         no_good.append(val)
-                        self.no_good_list.append( no_good )
+                        if len(succ.conflict) > 0 :
+                                self.no_goods.add( no_good )
                         return None
         
                 return succ        
@@ -203,17 +331,15 @@ class HybridTask :
                         return None
                 if not self.is_applicable( s, action ) : 
                         return None
-                prim_succ = s.primary.copy()
-        
-                for phi, index in self.no_good_list :
-                        if prim_succ.satisfies( phi ) and action.index == index : 
-                                self.pruned_ngl += 1
-                                return None                
+                if self.no_goods.find_violated( s.primary, action.index ) is not None :
+                        self.pruned_ngl += 1
+                        return None
 
-                prim_succ.set_vec( action.effect )
-                succ = HybridState( prim_succ, self.lp, self.inactive_by_default.copy() )
+                prim_succ = s.primary.copy()
+                prim_succ.apply_compiled( action.compiled_effect )
+                succ = HybridState( prim_succ, self.secondary, self.inactive_by_default, self.triggers )
                 # TODO: No Good Learning, needs to be switchable
-                succ.check_valid(True)
+                succ.check_valid( True, s )
 
                 if not succ.valid :
                         #print( 'Action effect:')
@@ -233,11 +359,13 @@ class HybridTask :
                         for a in self.task.actions :
                                 rule = a.regress( no_good )
                                 if len(rule) == 0 : continue
-                                self.no_good_list.append( ( rule, a.index ) ) 
+                                self.no_goods.add( rule, a.index )
                                 count += 1
                         print count
                         """
-                        self.no_good_list.append( ( action.regress( no_good ), action.index ) )
+                        rule = action.regress( no_good )
+                        if len(succ.conflict) > 0 and rule is not None :
+                                self.no_goods.add( rule, action.index )
 
                         return None
         
@@ -247,24 +375,76 @@ class HybridTask :
                 #print("checking primary goals:", self.Gp)
                 #print("checking secondary goals:", self.Gs)
                 assert s.valid is not None
-                if s.primary.satisfies( self.Gp ) :
+                if s.primary.satisfies_compiled( self.compiled_Gp ) :
                         if len(self.Gs) == 0 : return True
                         #logging.debug( 'Goal requires secondary constraints' )
                         return self.check_secondary_goal( s )
                 return False
 
+        # Returns the actions whose primary preconditions hold in s, in
+        # the order of self.actions; their secondary preconditions are
+        # not checked.
+        def applicable_actions( self, s ) :
+                if self.successor_generator is None :
+                        self.successor_generator = SuccessorGenerator( self.actions )
+                return self.successor_generator.applicable_actions( get_primary(s) )
+
         def successor_states( self, s ) :
-                for a in self.actions :
-                        succ = self.get_successor_state( s )
+                for a in self.applicable_actions( s ) :
+                        succ = self.compute_successor_state( s, a )
                         if succ is None : continue
                         yield succ
 
         # for pyperplan search algorithms
-        def get_successor_states( self, s ) :        
-                for a in self.task.actions :
-                        succ = self.compute_successor_state( s, a )
+        def get_successor_states( self, s, succ_fn = None ) :
+                if succ_fn is None :
+                        succ_fn = self.compute_successor_state
+                for a in self.applicable_actions( s ) :
+                        succ = succ_fn( s, a )
                         if succ is None : continue
                         yield (a, succ)
+                # s is expanded: its basis is no longer needed
+                s.basis = None
+
+        # Returns, for each state, the list of pairs (action, successor)
+        # that get_successor_states( s, succ_fn ) yields. The consistency
+        # checks that this will need (the secondary preconditions of the
+        # applicable actions and the validity of the successors) are
+        # first answered together, on a pool of check_workers processes,
+        # into the cache of the secondary model; the successors are then
+        # generated in order as usual, so the result is the same as with
+        # a single process.
+        def get_successor_states_batch( self, states, succ_fn = None ) :
+                if self.check_workers > 1 and self.secondary is not None :
+                        self.prefetch_checks( states )
+                return [ list( self.get_successor_states( s, succ_fn ) ) for s in states ]
+
+        def prefetch_checks( self, states ) :
+                if self.check_pool is None :
+                        self.check_pool = CheckPool( self.lp, self.check_workers )
+                active_sets = []
+                for s in states :
+                        if not s.valid : continue
+                        for action in self.applicable_actions( s ) :
+                                if len( action.sec_precs ) != 0 :
+                                        key = self.check_key( ( 'pre', action.index ), s, action.prim_precs, action.sec_precs )
+                                        if key is None or key not in self.check_cache :
+                                                s_p = s.primary.copy()
+                                                s_p.apply_compiled( action.compiled_precs )
+                                                tmp = HybridState( s_p, self.secondary, self.inactive_by_default - action.sec_precs, self.triggers )
+                                                active_sets.append( tmp.active )
+                                prim_succ = s.primary.copy()
+                                prim_succ.apply_compiled( action.compiled_effect )
+                                succ = HybridState( prim_succ, self.secondary, self.inactive_by_default, self.triggers )
+                                active_sets.append( succ.active )
+                self.secondary.prefetch( active_sets, self.check_pool )
+
+        # Stops the worker processes of get_successor_states_batch, if
+        # any; they are started again if needed.
+        def close_check_pool( self ) :
+                if self.check_pool is not None :
+                        self.check_pool.close()
+                        self.check_pool = None
 
         def find_action( self, action_name ):
                 for act in self.actions:
@@ -298,7 +478,7 @@ class HybridTask :
 
                         prim_succ = state.primary.copy()
                         prim_succ.set_vec( action.effect )
-                        succ = HybridState( prim_succ, self.lp, self.inactive_by_default.copy() )
+                        succ = HybridState( prim_succ, self.secondary, self.inactive_by_default, self.triggers )
                         succ.check_valid()
                         if not succ.valid:
                                 print( "successor state is not valid!" )
@@ -20,16 +20,18 @@ class Action :
                                 return False
                 return True
 
+        # Returns the regression of valuation through the action, or None
+        # if no state in which the action is applicable leads to a state
+        # that satisfies the valuation.
         def regress( self, valuation ) :
                 table_val = dict(valuation)
                 for X, v in self.effect :
-                        try :
-                                del table_val[X]
-                        except KeyError :
-                                return []
+                        if X not in table_val : continue
+                        if table_val[X] != v : return None # effect contradicts valuation
+                        del table_val[X]
                 for X, v in self.prim_precs :
                         try :
-                                if table_val[X] != v : return [] # regression contains false
+                                if table_val[X] != v : return None # regression contains false
                         except KeyError :
                                 table_val[X] = v
-                return [ (X,v) for X,v in table_val.iteritems() ]
+                return [ (X,v) for X,v in table_val.items() ]
@@ -0,0 +1,76 @@
+from         __future__         import         print_function
+
+class GeneratorNode :
+        """
+        Node of the successor generator decision tree. The actions in
+        immediate have no preconditions on the variables not yet tested
+        on the path to the node; the remaining actions are split on the
+        value of one more variable: children holds, for each value that
+        some action requires, the literal offset of the value and the
+        subtree of those actions, and dont_care the subtree of the actions
+        that have no precondition on the variable.
+        """
+
+        def __init__( self, immediate, children, dont_care ) :
+                self.immediate = immediate
+                self.children = children
+                self.dont_care = dont_care
+
+class SuccessorGenerator :
+        """
+        Decision tree over the primary preconditions of a set of actions
+        (in the style of Fast Downward's successor generator), used to
+        find the actions whose primary preconditions hold in a state
+        without testing every action. Variables are tested in the order
+        of their literal offsets. Actions must have compiled_precs (see
+        HybridTask.compile_valuations).
+        """
+
+        def __init__( self, actions ) :
+                self.actions = actions
+                items = []
+                for index, action in enumerate( actions ) :
+                        # (variable start offset, literal offset) pairs
+                        conds = sorted( [ ( start, offset ) for offset, start, end in action.compiled_precs.ranges ] )
+                        items.append( ( conds, 0, index ) )
+                self.root = self.construct( items )
+
+        def construct( self, items ) :
+                immediate = [ index for conds, pos, index in items if pos == len(conds) ]
+                rest = [ item for item in items if item[1] < len(item[0]) ]
+                if len(rest) == 0 :
+                        return GeneratorNode( immediate, [], None )
+                var = min( [ conds[pos][0] for conds, pos, index in rest ] )
+                switch = {}
+                dont_care = []
+                for conds, pos, index in rest :
+                        start, offset = conds[pos]
+                        if start == var :
+                                switch.setdefault( offset, [] ).append( ( conds, pos+1, index ) )
+                        else :
+                                dont_care.append( ( conds, pos, index ) )
+                children = [ ( offset, self.construct( switch[offset] ) ) for offset in sorted( switch ) ]
+                return GeneratorNode( immediate, children, self.construct( dont_care ) if len(dont_care) > 0 else None )
+
+        # Returns the indices of the actions whose primary preconditions
+        # hold in state, in increasing order.
+        def applicable_indices( self, state ) :
+                result = []
+                relaxed = state.relaxed
+                stack = [ self.root ]
+                while len(stack) > 0 :
+                        node = stack.pop()
+                        result += node.immediate
+                        if node.dont_care is not None :
+                                stack.append( node.dont_care )
+                        for offset, child in node.children :
+                                if state.holds( offset ) :
+                                        stack.append( child )
+                                        # in a non-relaxed state, only one
+                                        # value of the variable is true
+                                        if not relaxed : break
+                result.sort()
+                return result
+
+        def applicable_actions( self, state ) :
+                return [ self.actions[index] for index in self.applicable_indices( state ) ]
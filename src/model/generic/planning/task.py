@@ -9,6 +9,13 @@ xrange = range
 
 class Task :
 
+        # Option flag selecting the state representation: when True,
+        # states are stored as a single integer bitset (PackedState)
+        # rather than as an array of literals. It is defined as a
+        # class variable because states are created by the domain
+        # modules and by the projections, which don't know about it.
+        PACKED_STATES = False
+
         def __init__( self, domain_name, instance_name ) :
                 self.domain_name = domain_name
                 self.instance_name = instance_name
@@ -16,6 +23,7 @@ class Task :
                 self.state_var_last_idx = 0
                 self.last_lit_idx = 0
                 self.lit_offsets = []
+                self.var_masks = []
                 self.actions = []
 
         def create_state_var( self, var_name, var_domain, default = None ) :
@@ -27,6 +35,7 @@ class Task :
                 start = self.last_lit_idx
                 end = self.last_lit_idx + x.domain_size()
                 self.lit_offsets.append( ( start, end ) )
+                self.var_masks.append( ( ( 1 << x.domain_size() ) - 1 ) << start )
                 self.last_lit_idx = end 
                 return x
 
@@ -51,11 +60,45 @@ class Task :
         def default_valuation( self ) :
                 return [ ( x.index, x.domain[ x.default_value ] ) for x in self.state_vars ]
 
+        def compile_valuation( self, valuation ) :
+                return CompiledValuation( self, valuation )
+
+class CompiledValuation :
+        """
+        A (partial) valuation compiled against the literal layout of a
+        task: for each (var, value) pair, the offset of its literal and
+        the range of literals of its variable, plus the bitmasks of the
+        same. States test and apply compiled valuations without looking
+        up lit_offsets and value_index for every pair.
+        """
+
+        def __init__( self, task, valuation ) :
+                self.literals = []
+                self.ranges = []
+                self.lit_mask = 0
+                self.var_mask = 0
+                for x, v in valuation :
+                        start, end = task.lit_offsets[ x ]
+                        offset = start + task.state_vars[x].value_index[ v ]
+                        self.literals.append( offset )
+                        self.ranges.append( ( offset, start, end ) )
+                        self.lit_mask |= 1 << offset
+                        self.var_mask |= task.var_masks[x]
+
+        def __len__( self ) :
+                return len(self.literals)
+
 class State :
 
         bTrue = chr(0xff)
         bFalse = chr(0x00)
 
+        def __new__( cls, task = None, *args, **kwargs ) :
+                # task is None when unpickling
+                if cls is State and task is not None and task.PACKED_STATES :
+                        cls = PackedState
+                return object.__new__( cls )
+
         def __init__( self, task, valuation, check_domain = False ) :
                 #print(task.state_vars)
                 #print(valuation)
@@ -65,11 +108,7 @@ class State :
                 self.relaxed = False
                 
                 if check_domain :
-                        for x, v in valuation :
-                                if not task.state_vars[x].valid_value(v) :
-                                        domain_string = ','.join( [ str(v) for v in self.task.state_vars[x].domain ] )
-                                        params = ( v, self.task.state_vars[x].name, domain_string )
-                                        raise ValueError( 'Value "%s" does not belong to domain of variable "%s": { %s }'%params )
+                        self.check_domain( valuation )
 
                 for x,v in valuation :
                         start, _ = self.task.lit_offsets[ x ]
@@ -77,6 +116,13 @@ class State :
                         self.literals[ offset ] = State.bTrue 
 
 
+        def check_domain( self, valuation ) :
+                for x, v in valuation :
+                        if not self.task.state_vars[x].valid_value(v) :
+                                domain_string = ','.join( [ str(v) for v in self.task.state_vars[x].domain ] )
+                                params = ( v, self.task.state_vars[x].name, domain_string )
+                                raise ValueError( 'Value "%s" does not belong to domain of variable "%s": { %s }'%params )
+
         def __eq__( self, other ) :
                 for i in xrange( len(self.literals) ) :
                         if other.literals[i] != self.literals[i] : return False
@@ -98,7 +144,8 @@ class State :
                 return ''.join(['1' if lit == self.bTrue else '0' for lit in self.literals])
 
         def copy( self ) :
-                s = State( self.task, [] )
+                s = object.__new__( State )
+                s.task = self.task
                 s.literals = array( 'u', self.literals )
                 s.relaxed = self.relaxed
                 return s
@@ -130,6 +177,45 @@ class State :
 
                 return True
 
+        def holds( self, offset ) :
+                return self.literals[offset] == State.bTrue
+
+        # Returns a hashable projection of the state on the variables
+        # of the compiled valuation cv.
+        def projection_key( self, cv ) :
+                return ''.join( [ self.literals[start:end].tounicode() for _, start, end in cv.ranges ] )
+
+        def possible_compiled( self, cv ) :
+                for offset in cv.literals :
+                        if self.literals[offset] == State.bFalse : return False
+                return True
+
+        def satisfies_compiled( self, cv ) :
+                if self.relaxed :
+                        for offset, start, end in cv.ranges :
+                                if self.literals[offset] == State.bFalse : return False
+                                for k in xrange( start, end ) :
+                                        if k != offset and self.literals[k] == State.bTrue : return False
+                        return True
+                for offset in cv.literals :
+                        if self.literals[offset] == State.bFalse : return False
+                return True
+
+        def apply_compiled( self, cv ) :
+                for offset, start, end in cv.ranges :
+                        for k in xrange( start, end ) :
+                                self.literals[k] = State.bFalse
+                        self.literals[offset] = State.bTrue
+
+        def relaxed_apply_compiled( self, cv ) :
+                self.relaxed = True
+                for offset in cv.literals :
+                        self.literals[offset] = State.bTrue
+
+        def relaxed_set_literal( self, offset ) :
+                self.relaxed = True
+                self.literals[offset] = State.bTrue
+
         def relaxed_set_vec( self, valuation ) :
                 """
                 Here we don't need to flip the truth value of multi-valued variables
@@ -207,6 +293,15 @@ class State :
                                         return var.domain[ offset - start ]
                         raise ValueError( 'Variable %s has no value set!'%var.name )
 
+        # Returns the position of the value of variable x (an index)
+        # in its domain.
+        def value_index( self, x ) :
+                start, end = self.task.lit_offsets[x]
+                try :
+                        return self.literals[start:end].index( State.bTrue )
+                except ValueError :
+                        raise ValueError( 'Variable %s has no value set!'%self.task.state_vars[x].name )
+
         def write( self, file_obj ) :
                 for x in self.task.state_vars :
                         try:
@@ -232,3 +327,165 @@ class State :
 
         def dump_true_facts( self ) :
                 self.write( sys.stdout ) 
+
+class PackedState( State ) :
+        """
+        Compact state representation: the literals are the bits of a
+        single integer, so that hashing and equality are done in C
+        rather than by a loop over the literals. The hash value is
+        cached, and invalidated whenever the state is modified.
+        """
+
+        def __init__( self, task, valuation, check_domain = False ) :
+                self.task = task
+                self.bits = 0
+                self.relaxed = False
+                self._hash = None
+
+                if check_domain :
+                        self.check_domain( valuation )
+
+                for x,v in valuation :
+                        start, _ = self.task.lit_offsets[ x ]
+                        self.bits |= 1 << ( start + self.task.state_vars[x].value_index[ v ] )
+
+        def __eq__( self, other ) :
+                return self.bits == other.bits
+
+        def __hash__( self ) :
+                if self._hash is None :
+                        self._hash = hash( self.bits )
+                return self._hash
+
+        def num_literals( self ) :
+                return self.task.last_lit_idx
+
+        def __str__( self ):
+                return ''.join(['1' if self.bits >> k & 1 else '0' for k in xrange( self.task.last_lit_idx ) ])
+
+        def copy( self ) :
+                s = object.__new__( PackedState )
+                s.task = self.task
+                s.bits = self.bits
+                s.relaxed = self.relaxed
+                s._hash = self._hash
+                return s
+
+        def literal_mask( self, valuation ) :
+                mask = 0
+                for x, v in valuation :
+                        start, _ = self.task.lit_offsets[ x ]
+                        mask |= 1 << ( start + self.task.state_vars[x].value_index[ v ] )
+                return mask
+
+        def possible( self, valuation ) :
+                mask = self.literal_mask( valuation )
+                return self.bits & mask == mask
+
+        def satisfies( self, valuation ) :
+                if self.relaxed :
+                        # X = v must be the only possible value of X
+                        for x, v in valuation :
+                                start, _ = self.task.lit_offsets[ x ]
+                                bit = 1 << ( start + self.task.state_vars[x].value_index[ v ] )
+                                if self.bits & self.task.var_masks[x] != bit : return False
+                        return True
+                mask = self.literal_mask( valuation )
+                return self.bits & mask == mask
+
+        def holds( self, offset ) :
+                return self.bits >> offset & 1 == 1
+
+        def projection_key( self, cv ) :
+                return self.bits & cv.var_mask
+
+        def possible_compiled( self, cv ) :
+                return self.bits & cv.lit_mask == cv.lit_mask
+
+        def satisfies_compiled( self, cv ) :
+                if self.relaxed :
+                        return self.bits & cv.var_mask == cv.lit_mask
+                return self.bits & cv.lit_mask == cv.lit_mask
+
+        def apply_compiled( self, cv ) :
+                self.bits = ( self.bits & ~cv.var_mask ) | cv.lit_mask
+                self._hash = None
+
+        def relaxed_apply_compiled( self, cv ) :
+                self.relaxed = True
+                self.bits |= cv.lit_mask
+                self._hash = None
+
+        def relaxed_set_literal( self, offset ) :
+                self.relaxed = True
+                self.bits |= 1 << offset
+                self._hash = None
+
+        def relaxed_set_vec( self, valuation ) :
+                self.relaxed = True
+                self.bits |= self.literal_mask( valuation )
+                self._hash = None
+
+        def relaxed_set( self, x, v ) :
+                self.relaxed = True
+                try :
+                        start, _ = self.task.lit_offsets[ x.index ]
+                        self.bits |= 1 << ( start + x.value_index[ v ] )
+                except AttributeError :
+                        start, _ = self.task.lit_offsets[ x ]
+                        self.bits |= 1 << ( start + self.task.state_vars[x].value_index[ v ] )
+                self._hash = None
+
+        def set_vec( self, valuation ) :
+                for x,v in valuation :
+                        start, _ = self.task.lit_offsets[ x ]
+                        bit = 1 << ( start + self.task.state_vars[x].value_index[ v ] )
+                        self.bits = ( self.bits & ~self.task.var_masks[x] ) | bit
+                self._hash = None
+
+        def set( self, x, v ) :
+                try :
+                        var_index = x.index
+                        var = x
+                except AttributeError :
+                        var_index = x
+                        var = self.task.state_vars[x]
+                start, _ = self.task.lit_offsets[ var_index ]
+                bit = 1 << ( start + var.value_index[ v ] )
+                self.bits = ( self.bits & ~self.task.var_masks[var_index] ) | bit
+                self._hash = None
+
+        def iter_values( self ) :
+                for i in xrange( len(self.task.state_vars) ) :
+                        start, end = self.task.lit_offsets[i]
+                        var_bits = self.bits >> start
+                        for k in xrange( end - start ) :
+                                if var_bits >> k & 1 :
+                                        yield ( i, self.task.state_vars[i].domain[k] )
+
+        def value( self, x ) :
+                try :
+                        var_index = x.index
+                        var = x
+                except AttributeError :
+                        var_index = x
+                        var = self.task.state_vars[x]
+                start, _ = self.task.lit_offsets[ var_index ]
+                var_bits = ( self.bits & self.task.var_masks[var_index] ) >> start
+                if var_bits == 0 :
+                        raise ValueError( 'Variable %s has no value set!'%var.name )
+                # lowest possible value, as in State.value
+                return var.domain[ ( var_bits & -var_bits ).bit_length() - 1 ]
+
+        def value_index( self, x ) :
+                start, _ = self.task.lit_offsets[x]
+                var_bits = ( self.bits & self.task.var_masks[x] ) >> start
+                if var_bits == 0 :
+                        raise ValueError( 'Variable %s has no value set!'%self.task.state_vars[x].name )
+                return ( var_bits & -var_bits ).bit_length() - 1
+
+        def print_relaxed(self):
+                for idx in xrange( len(self.task.state_vars) ) :
+                        start, end = self.task.lit_offsets[idx]
+                        values = [ str(v) for k, v in enumerate( self.task.state_vars[idx].domain ) if self.bits >> (start+k) & 1 ]
+                        print( self.task.state_vars[idx].name + " = {" + ", ".join( values ) + "}" )
@@ -1,6 +1,8 @@
-from .a_star import astar_search, weighted_astar_search, greedy_best_first_search, greedy_best_first_search_g_tie_breaking
+from .a_star import astar_search, weighted_astar_search, greedy_best_first_search, greedy_best_first_search_g_tie_breaking, lazy_astar_search, lazy_greedy_best_first_search, anytime_weighted_astar_search
 from .breadth_first_search import breadth_first_search, IW
 from .enforced_hillclimbing_search import enforced_hillclimbing_search
+from .hda_star import hda_star_search
+from .limits import SearchLimits, LimitReached
 from .pref_partial_a_star import pref_partial_astar_search, restarting_pref_partial_astar_search, pref_partial_astar_search_with_delayed_evaluation
 
 from .searchspace import make_root_node, make_child_node
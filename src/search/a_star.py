@@ -19,10 +19,10 @@
 Implements the A* (a-star) and weighted A* search algorithm.
 """
 
-import heapq
 import logging
 
 from search import searchspace
+from search.open_list import make_open_list
 
 
 def ordered_node_astar(node, h, node_tiebreaker):
@@ -94,40 +94,58 @@ def ordered_node_greedy_best_first_g_tie_breaking(node, h, node_tiebreaker):
     return (node.h, node.g, node_tiebreaker, node)
 
 
-def greedy_best_first_search(task, heuristic, use_relaxed_plan=False):
+def greedy_best_first_search(task, heuristic, succ_fn=None, use_relaxed_plan=False, limits=None):
     """
     Searches for a plan in the given task using greedy best first search.
 
     @param task The task to be solved.
     @param heuristic A heuristic callable which computes the estimated steps
                      from a search node to reach the goal.
+    @param succ_fn The successor function (by default,
+                   task.compute_successor_state)
+    @param limits As for astar_search.
     """
-    return astar_search(task, heuristic, ordered_node_greedy_best_first_g_tie_breaking,
-                        use_relaxed_plan)
+    return astar_search(task, heuristic, succ_fn, ordered_node_greedy_best_first_g_tie_breaking,
+                        use_relaxed_plan, limits=limits)
 
 
-def greedy_best_first_search_g_tie_breaking(task, heuristic, use_relaxed_plan=False):
+def greedy_best_first_search_g_tie_breaking(task, heuristic, succ_fn=None, use_relaxed_plan=False, limits=None):
     """
     Searches for a plan in the given task using greedy best first search.
 
     @param task The task to be solved.
     @param heuristic A heuristic callable which computes the estimated steps
                      from a search node to reach the goal.
+    @param succ_fn The successor function (by default,
+                   task.compute_successor_state)
+    @param limits As for astar_search.
     """
-    return astar_search(task, heuristic, task.compute_successor_state, ordered_node_greedy_best_first_g_tie_breaking,
-                        use_relaxed_plan)
+    return astar_search(task, heuristic, succ_fn, ordered_node_greedy_best_first_g_tie_breaking,
+                        use_relaxed_plan, limits=limits)
 
-def weighted_astar_search(task, heuristic, weight=5, use_relaxed_plan=False):
+def weighted_astar_search(task, heuristic, succ_fn=None, weight=5, use_relaxed_plan=False, limits=None):
     """
     Searches for a plan in the given task using A* search.
 
     @param task The task to be solved.
     @param heuristic  A heuristic callable which computes the estimated steps.
                       from a search node to reach the goal.
+    @param succ_fn The successor function (by default,
+                   task.compute_successor_state)
     @param weight A weight to be applied to the heuristics value for each node.
+    @param limits As for astar_search.
     """
-    return astar_search(task, heuristic, ordered_node_weighted_astar(weight),
-                        use_relaxed_plan)
+    return astar_search(task, heuristic, succ_fn, ordered_node_weighted_astar(weight),
+                        use_relaxed_plan, limits=limits)
+
+
+def f_bound(make_open_entry, maxf):
+    """
+    Returns the highest f value expanded, which is a lower bound on the
+    cost of an optimal plan, if the open list is ordered by f = g + h,
+    and None otherwise.
+    """
+    return maxf if make_open_entry is ordered_node_astar else None
 
 
 def astar_state_sampling( task, heuristic, max_fn, sample_size ) :
@@ -139,7 +157,7 @@ def astar_state_sampling( task, heuristic, max_fn, sample_size ) :
         """
         import random
 
-        open = []
+        open = make_open_list( task )
         state_cost = {task.initial_state: 0}
         node_tiebreaker = 0
         
@@ -148,7 +166,7 @@ def astar_state_sampling( task, heuristic, max_fn, sample_size ) :
         root.tie = node_tiebreaker
         init_h = heuristic(root)
         root.h = init_h
-        heapq.heappush(open, ordered_node_astar(root, init_h, node_tiebreaker))
+        open.push(ordered_node_astar(root, init_h, node_tiebreaker))
         
         besth = float('inf')
         counter = 0
@@ -157,7 +175,7 @@ def astar_state_sampling( task, heuristic, max_fn, sample_size ) :
         witnesses = []
         
         while open:
-                (f, h, _tie, pop_node) = heapq.heappop(open)
+                (f, h, _tie, pop_node) = open.pop()
                 if pop_node.g > max_fn : continue
                 pop_state = pop_node.state
                 # Only expand the node if its associated cost (g value) is the lowest
@@ -188,7 +206,7 @@ def astar_state_sampling( task, heuristic, max_fn, sample_size ) :
                                         node_tiebreaker += 1
                                         succ_node.tie = node_tiebreaker
                                         succ_node.h = h
-                                        heapq.heappush(open, ordered_node_astar(succ_node, h, node_tiebreaker))
+                                        open.push(ordered_node_astar(succ_node, h, node_tiebreaker))
                                         state_cost[succ_state] = succ_node.g
                                         
 
@@ -197,7 +215,7 @@ def astar_state_sampling( task, heuristic, max_fn, sample_size ) :
         return witnesses
 
 def astar_search(task, heuristic, succ_fn = None, make_open_entry=ordered_node_astar,
-                 use_relaxed_plan=False, mute=False):
+                 use_relaxed_plan=False, mute=False, limits=None):
         """
         Searches for a plan in the given task using A* search.
         
@@ -210,10 +228,12 @@ def astar_search(task, heuristic, succ_fn = None, make_open_entry=ordered_node_a
                                 ordered_node_weighted_astar and
                                 ordered_node_greedy_best_first with obvious
                                 meanings.
+        @param limits Optional SearchLimits; when one is reached, LimitReached
+                      is raised.
         """
         if succ_fn is None :
                 succ_fn = task.compute_successor_state
-        open = []
+        open = make_open_list( task )
         state_cost = {task.initial_state: 0}
         node_tiebreaker = 0
         
@@ -222,24 +242,26 @@ def astar_search(task, heuristic, succ_fn = None, make_open_entry=ordered_node_a
         root.tie = node_tiebreaker
         init_h = heuristic(root)
         root.h = init_h
-        heapq.heappush(open, make_open_entry(root, init_h, node_tiebreaker))
+        open.push(make_open_entry(root, init_h, node_tiebreaker))
         
         if not mute :
                 logging.info("Initial h value: %f" % init_h)
         
         besth = float('inf')
+        best_node = None
         maxf = root.g + root.h
         counter = 0
         expansions = 0
         heuristic.num_calls = 1
         
         while open:
-                (f, h, _tie, pop_node) = heapq.heappop(open)
+                (f, h, _tie, pop_node) = open.pop()
                 if f > maxf:
                     maxf = f
                     logging.info("f = %d, nodes = %d" % (maxf, expansions))
                 if pop_node.h < besth:
                         besth = pop_node.h
+                        best_node = pop_node
                         logging.debug("Found new best h: %d after %d expansions" %
                                 (besth, counter))
                 pop_state = pop_node.state
@@ -247,6 +269,8 @@ def astar_search(task, heuristic, succ_fn = None, make_open_entry=ordered_node_a
                 # cost known for this state. Otherwise we already found a cheaper
                 # path after creating this node and hence can disregard it.
                 if state_cost[pop_state] == pop_node.g:
+                        if limits is not None :
+                                limits.check(expansions, besth, f_bound(make_open_entry, maxf), best_node)
                         expansions += 1
 
                         if task.goal_reached(pop_state):
@@ -262,7 +286,7 @@ def astar_search(task, heuristic, succ_fn = None, make_open_entry=ordered_node_a
                                 if not mute :
                                         logging.debug("relaxed plan %s " % rplan)
 
-                        for op, succ_state in task.get_successor_states(pop_state):
+                        for op, succ_state in task.get_successor_states_batch([pop_state], succ_fn)[0]:
                                 if use_relaxed_plan:
                                         if rplan and not op.name in rplan:
                                                 # ignore this operator if we use the relaxed plan
@@ -290,7 +314,7 @@ def astar_search(task, heuristic, succ_fn = None, make_open_entry=ordered_node_a
                                         node_tiebreaker += 1
                                         succ_node.tie = node_tiebreaker
                                         succ_node.h = h
-                                        heapq.heappush(open, make_open_entry(succ_node, h,
+                                        open.push(make_open_entry(succ_node, h,
                                                                                 node_tiebreaker))
                                         state_cost[succ_state] = succ_node.g
 
@@ -300,3 +324,253 @@ def astar_search(task, heuristic, succ_fn = None, make_open_entry=ordered_node_a
                 logging.info("No operators left. Task unsolvable.")
                 logging.info("{0} Nodes expanded, {1} Nodes evaluated".format (expansions, heuristic.num_calls))
         return None
+
+def lazy_astar_search(task, heuristic, succ_fn = None, make_open_entry=ordered_node_astar,
+                      mute=False, limits=None):
+        """
+        Searches for a plan in the given task using A* search with deferred
+        (lazy) heuristic evaluation: successors are queued with the h value
+        of their parent, less the cost of the action (which, for a
+        consistent heuristic, is a lower bound on their own), and are
+        evaluated only when popped from the open list. If the evaluated
+        node's priority turns out to be worse than the one it was queued
+        with, it goes back into the open list; otherwise it is expanded.
+        Goal states are recognised when popped, before they are evaluated.
+
+        @param task The task to be solved
+        @param heuristic  A heuristic callable which computes the estimated steps
+                          from a search node to reach the goal.
+        @param succ_fn The successor function (by default,
+                       task.compute_successor_state)
+        @param make_open_entry As for astar_search.
+        @param limits As for astar_search.
+        """
+        if succ_fn is None :
+                succ_fn = task.compute_successor_state
+        open = make_open_list( task )
+        state_cost = {task.initial_state: 0}
+        node_tiebreaker = 0
+
+        root = searchspace.make_root_node(task.initial_state)
+        root.g = 0
+        root.tie = node_tiebreaker
+        init_h = heuristic(root)
+        root.h = init_h
+        root.evaluated = True
+        open.push(make_open_entry(root, init_h, node_tiebreaker))
+
+        if not mute :
+                logging.info("Initial h value: %f" % init_h)
+
+        besth = float('inf')
+        best_node = None
+        maxf = root.g + root.h
+        expansions = 0
+        # number of nodes an eager search would have evaluated
+        generated = 1
+        heuristic.num_calls = 1
+
+        def log_statistics() :
+                if mute : return
+                logging.info("{0} Nodes expanded, {1} Nodes evaluated".format (expansions, heuristic.num_calls))
+                logging.info("Deferred evaluation: {0} Nodes generated, {1} evaluations saved".format( generated, generated - heuristic.num_calls ) )
+
+        while open:
+                (f, h, _tie, pop_node) = open.pop()
+                pop_state = pop_node.state
+                # Only consider the node if its associated cost (g value) is the
+                # lowest cost known for this state.
+                if state_cost[pop_state] != pop_node.g:
+                        continue
+
+                if limits is not None :
+                        limits.check(expansions, besth, f_bound(make_open_entry, maxf), best_node)
+
+                if task.goal_reached(pop_state):
+                        expansions += 1
+                        if not mute :
+                                logging.info("Goal reached. Start extraction of solution.")
+                        log_statistics()
+                        return pop_node.extract_solution()
+
+                if not pop_node.evaluated :
+                        pop_node.evaluated = True
+                        h = heuristic(pop_node)
+                        heuristic.num_calls += 1
+                        if h == float('inf'):
+                                # a dead end: no path to it will be cheap enough
+                                # to be queued again
+                                state_cost[pop_state] = float('-inf')
+                                continue
+                        pop_node.h = h
+                        entry = make_open_entry(pop_node, h, _tie)
+                        if entry[0] > f :
+                                open.push(entry)
+                                continue
+
+                if f > maxf:
+                    maxf = f
+                    logging.info("f = %d, nodes = %d" % (maxf, expansions))
+                if pop_node.h < besth:
+                        besth = pop_node.h
+                        best_node = pop_node
+                        logging.debug("Found new best h: %d after %d expansions" %
+                                (besth, expansions))
+                expansions += 1
+
+                for op, succ_state in task.get_successor_states_batch([pop_state], succ_fn)[0]:
+                        generated += 1
+                        succ_node = searchspace.make_child_node(pop_node, op,
+                                                        succ_state)
+                        old_succ_g = state_cost.get(succ_state, float("inf"))
+                        if succ_node.g < old_succ_g:
+                                node_tiebreaker += 1
+                                succ_node.tie = node_tiebreaker
+                                succ_node.h = max(pop_node.h - op.cost, 0)
+                                open.push(make_open_entry(succ_node, succ_node.h,
+                                                                        node_tiebreaker))
+                                state_cost[succ_state] = succ_node.g
+
+        if not mute :
+                logging.info("No operators left. Task unsolvable.")
+        log_statistics()
+        return None
+
+
+def lazy_greedy_best_first_search(task, heuristic, succ_fn = None, limits=None):
+        """
+        Searches for a plan in the given task using greedy best first search,
+        with deferred heuristic evaluation (see lazy_astar_search) and ties
+        broken by g.
+
+        @param task The task to be solved.
+        @param heuristic A heuristic callable which computes the estimated steps
+                         from a search node to reach the goal.
+        @param succ_fn The successor function
+        @param limits As for astar_search.
+        """
+        return lazy_astar_search(task, heuristic, succ_fn, ordered_node_greedy_best_first_g_tie_breaking,
+                                 limits=limits)
+
+
+# Weight schedule of anytime_weighted_astar_search, that of Restarting
+# Weighted A* (Richter, Thayer and Ruml, 2010).
+ANYTIME_WEIGHTS = [5, 3, 2, 1.5, 1]
+
+def anytime_weighted_astar_search(task, heuristic, succ_fn = None, weights = None,
+                                  on_plan = None, limits = None):
+        """
+        Searches for plans of decreasing cost in the given task using weighted
+        A* search with a decreasing weight schedule. The first plan is found
+        with the first weight; each time a better plan is found, the search
+        goes on with the next weight (the last one, once they run out) over
+        the same search space: the nodes still open are queued again by
+        g + weight * h, states reached through a cheaper path are reopened,
+        and each state is evaluated only once. Nodes whose g + h is not lower
+        than the cost of the best plan found so far are pruned. The search
+        ends when no open node is left, at which point the best plan is
+        optimal if the heuristic is admissible.
+
+        @param task The task to be solved
+        @param heuristic  A heuristic callable which computes the estimated steps
+                          from a search node to reach the goal.
+        @param succ_fn The successor function (by default,
+                       task.compute_successor_state)
+        @param weights The weight schedule (by default, ANYTIME_WEIGHTS)
+        @param on_plan An optional callable, called with each improved plan
+                       and its cost as soon as it is found.
+        @param limits As for astar_search; LimitReached carries the best plan
+                      found so far.
+        @returns The best plan found, or None.
+        """
+        if succ_fn is None :
+                succ_fn = task.compute_successor_state
+        if weights is None :
+                weights = ANYTIME_WEIGHTS
+        state_cost = {task.initial_state: 0}
+        h_values = {}
+        # the nodes in open, by state
+        open_nodes = {}
+        node_tiebreaker = 0
+
+        root = searchspace.make_root_node(task.initial_state)
+        root.h = heuristic(root)
+        heuristic.num_calls = 1
+        h_values[task.initial_state] = root.h
+        logging.info("Initial h value: %f" % root.h)
+        if root.h == float('inf'):
+                logging.info("No operators left. Task unsolvable.")
+                return None
+        open_nodes[task.initial_state] = root
+
+        incumbent = float('inf')
+        best_plan = None
+        besth = float('inf')
+        best_node = None
+        expansions = 0
+        iteration = 0
+
+        while open_nodes:
+                weight = weights[min(iteration, len(weights) - 1)]
+                iteration += 1
+                make_open_entry = ordered_node_weighted_astar(weight)
+                open = make_open_list(task)
+                for state, node in list(open_nodes.items()):
+                        if node.g + node.h >= incumbent:
+                                del open_nodes[state]
+                                continue
+                        open.push(make_open_entry(node, node.h, node.tie))
+                logging.info("Anytime WA*: weight %s, %d open nodes" % (weight, len(open_nodes)))
+
+                while open:
+                        (f, h, _tie, pop_node) = open.pop()
+                        pop_state = pop_node.state
+                        # Skip nodes that have been replaced by a node with a
+                        # cheaper path to their state.
+                        if open_nodes.get(pop_state) is not pop_node:
+                                continue
+                        del open_nodes[pop_state]
+                        if pop_node.g + h >= incumbent:
+                                # can't lead to a better plan
+                                continue
+                        if limits is not None :
+                                limits.check(expansions, besth, None, best_node, best_plan)
+                        if h < besth:
+                                besth = h
+                                best_node = pop_node
+
+                        if task.goal_reached(pop_state):
+                                incumbent = pop_node.g
+                                best_plan = pop_node.extract_solution()
+                                logging.info("Anytime WA*: plan found with weight %s, cost %s" % (weight, incumbent))
+                                logging.info("{0} Nodes expanded, {1} Nodes evaluated".format (expansions, heuristic.num_calls))
+                                if on_plan is not None :
+                                        on_plan(best_plan, incumbent)
+                                break
+
+                        expansions += 1
+                        for op, succ_state in task.get_successor_states_batch([pop_state], succ_fn)[0]:
+                                succ_node = searchspace.make_child_node(pop_node, op,
+                                                                succ_state)
+                                if succ_node.g >= state_cost.get(succ_state, float("inf")):
+                                        continue
+                                h = h_values.get(succ_state)
+                                if h is None:
+                                        h = heuristic(succ_node)
+                                        heuristic.num_calls += 1
+                                        h_values[succ_state] = h
+                                if h == float('inf') or succ_node.g + h >= incumbent:
+                                        continue
+                                node_tiebreaker += 1
+                                succ_node.tie = node_tiebreaker
+                                succ_node.h = h
+                                state_cost[succ_state] = succ_node.g
+                                open_nodes[succ_state] = succ_node
+                                open.push(make_open_entry(succ_node, h, node_tiebreaker))
+
+        if best_plan is None :
+                logging.info("No operators left. Task unsolvable.")
+        else :
+                logging.info("Anytime WA*: search space exhausted, best plan cost %s" % incumbent)
+        logging.info("{0} Nodes expanded, {1} Nodes evaluated".format (expansions, heuristic.num_calls))
+        return best_plan
@@ -25,12 +25,14 @@ import logging
 from . import searchspace
 
 from heuristics.novelty import Novelty_Table
-def breadth_first_search(planning_task, mute = False):
+def breadth_first_search(planning_task, mute = False, limits = None):
         '''
         Searches for a plan on the given task using breadth first search and
         duplicate detection.
         
         @param planning_task: The planning task to solve.
+        @param limits: Optional SearchLimits; when one is reached,
+        LimitReached is raised.
         @return: The solution as a list of operators or None if the task is
         unsolvable.
         '''
@@ -46,6 +48,8 @@ def breadth_first_search(planning_task, mute = False):
                 if not mute: 
                         logging.debug("breadth_first_search: Iteration %d, #unexplored=%d"
                                         % (iteration, len(queue)))
+                if limits is not None :
+                        limits.check( iteration - 1 )
                 # get the next node to explore
                 node = queue.popleft()
                 if not mute :
@@ -69,12 +73,14 @@ def breadth_first_search(planning_task, mute = False):
                 logging.info("%d Nodes expanded" % iteration)
         return None
 
-def IW(planning_task, i):
+def IW(planning_task, i, limits = None):
     '''
     Searches for a plan on the given task using breadth first search and
     duplicate detection.
 
     @param planning_task: The planning task to solve.
+    @param limits: Optional SearchLimits; when one is reached,
+    LimitReached is raised.
     @return: The solution as a list of operators or None if the task is
     unsolvable.
     '''
@@ -91,6 +97,8 @@ def IW(planning_task, i):
         iteration += 1
         logging.debug("breadth_first_search: Iteration %d, #unexplored=%d"
                       % (iteration, len(queue)))
+        if limits is not None:
+            limits.check(iteration - 1)
         # get the next node to explore
         node = queue.popleft()
         logging.debug("breadth_first_search: f(n) = %f"%node.g )
@@ -26,12 +26,15 @@ from . import searchspace
 
 
 def enforced_hillclimbing_search(planning_task, heuristic,
-                                 use_preferred_ops=False):
+                                 use_preferred_ops=False, limits=None):
     """
     Searches for a plan on the given task using enforced hill climbing and
     duplicate detection.
 
     @param planning_task: The planning task to solve.
+    @param limits: Optional SearchLimits; when one is reached,
+    LimitReached is raised, with the path to the node with the lowest
+    h value as its best prefix.
     @return: The solution as a list of operators or None if the task is
     unsolvable.
     """
@@ -42,11 +45,14 @@ def enforced_hillclimbing_search(planning_task, heuristic,
     initial_node = searchspace.make_root_node(planning_task.initial_state)
     queue.append(initial_node)
     best_heuristic_value = heuristic(initial_node)
+    best_node = initial_node
     logging.info("Initial h value: %f" % best_heuristic_value)
     # set storing the explored nodes, used for duplicate detection
     closed = set()
     visited = set()
     while queue:
+        if limits is not None:
+            limits.check(len(visited), best_heuristic_value, None, best_node)
         iteration += 1
         # get the next node to explore
         node = queue.popleft()
@@ -95,6 +101,7 @@ def enforced_hillclimbing_search(planning_task, heuristic,
                     queue.clear()
                     closed.clear()
                     best_heuristic_value = heuristic_value
+                    best_node = successor_node
                     queue.append(successor_node)
                     break
                 else:
@@ -0,0 +1,335 @@
+"""
+Implements Hash Distributed A* (HDA*, Kishimoto, Fukunaga and Botea,
+2009): A* search over several worker processes, each of which owns the
+states whose hash value is its index modulo the number of workers.
+"""
+
+import logging
+import multiprocessing
+import time
+import traceback
+
+try :
+        from queue import Empty
+except ImportError :
+        from Queue import Empty
+
+from search import searchspace
+from search.a_star import astar_search
+from search.limits import LimitReached
+from search.open_list import make_open_list
+from model.generic.hybrid.secondary import init_worker_env
+
+# Number of worker processes; None means one per core.
+NUM_WORKERS = None
+
+# Seconds an idle worker waits for a message before checking whether
+# the search is over.
+POLL_INTERVAL = 0.01
+
+class HDAChannels :
+        """
+        What the workers share: an inbox per worker, a queue to send
+        plans and statistics back to the coordinator, the cost of the
+        best plan found so far, the idle flags and the numbers of
+        messages sent and received, from which the coordinator detects
+        termination, the flag by which it stops the workers, and the
+        number of nodes expanded by all of them (kept only if the search
+        has limits).
+        """
+
+        def __init__( self, ctx, num_workers ) :
+                self.num_workers = num_workers
+                self.inboxes = [ ctx.Queue() for i in range( num_workers ) ]
+                self.results = ctx.Queue()
+                self.incumbent = ctx.Value( 'd', float('inf') )
+                self.idle = ctx.Array( 'b', num_workers )
+                self.sent = ctx.Value( 'q', 0 )
+                self.received = ctx.Value( 'q', 0 )
+                self.done = ctx.Value( 'b', 0 )
+                self.expanded = ctx.Value( 'q', 0 )
+
+        def add( self, counter, n ) :
+                with counter.get_lock() :
+                        counter.value += n
+
+        # Takes two snapshots of the idle flags and message counters: the
+        # search is over if all workers are idle in both, and no message
+        # was sent or received in between or is still on its way.
+        def quiescent( self ) :
+                snapshots = []
+                for k in range( 2 ) :
+                        if not all( self.idle[:] ) :
+                                return False
+                        snapshots.append( ( self.sent.value, self.received.value ) )
+                        if k == 0 : time.sleep( POLL_INTERVAL )
+                ( s1, r1 ), ( s2, r2 ) = snapshots
+                return s1 == r1 == s2 == r2
+
+# States travel between workers as their primary valuation; the
+# successor function has already checked that they are valid.
+def encode_state( state ) :
+        return tuple( state.primary.iter_values() )
+
+def decode_state( task, values ) :
+        from model.generic.planning.task import State
+        from model.generic.hybrid.state import HybridState
+        s = HybridState( State( task.task, values ), task.secondary, task.inactive_by_default, task.triggers )
+        s.valid = True
+        s.secondary = None
+        return s
+
+# The hash of a packed state is the integer of its bits, whose low bits
+# hardly vary, so the hash value is mixed (as in MurmurHash3's
+# finalizer) before it is taken modulo the number of workers.
+def owner( state, num_workers ) :
+        h = hash( state ) & 0xffffffffffffffff
+        h ^= h >> 33
+        h = ( h * 0xff51afd7ed558ccd ) & 0xffffffffffffffff
+        h ^= h >> 33
+        h = ( h * 0xc4ceb9fe1a85ec53 ) & 0xffffffffffffffff
+        h ^= h >> 33
+        return h % num_workers
+
+def hda_worker( index, task, heuristic, succ_fn, channels, limits ) :
+        """
+        The search of one worker: A* over the states it owns, with the
+        successors of each expanded state sent to their owners. Nodes are
+        evaluated by their owner, when they arrive. A node is expanded
+        only if its f value is below the cost of the best plan found by
+        any worker; a goal state that improves on it becomes the new best
+        plan. Plans are kept as the sequence of action indices from the
+        initial state. A worker that reaches one of the limits tells the
+        coordinator, which stops the search.
+        """
+        inbox = channels.inboxes[index]
+        for q in channels.inboxes :
+                q.cancel_join_thread()
+        # the models made by this worker (its secondary model, and those
+        # of the heuristic) are made in a Gurobi environment of its own
+        init_worker_env()
+        if task.lp is not None :
+                # a solver model of its own
+                from model.generic.hybrid.secondary import SecondaryModel
+                task.secondary = SecondaryModel( task.lp )
+        open = make_open_list( task )
+        state_cost = {}
+        paths = {}
+        expansions = 0
+        num_workers = channels.num_workers
+
+        def receive( batch ) :
+                for values, g, path in batch :
+                        state = decode_state( task, values )
+                        if g >= state_cost.get( state, float('inf') ) :
+                                continue
+                        state_cost[state] = g
+                        paths[state] = path
+                        node = searchspace.make_root_node( state )
+                        node.g = g
+                        h = heuristic( node )
+                        receive.evaluations += 1
+                        if h == float('inf') :
+                                continue
+                        receive.tie += 1
+                        node.tie = receive.tie
+                        node.h = h
+                        open.push( ( g + h, h, receive.tie, node ) )
+        receive.evaluations = 0
+        receive.tie = 0
+
+        while not channels.done.value :
+                # take in all the messages waiting
+                while True :
+                        try :
+                                batch = inbox.get_nowait()
+                        except Empty :
+                                break
+                        channels.idle[index] = 0
+                        channels.add( channels.received, 1 )
+                        receive( batch )
+                incumbent = channels.incumbent.value
+                if len(open) == 0 or open.top()[0] >= incumbent :
+                        channels.idle[index] = 1
+                        try :
+                                batch = inbox.get( timeout = POLL_INTERVAL )
+                        except Empty :
+                                continue
+                        channels.idle[index] = 0
+                        channels.add( channels.received, 1 )
+                        receive( batch )
+                        continue
+                channels.idle[index] = 0
+                f, h, _tie, pop_node = open.pop()
+                pop_state = pop_node.state
+                if state_cost[pop_state] != pop_node.g :
+                        continue
+                if limits is not None :
+                        channels.add( channels.expanded, 1 )
+                        reason = limits.exhausted( channels.expanded.value )
+                        if reason is not None :
+                                channels.results.put( ( 'limit', index, reason ) )
+                                break
+                expansions += 1
+                path = paths[pop_state]
+                if task.goal_reached( pop_state ) :
+                        with channels.incumbent.get_lock() :
+                                if pop_node.g < channels.incumbent.value :
+                                        channels.incumbent.value = pop_node.g
+                                        channels.results.put( ( 'plan', pop_node.g, path ) )
+                        continue
+                outgoing = [ [] for k in range( num_workers ) ]
+                for op, succ_state in task.get_successor_states( pop_state, succ_fn ) :
+                        succ_g = pop_node.g + op.cost
+                        outgoing[ owner( succ_state, num_workers ) ].append( ( encode_state( succ_state ), succ_g, path + ( op.index, ) ) )
+                for k, batch in enumerate( outgoing ) :
+                        if len(batch) == 0 : continue
+                        if k == index :
+                                receive( batch )
+                                continue
+                        # counted as sent before it can be received
+                        channels.add( channels.sent, 1 )
+                        channels.inboxes[k].put( batch )
+        channels.results.put( ( 'stats', index, expansions, receive.evaluations, heuristic_statistics( heuristic ) ) )
+
+class MessageRecorder( logging.Handler ) :
+        """
+        Logging handler that keeps the messages logged, rather than
+        writing them out.
+        """
+
+        def __init__( self ) :
+                logging.Handler.__init__( self )
+                self.messages = []
+
+        def emit( self, record ) :
+                self.messages.append( record.getMessage() )
+
+# Returns the messages that heuristic.print_statistics() logs (none if
+# the heuristic has no statistics), for the coordinator to log them.
+def heuristic_statistics( heuristic ) :
+        if not hasattr( heuristic, 'print_statistics' ) :
+                return []
+        root = logging.getLogger()
+        recorder = MessageRecorder()
+        handlers = root.handlers
+        root.handlers = [ recorder ]
+        try :
+                heuristic.print_statistics()
+        finally :
+                root.handlers = handlers
+        return recorder.messages
+
+def hda_worker_main( index, task, heuristic, succ_fn, channels, limits ) :
+        try :
+                hda_worker( index, task, heuristic, succ_fn, channels, limits )
+        except Exception :
+                channels.results.put( ( 'error', index, traceback.format_exc() ) )
+
+def hda_star_search( task, heuristic, succ_fn = None, num_workers = None, limits = None ) :
+        """
+        Searches for a plan in the given task using HDA*: A* search over
+        num_workers processes (by default NUM_WORKERS), forked from this
+        one, each with its own open and closed lists, its own copy of the
+        heuristic and its own secondary model. This process only
+        coordinates them: it collects the plans they find, and stops them
+        when they are all idle and no message is in transit, at which
+        point no open node has an f value lower than the cost of the best
+        plan, so that with an admissible heuristic that plan is optimal.
+
+        succ_fn must not change the actions of the task, since each
+        worker has its own copy of it. With a single worker, or where
+        processes can't be forked, this is plain A* search. The
+        statistics of the heuristic (see print_statistics) are logged
+        for each worker at the end of the search.
+
+        @param task The task to be solved
+        @param heuristic A heuristic callable which computes the estimated
+                         steps from a search node to reach the goal.
+        @param succ_fn The successor function (by default,
+                       task.compute_successor_state)
+        @param num_workers The number of worker processes
+        @param limits Optional SearchLimits, checked by each worker: the
+                      expansions are those of all workers, the memory and
+                      calls to the secondary model's solver those of the
+                      worker. When one is reached, LimitReached is raised,
+                      with the best plan found so far, if any.
+        """
+        if num_workers is None :
+                num_workers = NUM_WORKERS
+        if num_workers is None :
+                num_workers = multiprocessing.cpu_count()
+        if num_workers <= 1 or 'fork' not in multiprocessing.get_all_start_methods() :
+                logging.info( 'HDA*: {0}, running A* in this process'.format( 'a single worker' if num_workers <= 1 else 'processes can\'t be forked' ) )
+                try :
+                        return astar_search( task, heuristic, succ_fn, limits = limits )
+                finally :
+                        if hasattr( heuristic, 'print_statistics' ) :
+                                heuristic.print_statistics()
+        if succ_fn is None :
+                succ_fn = task.compute_successor_state
+        logging.info( 'HDA*: {0} worker processes'.format( num_workers ) )
+        ctx = multiprocessing.get_context( 'fork' )
+        channels = HDAChannels( ctx, num_workers )
+        root = task.initial_state
+        channels.add( channels.sent, 1 )
+        channels.inboxes[ owner( root, num_workers ) ].put( [ ( encode_state( root ), 0, () ) ] )
+        workers = [ ctx.Process( target = hda_worker_main, args = ( i, task, heuristic, succ_fn, channels, limits ) ) for i in range( num_workers ) ]
+        for w in workers :
+                w.start()
+
+        best_cost, best_path = float('inf'), None
+        errors = []
+        stats = []
+        limit_reached = None
+        while len(stats) + len(errors) < num_workers :
+                try :
+                        msg = channels.results.get( timeout = POLL_INTERVAL )
+                except Empty :
+                        if any( [ w.exitcode not in ( None, 0 ) for w in workers ] ) :
+                                logging.error( 'HDA*: a worker process died' )
+                                errors.append( None )
+                                channels.done.value = 1
+                                break
+                        if not channels.done.value and channels.quiescent() :
+                                channels.done.value = 1
+                        continue
+                if msg[0] == 'plan' :
+                        _, cost, path = msg
+                        if cost < best_cost :
+                                best_cost, best_path = cost, path
+                                logging.info( 'HDA*: plan found, cost {0}'.format( cost ) )
+                elif msg[0] == 'stats' :
+                        stats.append( msg[1:] )
+                elif msg[0] == 'limit' :
+                        if limit_reached is None :
+                                limit_reached = msg[2]
+                                logging.info( 'HDA*: worker {0} reached the {1} limit'.format( msg[1], msg[2] ) )
+                        channels.done.value = 1
+                else :
+                        logging.error( 'HDA*: worker {0} failed:\n{1}'.format( msg[1], msg[2] ) )
+                        errors.append( msg[1] )
+                        channels.done.value = 1
+        for w in workers :
+                w.join( None if len(errors) == 0 else 1 )
+                if w.is_alive() :
+                        w.terminate()
+        if len(errors) > 0 :
+                raise RuntimeError( 'HDA*: {0} worker(s) failed'.format( len(errors) ) )
+
+        expansions = sum( [ e for _, e, _, _ in stats ] )
+        evaluations = sum( [ n for _, _, n, _ in stats ] )
+        for i, e, n, h_stats in sorted( stats ) :
+                logging.info( 'HDA*: worker {0}: {1} nodes expanded, {2} nodes evaluated'.format( i, e, n ) )
+                for message in h_stats :
+                        logging.info( 'HDA*: worker {0}: {1}'.format( i, message ) )
+        if limit_reached is not None :
+                plan = [ task.actions[i] for i in best_path ] if best_path is not None else None
+                raise LimitReached( limit_reached, expansions, plan = plan )
+        if best_path is None :
+                logging.info( "No operators left. Task unsolvable." )
+                logging.info( "{0} Nodes expanded, {1} Nodes evaluated".format( expansions, evaluations ) )
+                return None
+        logging.info( "Goal reached. Start extraction of solution." )
+        logging.info( "{0} Nodes expanded, {1} Nodes evaluated".format( expansions, evaluations ) )
+        return [ task.actions[i] for i in best_path ]
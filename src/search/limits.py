@@ -0,0 +1,131 @@
+"""
+Resource limits for the searches: wall-clock time, peak memory (resident
+set size), node expansions and calls to the solver of the secondary
+model. A search given a SearchLimits object checks it once per expansion
+and, when some limit is reached, raises LimitReached, which carries what
+the search had found by then.
+"""
+
+import logging
+import os
+import sys
+import time
+
+try :
+        import resource
+except ImportError :
+        # not available on Windows: memory limits are not checked
+        resource = None
+
+TIMER_FUN = time.time
+
+class LimitReached( Exception ) :
+        """
+        Raised by a search when it reaches one of its limits. Holds the
+        limit that was reached (one of 'time', 'memory', 'expansions' and
+        'lp_calls'), the number of nodes expanded, the lowest h value
+        seen, the highest f value of an expanded node (a lower bound on
+        the optimal plan cost for A*; None for searches that have no f
+        bound), the best plan found so far (for the searches that can
+        find more than one; None otherwise), and the sequence of actions
+        leading to the node with the lowest h value.
+        """
+
+        def __init__( self, reason, expansions, best_h = None, f_bound = None, plan = None, best_prefix = None ) :
+                Exception.__init__( self, 'search limit reached: {0}'.format( reason ) )
+                self.reason = reason
+                self.expansions = expansions
+                self.best_h = best_h
+                self.f_bound = f_bound
+                self.plan = plan
+                self.best_prefix = best_prefix
+
+        def log( self ) :
+                logging.info( 'Search limit reached: {0}'.format( self.reason ) )
+                logging.info( '{0} Nodes expanded'.format( self.expansions ) )
+                if self.best_h is not None :
+                        logging.info( 'Best h value: {0}'.format( self.best_h ) )
+                if self.f_bound is not None :
+                        logging.info( 'f bound reached: {0}'.format( self.f_bound ) )
+                if self.best_prefix is not None :
+                        logging.info( 'Best h value reached after {0} actions: {1}'.format( len(self.best_prefix), ' '.join( [ a.name for a in self.best_prefix ] ) ) )
+
+class SearchLimits :
+        """
+        Limits on a search: time_limit in seconds of wall-clock time since
+        the object was created (or since start() was last called),
+        memory_limit in MB of peak resident set size of this process,
+        max_expansions, and max_lp_calls on the number of consistency
+        checks solved by the secondary model (SecondaryModel, including
+        those solved by worker processes). None means no limit.
+
+        All limits are checked at every call of check(), except for the
+        memory limit, which is checked at most once every
+        MEMORY_CHECK_INTERVAL seconds, since finding out the peak memory
+        takes a system call.
+        """
+
+        MEMORY_CHECK_INTERVAL = 0.1
+
+        def __init__( self, time_limit = None, memory_limit = None, max_expansions = None, max_lp_calls = None ) :
+                self.time_limit = time_limit
+                self.memory_limit = memory_limit
+                self.max_expansions = max_expansions
+                self.max_lp_calls = max_lp_calls
+                self.start()
+
+        # Returns the limits given by the environment variables
+        # SEARCH_TIME_LIMIT, SEARCH_MEMORY_LIMIT, SEARCH_MAX_EXPANSIONS
+        # and SEARCH_MAX_LP_CALLS, or None if none of them is set.
+        @staticmethod
+        def from_environment() :
+                values = []
+                for name, convert in [ ( 'SEARCH_TIME_LIMIT', float ), ( 'SEARCH_MEMORY_LIMIT', float ), ( 'SEARCH_MAX_EXPANSIONS', int ), ( 'SEARCH_MAX_LP_CALLS', int ) ] :
+                        value = os.environ.get( name )
+                        values.append( convert( value ) if value else None )
+                if all( [ v is None for v in values ] ) :
+                        return None
+                return SearchLimits( *values )
+
+        def start( self ) :
+                self.start_time = TIMER_FUN()
+                self.start_lp_calls = lp_calls()
+                self.next_memory_check = self.start_time
+
+        # Returns the name of the limit reached, or None.
+        def exhausted( self, expansions ) :
+                if self.max_expansions is not None and expansions >= self.max_expansions :
+                        return 'expansions'
+                now = TIMER_FUN()
+                if self.time_limit is not None and now - self.start_time >= self.time_limit :
+                        return 'time'
+                if self.max_lp_calls is not None and lp_calls() - self.start_lp_calls >= self.max_lp_calls :
+                        return 'lp_calls'
+                if self.memory_limit is not None and now >= self.next_memory_check :
+                        self.next_memory_check = now + SearchLimits.MEMORY_CHECK_INTERVAL
+                        if peak_memory() >= self.memory_limit :
+                                return 'memory'
+                return None
+
+        # Raises LimitReached if some limit has been reached; node is the
+        # node with the lowest h value, if the search keeps track of it.
+        def check( self, expansions, best_h = None, f_bound = None, node = None, plan = None ) :
+                reason = self.exhausted( expansions )
+                if reason is None :
+                        return
+                best_prefix = node.extract_solution() if node is not None else None
+                raise LimitReached( reason, expansions, best_h, f_bound, plan, best_prefix )
+
+# Peak resident set size of this process, in MB (0 if unknown).
+def peak_memory() :
+        if resource is None :
+                return 0
+        peak = resource.getrusage( resource.RUSAGE_SELF ).ru_maxrss
+        if sys.platform == 'darwin' :
+                # bytes, rather than KB
+                return peak / ( 1024.0 * 1024.0 )
+        return peak / 1024.0
+
+def lp_calls() :
+        from model.generic.hybrid.secondary import SecondaryModel
+        return SecondaryModel.calls_to_optimize + SecondaryModel.prefetched
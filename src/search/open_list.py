@@ -0,0 +1,169 @@
+"""
+Open lists for best-first search. Entries are the tuples made by the
+make_open_entry functions, (f, h, tie, node) or similar: they are ordered
+by the first three components, and the last is the search node.
+"""
+
+import heapq
+from collections import deque
+
+def make_open_list( task ) :
+        """
+        Returns a bucket open list if all action costs in the task are
+        integral, and a heap otherwise.
+        """
+        for action in task.actions :
+                if not float( action.cost ).is_integer() :
+                        return HeapOpenList()
+        return BucketOpenList()
+
+class HeapOpenList :
+        """
+        Open list on a binary heap: O(log n) push and pop, for keys of any
+        kind.
+        """
+
+        def __init__( self ) :
+                self.heap = []
+
+        def __len__( self ) :
+                return len(self.heap)
+
+        def push( self, entry ) :
+                heapq.heappush( self.heap, entry )
+
+        def pop( self ) :
+                return heapq.heappop( self.heap )
+
+        def top( self ) :
+                return self.heap[0]
+
+class BucketOpenList :
+        """
+        Two-level bucket queue: entries are kept in buckets indexed by the
+        first and second components of the key (e.g., f and h), which must
+        be non-negative integers. Only the non-empty buckets are stored,
+        in a dict for each level, and the lowest f, and the lowest h of
+        each f, are kept as cursors. Within a bucket, entries are ordered
+        by the third component (tie), and then first in first out.
+
+        Each bucket is a deque. Searches that number their entries in
+        order of insertion (A*) only ever append to it; an entry whose tie
+        is lower than that of the last one (PrefPEA* putting back the
+        node it is expanding) goes to the front if its tie is not higher
+        than that of the first one, and otherwise is inserted in order,
+        in time linear in the size of the bucket. Push is otherwise
+        constant time, and so is pop, except when it empties a bucket:
+        the cursor then moves to the lowest remaining key of the level,
+        found in time linear in the number of non-empty buckets of the
+        level.
+
+        Entries with an infinite key are kept apart, and come out last.
+        If a key that is not a non-negative integer is pushed, or a level
+        comes to have more than MAX_KEYS non-empty buckets (so that moving
+        the cursors would no longer be cheap), the open list turns itself
+        into a heap.
+        """
+
+        MAX_KEYS = 1024
+
+        def __init__( self ) :
+                self.buckets = {} # f -> h -> deque of entries
+                self.min_f = None
+                self.min_h = {} # f -> lowest h of a non-empty bucket
+                self.size = 0
+                self.infinite = HeapOpenList()
+                self.fallback = None
+
+        def __len__( self ) :
+                if self.fallback is not None :
+                        return len(self.fallback)
+                return self.size + len(self.infinite)
+
+        def push( self, entry ) :
+                if self.fallback is not None :
+                        self.fallback.push( entry )
+                        return
+                f, h, tie = entry[0], entry[1], entry[2]
+                if f == float('inf') or h == float('inf') :
+                        self.infinite.push( entry )
+                        return
+                if f < 0 or h < 0 or f != int(f) or h != int(h) :
+                        self.switch_to_heap()
+                        self.fallback.push( entry )
+                        return
+                f, h = int(f), int(h)
+                h_buckets = self.buckets.get( f )
+                if h_buckets is None :
+                        if len(self.buckets) == self.MAX_KEYS :
+                                self.switch_to_heap()
+                                self.fallback.push( entry )
+                                return
+                        h_buckets = self.buckets[f] = {}
+                        self.min_h[f] = h
+                        if self.min_f is None or f < self.min_f :
+                                self.min_f = f
+                elif h < self.min_h[f] :
+                        self.min_h[f] = h
+                bucket = h_buckets.get( h )
+                if bucket is None :
+                        if len(h_buckets) == self.MAX_KEYS :
+                                self.switch_to_heap()
+                                self.fallback.push( entry )
+                                return
+                        bucket = h_buckets[h] = deque()
+                if len(bucket) == 0 or bucket[-1][2] <= tie :
+                        bucket.append( entry )
+                elif tie <= bucket[0][2] :
+                        bucket.appendleft( entry )
+                else :
+                        i = len(bucket) - 1
+                        while bucket[i-1][2] > tie :
+                                i -= 1
+                        bucket.insert( i, entry )
+                self.size += 1
+
+        def first_bucket( self ) :
+                return self.buckets[self.min_f][self.min_h[self.min_f]]
+
+        def pop( self ) :
+                if self.fallback is not None :
+                        return self.fallback.pop()
+                if self.size == 0 :
+                        return self.infinite.pop()
+                f, h = self.min_f, self.min_h[self.min_f]
+                h_buckets = self.buckets[f]
+                bucket = h_buckets[h]
+                entry = bucket.popleft()
+                self.size -= 1
+                if len(bucket) == 0 :
+                        # move the cursors to the next non-empty bucket
+                        del h_buckets[h]
+                        if len(h_buckets) > 0 :
+                                self.min_h[f] = min( h_buckets )
+                        else :
+                                del self.buckets[f]
+                                del self.min_h[f]
+                                self.min_f = min( self.buckets ) if len(self.buckets) > 0 else None
+                return entry
+
+        def top( self ) :
+                if self.fallback is not None :
+                        return self.fallback.top()
+                if self.size == 0 :
+                        return self.infinite.top()
+                return self.first_bucket()[0]
+
+        def switch_to_heap( self ) :
+                self.fallback = HeapOpenList()
+                for h_buckets in self.buckets.values() :
+                        for bucket in h_buckets.values() :
+                                for entry in bucket :
+                                        self.fallback.push( entry )
+                for entry in self.infinite.heap :
+                        self.fallback.push( entry )
+                self.buckets = {}
+                self.min_h = {}
+                self.min_f = None
+                self.size = 0
+                self.infinite = None
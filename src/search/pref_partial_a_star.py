@@ -2,10 +2,10 @@
 Implements the Preferred Partial A* (a-star) algorithm.
 """
 
-import heapq
 import logging
 
 from search import searchspace
+from search.open_list import make_open_list
 
 
 def ordered_node_astar(node, h, node_tiebreaker):
@@ -53,7 +53,7 @@ def new_state( succ_node, heuristic_fn, open_fn, open_list, open_hash, closed_li
                 if h == float('inf' ) :
                         #logging.info( 'PrefPEA*: Successor has infinite heuristic value' ) 
                         return False
-                heapq.heappush( open_list, open_fn( succ_node, h, tie_breaking_function(succ_node) ) )
+                open_list.push( open_fn( succ_node, h, tie_breaking_function(succ_node) ) )
                 open_hash[ succ_node.state ] = succ_node
                 logging.debug( 'PrefPEA*: Successor f={0}, h={1}, g={2}, s={3} got into OPEN via preferred operator'.format(succ_node.f, h, succ_node.g, str(succ_node.state.primary)) )
                 return True
@@ -67,18 +67,18 @@ def new_state( succ_node, heuristic_fn, open_fn, open_list, open_hash, closed_li
                         open_hash[ n_prima.state ] = n_prima
                         assert n_prima.state in open_hash
                         closed_list.pop( n_prima.state )
-                        #heapq.heappush( open_list, open_fn( n_prima, n_prima.h, tie_breaking_function(n_prima) ) )
+                        #open_list.push( open_fn( n_prima, n_prima.h, tie_breaking_function(n_prima) ) )
                         logging.info( 'Reopening node in closed: {0}'.format( n_prima.state ) )
 
                 # whether in closed or not, the updated node needs to be re-inserted into open
                 # to ensure it's in the right position
-                heapq.heappush( open_list, open_fn( n_prima, n_prima.h, tie_breaking_function(n_prima) ) )
+                open_list.push( open_fn( n_prima, n_prima.h, tie_breaking_function(n_prima) ) )
                 return False
 
         return False
 
 
-def pref_partial_astar_search(task, heuristic, succ_fn = None, make_open_entry=ordered_node_astar ):
+def pref_partial_astar_search(task, heuristic, succ_fn = None, make_open_entry=ordered_node_astar, limits = None ):
         """
         Searches for a plan in the given task using A* search.
         
@@ -91,15 +91,17 @@ def pref_partial_astar_search(task, heuristic, succ_fn = None, make_open_entry=o
                                 ordered_node_weighted_astar and
                                 ordered_node_greedy_best_first with obvious
                                 meanings.
+        @param limits Optional SearchLimits; when one is reached, LimitReached
+                      is raised.
         """
         if succ_fn is None :
                 succ_fn = task.compute_successor_state
-        open = []
+        open = make_open_list( task )
         node_tiebreaker = 0
         
         root = searchspace.make_root_node(task.initial_state)
         init_h = heuristic(root)
-        heapq.heappush(open, make_open_entry(root, init_h, tie_breaking_function(root)))
+        open.push(make_open_entry(root, init_h, tie_breaking_function(root)))
         logging.info("Initial h value: %f" % init_h)
         # try:
         #     heuristic.print_relaxed_plan()
@@ -113,12 +115,13 @@ def pref_partial_astar_search(task, heuristic, succ_fn = None, make_open_entry=o
                 return None
 
         besth = float('inf')
+        best_node = None
         maxf = root.g + root.h
         counter = 0
         expansions = 0
 
         while open:
-                entry = heapq.heappop(open) # this is the best node in Open
+                entry = open.pop() # this is the best node in Open
                 f, h, _tie, pop_node = entry
                 check_f = pop_node.g + h
                 if check_f < f:
@@ -135,8 +138,11 @@ def pref_partial_astar_search(task, heuristic, succ_fn = None, make_open_entry=o
                     logging.info("f = %d, nodes = %d" % (maxf, expansions))
                 if h < besth:
                         besth = h
+                        best_node = pop_node
                         logging.debug("Found new best h: %d after %d evaluations" %
                                         (besth, counter))
+                if limits is not None :
+                        limits.check( expansions, besth, maxf if make_open_entry is ordered_node_astar else None, best_node )
 
                 pop_state = pop_node.state
                 if h == float('inf') :
@@ -159,7 +165,7 @@ def pref_partial_astar_search(task, heuristic, succ_fn = None, make_open_entry=o
                         # generate successor (expensive!)
                         succ_state = succ_fn( pop_state, action )
                         if succ_state is None :
-                                heapq.heappush( open, (f, h, _tie, pop_node) )
+                                open.push( (f, h, _tie, pop_node) )
                                 pending[ pop_state ] = pop_node
                                 continue
                         logging.debug( 'Applying helpful action: {0} with cost: {1}'.format( action.name, action.cost ) ) 
@@ -167,11 +173,11 @@ def pref_partial_astar_search(task, heuristic, succ_fn = None, make_open_entry=o
                         if new_state( succ_node, heuristic, make_open_entry, open, pending, closed ) :
                                 counter += 1
                                 #assert succ_node.state in pending
-                        heapq.heappush( open, (f, h, _tie, pop_node) )
+                        open.push( (f, h, _tie, pop_node) )
                         pending[ pop_state ] = pop_node
                         continue
                         
-                for a in task.actions :
+                for a in task.applicable_actions( pop_state ) :
                         if a in pop_node.preferred_ops : continue
                         #logging.info( 'PrefPEA*: Generating successor through non-preferred op...' ) 
                         succ_state = succ_fn( pop_state, a )
@@ -186,6 +192,8 @@ def pref_partial_astar_search(task, heuristic, succ_fn = None, make_open_entry=o
                 logging.debug( 'PrefPEA*: closing f={0}, h={1}, g={2}, po(n)={3}, s={4}, n={5}'.format( pop_node.f, pop_node.h, pop_node.g, len(pop_node.preferred_ops)-pop_node.preferred_ops_counter, str(pop_node.state.primary), [act.name for act in pop_node.extract_solution() ] ) )
                 closed[ pop_state ] = pop_node        
                 expansions += 1
+                # the basis is only used to check its successors
+                pop_state.basis = None
 
         logging.info("No operators left. Task unsolvable.")
         logging.info("{0} Nodes expanded, {1} Nodes evaluated".format (expansions, counter))
@@ -193,19 +201,24 @@ def pref_partial_astar_search(task, heuristic, succ_fn = None, make_open_entry=o
 
 
 ###
-# Delayed evaluation algorithm - don't know if this is correct
+# Delayed evaluation algorithm
 ##
 
+# Successors are queued with the h value of their parent, less the cost
+# of the action, which is a lower bound on their own if the heuristic is
+# consistent; they are evaluated when popped (see
+# pref_partial_astar_search_with_delayed_evaluation).
 def new_state_delayed_evaluation( succ_node, heuristic_fn, open_fn, open_list, open_hash, closed_list ) :
 
         # 1. does exist n' in open \cup closed s.t. state(n') = state
         in_open, in_closed, n_prima = check_duplicate( succ_node.state, open_hash, closed_list )
         
         if n_prima is None :
-                h = min( succ_node.parent.h - succ_node.action.cost, 0 )
-                heapq.heappush( open_list, open_fn( succ_node, h, succ_node.g ) )
+                succ_node.h = max( succ_node.parent.h - succ_node.action.cost, 0 )
+                succ_node.evaluated = False
+                open_list.push( open_fn( succ_node, succ_node.h, tie_breaking_function(succ_node) ) )
                 open_hash[ succ_node.state ] = succ_node
-                logging.debug( 'PrefPEA*: Successor f={0}, h={1} got into OPEN via preferred operator'.format(succ_node.f, h) )
+                logging.debug( 'PrefPEA*: Successor f={0}, h={1} got into OPEN, not evaluated'.format(succ_node.f, succ_node.h) )
                 return True
 
         if succ_node.g < n_prima.g : 
@@ -217,15 +230,23 @@ def new_state_delayed_evaluation( succ_node, heuristic_fn, open_fn, open_list, o
                         open_hash[ n_prima.state ] = n_prima
                         assert n_prima.state in open_hash
                         closed_list.pop( n_prima.state )
-                        heapq.heappush( open_list, make_open_entry( n_prima, n_prima.h, n_prima.g ) )
                         logging.info( 'Reopening node in closed: {0}'.format( n_prima.state ) )
+
+                # whether in closed or not, the updated node needs to be re-inserted into open
+                # to ensure it's in the right position
+                open_list.push( open_fn( n_prima, n_prima.h, tie_breaking_function(n_prima) ) )
                 return False
 
         return False
 
-def pref_partial_astar_search_with_delayed_evaluation(task, heuristic, succ_fn = None, make_open_entry=ordered_node_astar ):
+def pref_partial_astar_search_with_delayed_evaluation(task, heuristic, succ_fn = None, make_open_entry=ordered_node_astar, limits = None ):
         """
-        Searches for a plan in the given task using A* search.
+        Searches for a plan in the given task using Preferred Partial A*
+        search with delayed evaluation: successors are queued with a lower
+        bound on their h value obtained from their parent (see
+        new_state_delayed_evaluation), and evaluated when they are popped
+        from the open list. A node whose evaluated f value is greater than
+        the one it was queued with goes back into the open list.
         
         @param task The task to be solved
         @param heuristic  A heuristic callable which computes the estimated steps
@@ -236,50 +257,88 @@ def pref_partial_astar_search_with_delayed_evaluation(task, heuristic, succ_fn =
                                 ordered_node_weighted_astar and
                                 ordered_node_greedy_best_first with obvious
                                 meanings.
+        @param limits Optional SearchLimits; when one is reached, LimitReached
+                      is raised.
         """
         if succ_fn is None :
                 succ_fn = task.compute_successor_state
-        open = []
+        open = make_open_list( task )
         node_tiebreaker = 0
 
-        heuristic.num_calls = 0        
         root = searchspace.make_root_node(task.initial_state)
-        root.evaluated = False
-        heapq.heappush(open, make_open_entry(root, 0, 0))
+        init_h = heuristic(root)
+        root.h = init_h
+        root.evaluated = True
+        heuristic.num_calls = 1
+        open.push(make_open_entry(root, init_h, tie_breaking_function(root)))
+        logging.info("Initial h value: %f" % init_h)
         pending = {task.initial_state: root}
         closed = {}
 
+        if init_h == float('inf') :
+                logging.info( 'Problem has no solution, h(s0) = infty' )
+                return None
+
         besth = float('inf')
+        best_node = None
+        maxf = root.g + root.h
+        # number of nodes put into open without being evaluated
         counter = 0
         expansions = 0
 
+        def log_statistics() :
+                logging.info("{0} Nodes expanded, {1} Nodes evaluated".format (expansions, heuristic.num_calls))
+                logging.info("Delayed evaluation: {0} Nodes queued, {1} evaluations saved".format( counter + 1, counter + 1 - heuristic.num_calls ) )
+
         while open:
-                entry = heapq.heappop(open) # this is the best node in Open
+                entry = open.pop() # this is the best node in Open
                 f, h, _tie, pop_node = entry
-                #assert pop_node.state in pending        
+                if pop_node.g + h < f :
+                        # this node was re-inserted with a lower f-value, so this
+                        # entry is out of date
+                        continue
+                if pop_node.state not in pending :
+                        # the node was closed through a more recent entry
+                        continue
                 pending.pop( pop_node.state )
+                pop_state = pop_node.state
+
+                # goal states are recognised before they are evaluated
+                if task.goal_reached(pop_state):
+                        logging.info("Goal reached. Start extraction of solution.")
+                        log_statistics()
+                        return pop_node.extract_solution()
 
                 if not pop_node.evaluated :
                         pop_node.evaluated = True
                         heuristic.num_calls += 1
-                        h = heuristic( pop_node )        
+                        h = heuristic( pop_node )
+                        pop_node.h = h
+                        if h == float('inf') :
+                                closed[ pop_state ] = pop_node
+                                continue
+                        evaluated_entry = make_open_entry( pop_node, h, tie_breaking_function(pop_node) )
+                        if evaluated_entry[0] > f :
+                                open.push( evaluated_entry )
+                                pending[ pop_state ] = pop_node
+                                continue
+                        f, h, _tie, _ = evaluated_entry
 
+                if f > maxf :
+                        maxf = f
                 if h < besth:
                         besth = h
+                        best_node = pop_node
                         logging.debug("Found new best h: %d after %d evaluations" %
-                                        (besth, counter))
+                                        (besth, heuristic.num_calls))
+                if limits is not None :
+                        limits.check( expansions, besth, maxf if make_open_entry is ordered_node_astar else None, best_node )
 
-                pop_state = pop_node.state
                 if h == float('inf') :
                         # Remove from open
                         closed[ pop_state ] = pop_node        
                         continue        
 
-                if task.goal_reached(pop_state):
-                        logging.info("Goal reached. Start extraction of solution.")
-                        logging.info("{0} Nodes expanded, {1} Nodes evaluated".format (expansions, heuristic.num_calls))
-                        return pop_node.extract_solution()
-                
                 logging.debug( 'PrefPEA*: Expanding f={0}, h={1}, g={2}, po(n)={3}'.format( f, h, pop_node.g, len(pop_node.preferred_ops)-pop_node.preferred_ops_counter ) )
                 
                 if pop_node.preferred_ops_counter < len( pop_node.preferred_ops ) :
@@ -290,34 +349,35 @@ def pref_partial_astar_search_with_delayed_evaluation(task, heuristic, succ_fn =
                         # generate successor (expensive!)
                         succ_state = succ_fn( pop_state, action )
                         if succ_state is None :
-                                heapq.heappush( open, (f, h, _tie, pop_node) )
+                                open.push( (f, h, _tie, pop_node) )
                                 pending[ pop_state ] = pop_node
                                 continue
 
                         succ_node = searchspace.make_child_node( pop_node, action, succ_state )
-                        succ_node.evaluated = False
-                        new_state_delayed_evaluation( succ_node, heuristic, make_open_entry, open, pending, closed )
-                        heapq.heappush( open, (f, h, _tie, pop_node) )
+                        if new_state_delayed_evaluation( succ_node, heuristic, make_open_entry, open, pending, closed ) :
+                                counter += 1
+                        open.push( (f, h, _tie, pop_node) )
                         pending[ pop_state ] = pop_node
                         continue
                         
-                for a in task.actions :
+                for a in task.applicable_actions( pop_state ) :
                         if a in pop_node.preferred_ops : continue
-                        #logging.info( 'PrefPEA*: Generating successor through non-preferred op...' ) 
                         succ_state = succ_fn( pop_state, a )
                         if succ_state is None : 
                                 continue
                         succ_node = searchspace.make_child_node( pop_node, a, succ_state )
-                        succ_node.evaluated = False
-                        new_state_delayed_evaluation( succ_node, heuristic, make_open_entry, open, pending, closed )
+                        if new_state_delayed_evaluation( succ_node, heuristic, make_open_entry, open, pending, closed ) :
+                                counter += 1
                         
                 # Remove from open
-                logging.debug( 'PrefPEA*: closing f={0}, h={1}, g={2}, po(n)={3}'.format( pop_node.h, pop_node.h, pop_node.g, len(pop_node.preferred_ops)-pop_node.preferred_ops_counter ) )
+                logging.debug( 'PrefPEA*: closing f={0}, h={1}, g={2}, po(n)={3}'.format( f, h, pop_node.g, len(pop_node.preferred_ops)-pop_node.preferred_ops_counter ) )
                 closed[ pop_state ] = pop_node        
                 expansions += 1
+                # the basis is only used to check its successors
+                pop_state.basis = None
 
         logging.info("No operators left. Task unsolvable.")
-        logging.info("{0} Nodes expanded, {1} Nodes evaluated".format (expansions, heuristic.num_calls))
+        log_statistics()
         return None
 
 
@@ -325,7 +385,7 @@ def pref_partial_astar_search_with_delayed_evaluation(task, heuristic, succ_fn =
 # restarting algorithm - don't know if this is correct
 ##
 
-def restarting_pref_partial_astar_search(task, heuristic, make_open_entry=ordered_node_astar ):
+def restarting_pref_partial_astar_search(task, heuristic, make_open_entry=ordered_node_astar, limits = None ):
         """
         Searches for a plan in the given task using A* search.
         
@@ -338,34 +398,44 @@ def restarting_pref_partial_astar_search(task, heuristic, make_open_entry=ordere
                                 ordered_node_weighted_astar and
                                 ordered_node_greedy_best_first with obvious
                                 meanings.
+        @param limits Optional SearchLimits; when one is reached, LimitReached
+                      is raised. The expansions counted are those of this
+                      search, not of the previous ones before a restart.
         """
         succ_fn = task.compute_successor_state_ngl_dyn_model
-        open = []
+        open = make_open_list( task )
         node_tiebreaker = 0
         
         root = searchspace.make_root_node(task.initial_state)
         init_h = heuristic(root)
-        heapq.heappush(open, make_open_entry(root, init_h, tie_breaking_function(root)))
+        open.push(make_open_entry(root, init_h, tie_breaking_function(root)))
         logging.info("Initial h value: %f" % init_h)
         pending = {task.initial_state: root}
         closed = {}
 
         besth = float('inf')
+        best_node = None
+        maxf = root.g + init_h
         counter = 0
         expansions = 0
 
         while open:
-                entry = open[0] # this is the best node in Open
+                entry = open.top() # this is the best node in Open
                 (f, h, _tie, pop_node) = entry                
+                if f > maxf :
+                        maxf = f
                 if h < besth:
                         besth = h
+                        best_node = pop_node
                         logging.debug("Found new best h: %d after %d evaluations" %
                                         (besth, counter))
+                if limits is not None :
+                        limits.check( expansions, besth, maxf if make_open_entry is ordered_node_astar else None, best_node )
 
                 pop_state = pop_node.state
                 if h == float('inf') :
                         # Remove from open
-                        heapq.heappop( open )
+                        open.pop()
                         pending.pop( pop_state )
                         closed[ pop_state ] = pop_node        
                         continue        
@@ -393,7 +463,7 @@ def restarting_pref_partial_astar_search(task, heuristic, make_open_entry=ordere
                                 counter += 1
                         continue
                         
-                for a in task.actions :
+                for a in task.applicable_actions( pop_state ) :
                         if a in pop_node.preferred_ops : continue
                         #logging.info( 'PrefPEA*: Generating successor through non-preferred op...' ) 
                         succ_state, needs_restart = succ_fn( pop_state, a )
@@ -406,10 +476,12 @@ def restarting_pref_partial_astar_search(task, heuristic, make_open_entry=ordere
                         
                 # Remove from open
                 logging.debug( 'PrefPEA*: closing f={0}, h={1}, g={2}, po(n)={3}'.format( pop_node.h, pop_node.h, pop_node.g, len(pop_node.preferred_ops)-pop_node.preferred_ops_counter ) )
-                heapq.heappop( open )
+                open.pop()
                 pending.pop( pop_state )
                 closed[ pop_state ] = pop_node        
                 expansions += 1
+                # the basis is only used to check its successors
+                pop_state.basis = None
 
         logging.info("No operators left. Task unsolvable.")
         logging.info("{0} Nodes expanded, {1} Nodes evaluated".format (expansions, counter))
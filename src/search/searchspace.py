@@ -29,7 +29,14 @@ class SearchNode:
     search space for planning algorithms. Each node links to is parent
     node and contains informations about the state, action to arrive
     the node and the path length in the count of applied operators.
+
+    Nodes have fixed slots, for the attributes set by the search
+    algorithms and heuristics, instead of a __dict__ each.
     """
+    __slots__ = ('state', 'parent', 'action', 'g', 'h', 'f', 'tie',
+                 'preferred_ops', 'preferred_ops_counter', 'landmarks',
+                 'evaluated')
+
     def __init__(self, state, parent, action, g):
         """
         Construct a search node
@@ -44,6 +51,13 @@ class SearchNode:
         self.parent = parent
         self.action = action
         self.g = g
+        self.h = None
+        self.f = None
+        self.tie = 0
+        self.preferred_ops = ()
+        self.preferred_ops_counter = 0
+        self.landmarks = None
+        self.evaluated = False
 
     def extract_solution(self):
         """
@@ -1,10 +1,13 @@
 from         heuristics.h_max                import         H_Max
 from         heuristics.h_plus                import         H_Plus
 from         heuristics.h_zero                import         H_Zero
+from         heuristics.lm_cut                import         H_LMCut
 
 import  search
+from         search.limits                import         SearchLimits, LimitReached
 
 import logging
+import sys
 import time
 
 #TIMER_FUN = time.clock
@@ -18,11 +21,25 @@ def     log_plan( the_plan ) :
                 total_cost += action.cost
         logging.info( 'Plan Cost: {0}'.format( total_cost ) )
 
+# Logs what a search that reached its limits had found, and returns the
+# best plan it had found, if any.
+def        log_limit_reached( e ) :
+        e.log()
+        if e.plan is None :
+                return None
+        logging.info( 'Best plan found before reaching the limit:' )
+        return e.plan
+
 def         solve_blind( task, search_fn, planner_name ) :
         
         start_time = TIMER_FUN()
 
-        the_plan = search_fn( task )
+        try :
+                the_plan = search_fn( task, limits = SearchLimits.from_environment() )
+        except LimitReached as e :
+                the_plan = log_limit_reached( e )
+        finally :
+                task.close_check_pool()
         
         logging.info( 'Wall-clock {0} search time: {1:.4}'.format( planner_name, TIMER_FUN() - start_time ) )
         if the_plan is None :
@@ -37,11 +54,18 @@ def         solve_blind( task, search_fn, planner_name ) :
 def         solve_restarting( task, search_fn, h, planner_name ) :
 
         start_time = TIMER_FUN()
+        # the same limits hold for all the restarts
+        limits = SearchLimits.from_environment()
 
-        while True :
-                the_plan, needs_restart = search_fn( task, h )
-                if the_plan is None : break
-                if needs_restart is False : break
+        try :
+                while True :
+                        the_plan, needs_restart = search_fn( task, h, limits = limits )
+                        if the_plan is None : break
+                        if needs_restart is False : break
+        except LimitReached as e :
+                the_plan = log_limit_reached( e )
+        finally :
+                task.close_check_pool()
         
         logging.info( 'Wall-clock {0} search time: {1:.4}'.format( planner_name, TIMER_FUN() - start_time ) )
         
@@ -57,7 +81,12 @@ def         solve_restarting( task, search_fn, h, planner_name ) :
 
 def         solve_heuristic( task, search_fn, h, planner_name, succ_fn = None ) :
         start_time = TIMER_FUN()
-        the_plan = search_fn( task, h, succ_fn )
+        try :
+                the_plan = search_fn( task, h, succ_fn, limits = SearchLimits.from_environment() )
+        except LimitReached as e :
+                the_plan = log_limit_reached( e )
+        finally :
+                task.close_check_pool()
         logging.info( 'Wall-clock {0} search time: {1:.4}'.format( planner_name, TIMER_FUN() - start_time ) )
         if the_plan is None :
                 print( 'No solution found.' )
@@ -70,14 +99,36 @@ def         solve_heuristic( task, search_fn, h, planner_name, succ_fn = None )
         #task.validate(the_plan)
         return the_plan
 
-configs = [  'blind', 'iw_1', 'iw_2', 'bfs_f_1', 'bfs_f_2', 'a_star_h0', 'a_star_hmax', 'a_star_hplus', 'ppa_star_hplus', 'ppa_star_hplus_r1', 'ppa_star_hmax', 'ppa_star_hplus_ngl','ppa_star_hplus_ngl2', 'restarting_ppa_star_hplus',
-                'delayed_eval_ppa_star_hplus', 'delayed_eval_ppa_star_hplus_ngl2', 'ppa_star_pdb_trivial', 'ppa_star_pdb_naive', 'ppa_star_pdb_haslum_aaai07', 'a_star_pdb_haslum_aaai07', 'ppa_star_pdb_haslum_aaai07_ngl',
+# Runs an anytime search, which logs each plan as soon as it finds it.
+def         solve_anytime( task, search_fn, h, planner_name, succ_fn = None ) :
+        start_time = TIMER_FUN()
+        def on_plan( the_plan, cost ) :
+                logging.info( 'Wall-clock {0} time to plan of cost {1}: {2:.4}'.format( planner_name, cost, TIMER_FUN() - start_time ) )
+                log_plan( the_plan )
+                sys.stdout.flush()
+        try :
+                the_plan = search_fn( task, h, succ_fn, on_plan = on_plan, limits = SearchLimits.from_environment() )
+        except LimitReached as e :
+                e.log()
+                the_plan = e.plan
+        finally :
+                task.close_check_pool()
+        logging.info( 'Wall-clock {0} search time: {1:.4}'.format( planner_name, TIMER_FUN() - start_time ) )
+        if the_plan is None :
+                print( 'No solution found.' )
+        return the_plan
+
+configs = [  'blind', 'iw_1', 'iw_2', 'bfs_f_1', 'bfs_f_2', 'a_star_h0', 'a_star_hmax', 'a_star_hplus', 'ppa_star_hplus', 'a_star_lmcut', 'ppa_star_lmcut', 'wa_star_hplus', 'anytime_wa_star_hmax', 'anytime_wa_star_hplus', 'anytime_wa_star_lmcut', 'hda_star_hmax', 'hda_star_hplus', 'hda_star_lmcut', 'ppa_star_hplus_r1', 'ppa_star_hmax', 'ppa_star_hplus_ngl','ppa_star_hplus_ngl2', 'restarting_ppa_star_hplus',
+                'delayed_eval_a_star_hmax', 'delayed_eval_a_star_hplus', 'delayed_eval_a_star_lmcut', 'delayed_eval_gbfs_hplus', 'delayed_eval_ppa_star_hplus', 'delayed_eval_ppa_star_hplus_ngl2', 'ppa_star_pdb_trivial', 'ppa_star_pdb_naive', 'ppa_star_pdb_haslum_aaai07', 'a_star_pdb_haslum_aaai07', 'ppa_star_pdb_haslum_aaai07_ngl',
                 'ppa_star_pdb_haslum_aaai07_ngl2'   ]
 
 
 def solve( configuration, task ) :
         delayed_evaluation = False
-        if configuration == 'delayed_eval_ppa_star_hplus' :
+        if configuration in ( 'delayed_eval_a_star_hmax', 'delayed_eval_a_star_hplus', 'delayed_eval_a_star_lmcut' ) :
+                configuration = configuration[ len('delayed_eval_'): ]
+                delayed_evaluation = True
+        elif configuration == 'delayed_eval_ppa_star_hplus' :
                 configuration = 'ppa_star_hplus'
                 delayed_evaluation = True
         elif configuration == 'delayed_eval_ppa_star_hplus_ngl2' :
@@ -89,10 +140,10 @@ def solve( configuration, task ) :
                 solve_blind( task, search.breadth_first_search, 'Blind')
         elif 'iw_' in configuration :
                 if configuration == 'iw_1' :
-                        def IW1( task ) : return search.IW(task,1)
+                        def IW1( task, limits = None ) : return search.IW(task,1,limits)
                         solve_blind( task, IW1, 'IW(1)' )
                 elif configuration == 'iw_2' :
-                        def IW2( task ) : return search.IW(task,2)
+                        def IW2( task, limits = None ) : return search.IW(task,2,limits)
                         solve_blind( task, IW2, 'IW(2)' )
         elif 'bfs_f_' in configuration :
                 from heuristics.novelty import Novelty_Table
@@ -110,13 +161,70 @@ def solve( configuration, task ) :
         elif configuration == 'a_star_h0' :
                 solve_heuristic( task, search.astar_search, H_Zero(task), 'A* (h_0)' )
         elif configuration == 'a_star_hmax' :
-                solve_heuristic( task, search.astar_search, H_Max(task), 'A* (h_max)' )
+                if delayed_evaluation :
+                        solve_heuristic( task, search.lazy_astar_search, H_Max(task), 'A* (h_max, delayed evaluation)' )
+                else :
+                        solve_heuristic( task, search.astar_search, H_Max(task), 'A* (h_max)' )
         elif configuration == 'a_star_hplus' :
                 hplus = H_Plus(task)
                 hplus.compute_pref_ops = False
-                solve_heuristic( task, search.astar_search, hplus, 'A* (h+)')
+                if delayed_evaluation :
+                        solve_heuristic( task, search.lazy_astar_search, hplus, 'A* (h+, delayed evaluation)')
+                else :
+                        solve_heuristic( task, search.astar_search, hplus, 'A* (h+)')
+                hplus.print_statistics()
+
+        elif configuration == 'a_star_lmcut' :
+                lmcut = H_LMCut(task)
+                if delayed_evaluation :
+                        solve_heuristic( task, search.lazy_astar_search, lmcut, 'A* (LM-cut, delayed evaluation)' )
+                else :
+                        solve_heuristic( task, search.astar_search, lmcut, 'A* (LM-cut)' )
+                lmcut.print_statistics()
+
+        elif configuration == 'wa_star_hplus' :
+                hplus = H_Plus(task)
+                hplus.compute_pref_ops = False
+                solve_heuristic( task, search.weighted_astar_search, hplus, 'WA* (h+)' )
                 hplus.print_statistics()
 
+        elif configuration == 'anytime_wa_star_hmax' :
+                solve_anytime( task, search.anytime_weighted_astar_search, H_Max(task), 'Anytime WA* (h_max)' )
+
+        elif configuration == 'anytime_wa_star_hplus' :
+                hplus = H_Plus(task)
+                hplus.compute_pref_ops = False
+                solve_anytime( task, search.anytime_weighted_astar_search, hplus, 'Anytime WA* (h+)' )
+                hplus.print_statistics()
+
+        elif configuration == 'anytime_wa_star_lmcut' :
+                lmcut = H_LMCut(task)
+                solve_anytime( task, search.anytime_weighted_astar_search, lmcut, 'Anytime WA* (LM-cut)' )
+                lmcut.print_statistics()
+
+        elif configuration == 'delayed_eval_gbfs_hplus' :
+                hplus = H_Plus(task)
+                hplus.compute_pref_ops = False
+                solve_heuristic( task, search.lazy_greedy_best_first_search, hplus, 'GBFS (h+, delayed evaluation)')
+                hplus.print_statistics()
+
+        elif configuration == 'ppa_star_lmcut' :
+                lmcut = H_LMCut(task)
+                lmcut.compute_pref_ops = True
+                solve_heuristic( task, search.pref_partial_astar_search, lmcut, 'Pref. Partial A* (LM-cut)' )
+                lmcut.print_statistics()
+
+        elif configuration == 'hda_star_hmax' :
+                solve_heuristic( task, search.hda_star_search, H_Max(task), 'HDA* (h_max)' )
+
+        elif configuration == 'hda_star_hplus' :
+                hplus = H_Plus(task)
+                hplus.compute_pref_ops = False
+                solve_heuristic( task, search.hda_star_search, hplus, 'HDA* (h+)' )
+
+        elif configuration == 'hda_star_lmcut' :
+                solve_heuristic( task, search.hda_star_search, H_LMCut(task), 'HDA* (LM-cut)' )
+
         elif configuration == 'ppa_star_hmax' :
                 h = H_Max( task ) 
                 solve_heuristic( task, search.pref_partial_astar_search, h, 'Pref. Partial A* (h_max)' )
@@ -133,12 +241,12 @@ def solve( configuration, task ) :
 
         elif configuration == 'ppa_star_pdb_haslum_aaai07' :
                 from heuristics.pdb.haslum_aaai07 import iPDB
-                pdb_h = iPDB( task, 10000 )
+                pdb_h = iPDB( task )
                 #pdb_h.evaluate( task.s0.primary, True )
                 solve_heuristic( task, search.pref_partial_astar_search, pdb_h, 'Pref. Partial A* (Haslum, 2007)' )
         elif configuration == 'a_star_pdb_haslum_aaai07' :
                 from heuristics.pdb.haslum_aaai07 import iPDB
-                pdb_h = iPDB( task, 10000 )
+                pdb_h = iPDB( task )
                 solve_heuristic( task, search.astar_search, pdb_h, 'A* (Haslum, 2007)' )
         elif configuration == 'ppa_star_hplus' :
                 hplus = H_Plus(task)
@@ -148,47 +256,30 @@ def solve( configuration, task ) :
                 else :
                         solve_heuristic( task, search.pref_partial_astar_search, hplus, 'Pref. Partial A* (h+)')        
                 hplus.print_statistics()
-                #logging.info( '# Calls to optimize(): {0} Total Time: {1}'.format( HybridState.calls_to_optimize, HybridState.total_time_optimize) )
-                #logging.info( '# Models created: {0} Total Time: {1}'.format( HybridState.models_created, HybridState.total_time_model_building ) )
 
         elif configuration == 'ppa_star_hplus_r1' :
-                from model.generic.hybrid.state import HybridState
                 from heuristics.simple_rpg import RelaxedPlanningGraph
                 RelaxedPlanningGraph.meticulous = True
                 hplus = H_Plus(task)
                 hplus.compute_pref_ops = True
                 solve_heuristic( task, search.pref_partial_astar_search, hplus, 'Pref. Partial A* (h+)')        
                 hplus.print_statistics()
-                #logging.info( '# Calls to optimize(): {0} Total Time: {1}'.format( HybridState.calls_to_optimize, HybridState.total_time_optimize) )
-                #logging.info( '# Models created: {0} Total Time: {1}'.format( HybridState.models_created, HybridState.total_time_model_building ) )
         #
         elif configuration == 'ppa_star_pdb_haslum_aaai07_ngl' :
                 from heuristics.pdb.haslum_aaai07 import iPDB
-                pdb_h = iPDB( task, 10000 )
+                pdb_h = iPDB( task )
                 solve_heuristic( task, search.pref_partial_astar_search, pdb_h, 'Pref. Partial A* (Haslum, 2007)', task.compute_successor_state_ngl )
                 logging.info( 'No Good Learning: # Conflicts: {0}'.format( task.num_conflicts ) ) 
                 logging.info( 'No Good Learning: # Pruned: {0}'.format( task.pruned_ngl ) )
-                ng_lens = [ len(ng) for ng in task.no_good_list ]
-                if len(ng_lens) == 0 :
-                        biggest_no_good = smallest_no_good = 0
-                else :
-                        biggest_no_good = max( ng_lens )
-                        smallest_no_good = min( ng_lens )
-                logging.info( 'No Good Learning: # Lits in Biggest No Good {0} # Lits in Smallest No Good {1}'.format( biggest_no_good, smallest_no_good ) ) 
+                task.no_goods.print_statistics()
         elif configuration == 'ppa_star_pdb_haslum_aaai07_ngl2' :
                 from heuristics.pdb.haslum_aaai07 import iPDB
-                pdb_h = iPDB( task, 10000 )
+                pdb_h = iPDB( task )
                 solve_heuristic( task, search.pref_partial_astar_search, pdb_h, 'Pref. Partial A* (Haslum, 2007)', task.compute_successor_state_ngl2 )
 
                 logging.info( 'No Good Learning: # Conflicts: {0}'.format( task.num_conflicts ) ) 
                 logging.info( 'No Good Learning: # Pruned: {0}'.format( task.pruned_ngl ) )
-                ng_lens = [ len(ng[0]) for ng in task.no_good_list ]
-                if len(ng_lens) == 0 :
-                        biggest_no_good = smallest_no_good = 0
-                else :
-                        biggest_no_good = max( ng_lens )
-                        smallest_no_good = min( ng_lens )
-                logging.info( 'No Good Learning: # Lits in Biggest No Good {0} # Lits in Smallest No Good {1}'.format( biggest_no_good, smallest_no_good ) ) 
+                task.no_goods.print_statistics()
 
         elif configuration == 'ppa_star_hplus_ngl' :
                 hplus = H_Plus(task)
@@ -197,13 +288,7 @@ def solve( configuration, task ) :
                 hplus.print_statistics()        
                 logging.info( 'No Good Learning: # Conflicts: {0}'.format( task.num_conflicts ) ) 
                 logging.info( 'No Good Learning: # Pruned: {0}'.format( task.pruned_ngl ) )
-                ng_lens = [ len(ng) for ng in task.no_good_list ]
-                if len(ng_lens) == 0 :
-                        biggest_no_good = smallest_no_good = 0
-                else :
-                        biggest_no_good = max( ng_lens )
-                        smallest_no_good = min( ng_lens )
-                logging.info( 'No Good Learning: # Lits in Biggest No Good {0} # Lits in Smallest No Good {1}'.format( biggest_no_good, smallest_no_good ) ) 
+                task.no_goods.print_statistics()
         elif configuration == 'ppa_star_hplus_ngl2' :
                 hplus = H_Plus(task)
                 hplus.compute_pref_ops = True
@@ -214,13 +299,7 @@ def solve( configuration, task ) :
                 hplus.print_statistics()
                 logging.info( 'No Good Learning: # Conflicts: {0}'.format( task.num_conflicts ) ) 
                 logging.info( 'No Good Learning: # Pruned: {0}'.format( task.pruned_ngl ) )
-                ng_lens = [ len(ng[0]) for ng in task.no_good_list ]
-                if len(ng_lens) == 0 :
-                        biggest_no_good = smallest_no_good = 0
-                else :
-                        biggest_no_good = max( ng_lens )
-                        smallest_no_good = min( ng_lens )
-                logging.info( 'No Good Learning: # Lits in Biggest No Good {0} # Lits in Smallest No Good {1}'.format( biggest_no_good, smallest_no_good ) ) 
+                task.no_goods.print_statistics()
         elif configuration == 'restarting_ppa_star_hplus' :
                 hplus = H_Plus(task)
                 hplus.compute_pref_ops = True
@@ -228,7 +307,8 @@ def solve( configuration, task ) :
                 hplus.print_statistics()        
                 logging.info( 'No Good Learning: # Conflicts: {0}'.format( task.num_conflicts ) ) 
                 logging.info( 'No Good Learning: # Actions Added: {0}'.format( task.num_actions_added ) )
-        from model.generic.hybrid.state import HybridState
-        logging.info( '# Calls to optimize(): {0} Total Time: {1}'.format( HybridState.calls_to_optimize, HybridState.total_time_optimize) )
-        logging.info( '# Models created: {0} Total Time: {1}'.format( HybridState.models_created, HybridState.total_time_model_building ) )
+        from model.generic.hybrid.secondary import SecondaryModel
+        SecondaryModel.print_statistics()
+        from model.generic.hybrid.task import HybridTask
+        HybridTask.print_check_statistics()
 